@@ -5,7 +5,18 @@ from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import Update
 
 from config import TOKEN
+from database import async_engine
+from message_cache import (
+    preload_templates,
+    start_templates_listener,
+    stop_templates_listener,
+)
+from matching_engine import load_engine
+from recommendations import start_recommendations_job, stop_recommendations_job
+from choice_buffer import start_choice_buffer, stop_choice_buffer
+from outbox import start_outbox_worker, stop_outbox_worker, wake_outbox_worker
 from router import all_routers
+from throttling import setup_outbound_queue
 
 # ==========================
 # URL вебхука (Telegram → наш сервер)
@@ -18,6 +29,9 @@ WEBHOOK_URL = os.getenv("WEBHOOK_URL")
 # ==========================
 bot = Bot(token=TOKEN)
 
+# Усі вихідні повідомлення (з усіх роутерів) — через чергу з лімітами Telegram
+setup_outbound_queue(bot)
+
 # Пам'яткова FSM (тримання станів у RAM)
 # У продакшені можна замінити на RedisStorage
 dp = Dispatcher(storage=MemoryStorage())
@@ -42,10 +56,36 @@ async def healthcheck():
 
 # ==========================
 # Подія запуску FastAPI
-# Встановлюємо вебхук для Telegram
+# Прогріваємо кеш текстів і встановлюємо вебхук для Telegram
 # ==========================
 @app.on_event("startup")
 async def on_startup():
+    # Тексти бота (BotMessages) тягнемо в памʼять одним запитом
+    loaded = preload_templates()
+    print(f"✅ Завантажено текстів бота: {loaded}")
+
+    # Слухаємо NOTIFY від тригера на BotMessages, щоб кеш оновлювався
+    # одразу після редагування тексту (в усіх репліках)
+    try:
+        await start_templates_listener()
+    except Exception as e:
+        # Без слухача кеш усе одно оновиться по TTL
+        print(f"⚠ Слухач змін BotMessages не запущений: {e}")
+
+    # In-memory індекси пошуку кандидатів (лише якщо MATCHING_ENGINE=memory)
+    indexed = load_engine()
+    if indexed:
+        print(f"✅ Рушій пошуку завантажив анкет: {indexed}")
+
+    # Фоновий перерахунок Recommendations (лише якщо MATCHING_ENGINE=precomputed)
+    start_recommendations_job()
+
+    # Пакетний запис лайків / дизлайків (лише якщо CHOICE_BUFFER_FLUSH_MS > 0)
+    start_choice_buffer(wake_outbox_worker)
+
+    # Розсилка сповіщень про метчі з NotificationOutbox
+    start_outbox_worker(bot)
+
     if WEBHOOK_URL:
         # Встановлюємо Telegram → наш сервер (webhook)
         await bot.set_webhook(WEBHOOK_URL, drop_pending_updates=True)
@@ -60,6 +100,12 @@ async def on_startup():
 # ==========================
 @app.on_event("shutdown")
 async def on_shutdown():
+    stop_templates_listener()
+    stop_recommendations_job()
+    # Дописуємо в БД вибори, що ще лежать у буфері
+    await stop_choice_buffer()
+    stop_outbox_worker()
+    await async_engine.dispose()
     await bot.session.close()
 
 
@@ -0,0 +1,334 @@
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest, TelegramNotFound
+from sqlalchemy import exists, select, update
+
+from config import (
+    TOKEN,
+    TELEGRAM_GLOBAL_RATE,
+    BROADCAST_CHUNK_SIZE,
+    BROADCAST_RATE,
+    BROADCAST_BOT_MIN_RATE,
+    BROADCAST_WATCH_INTERVAL,
+    BROADCAST_ACTIVE_TIMEOUT,
+)
+from database import engine, async_engine, SessionLocal, AsyncSessionLocal, User, BroadcastCheckpoint
+from function import render_bot_message
+from message_cache import get_template
+from throttling import setup_outbound_queue, set_global_rate
+
+
+# ==========================
+# МАСОВА РОЗСИЛКА (BotMessage усім користувачкам)
+# ==========================
+# Запуск:
+#   python broadcast.py <ключ BotMessage> [--name назва] [--restart]
+#
+# - Отримувачів читаємо пачками по BROADCAST_CHUNK_SIZE у порядку telegram_id:
+#   на кожну пачку — окремий короткий keyset-запит (telegram_id > останній
+#   LIMIT n), тож жодне зʼєднання / транзакція не висить усю розсилку.
+# - Ключ BotMessage перевіряємо до старту: якщо тексту немає — нічого не шлемо.
+# - Скрипт — окремий процес з власною чергою вихідних (throttling.py), яка
+#   не бачить черги бота. Розсилка шле зі швидкістю BROADCAST_RATE, а бот,
+#   поки бачить активну розсилку (start_broadcast_watch), знижує свою до
+#   TELEGRAM_GLOBAL_RATE - BROADCAST_RATE; разом вони вкладаються в ліміт
+#   Telegram. Тобто на час розсилки бот відповідає повільніше — швидкості
+#   ділимо через BROADCAST_RATE. Повтор після 429 — як у бота.
+# - Після кожної пачки — чекпоінт у BroadcastCheckpoints. Повторний запуск
+#   з тією ж назвою продовжує з last_user_id; --restart — почати спочатку.
+# - Хто заблокував бота (TelegramForbiddenError) — позначаємо Users.blocked_at
+#   і в наступних розсилках пропускаємо.
+# - Тимчасові помилки (429 після усіх повторів, мережа, 5xx) — id у
+#   failed_ids чекпоінта; наприкінці розсилка досилає їм ще раз. Хто й тоді
+#   не отримав — лишається в failed_ids, і розсилка не завершена, доки
+#   повторний запуск з тією ж назвою не дошле.
+
+
+def _load_checkpoint(name: str, message_key: str, restart: bool) -> BroadcastCheckpoint:
+    """
+    Чекпоінт розсилки: існуючий (продовжуємо) або новий.
+    """
+    session = SessionLocal()
+    try:
+        checkpoint = session.get(BroadcastCheckpoint, name)
+        if checkpoint is None or restart:
+            if checkpoint is not None:
+                session.delete(checkpoint)
+                session.flush()
+            checkpoint = BroadcastCheckpoint(name=name, message_key=message_key)
+            session.add(checkpoint)
+        elif checkpoint.finished_at is None:
+            # Продовжуємо — свіжий updated_at, щоб бот одразу побачив активну розсилку
+            checkpoint.updated_at = datetime.utcnow()
+        session.commit()
+        session.refresh(checkpoint)
+        session.expunge(checkpoint)
+        return checkpoint
+    finally:
+        session.close()
+
+
+def _save_checkpoint(
+    name: str,
+    last_user_id: int | None,
+    sent: int,
+    blocked: list[int],
+    failed: int,
+    failed_ids: list[int],
+) -> None:
+    """
+    Фіксує оброблену пачку: зсуває курсор, додає лічильники, записує
+    актуальний список failed_ids і позначає тих, хто заблокував бота —
+    в одній транзакції.
+    """
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        if blocked:
+            conn.execute(
+                update(User)
+                .where(User.telegram_id.in_(blocked))
+                .values(blocked_at=now)
+            )
+        conn.execute(
+            update(BroadcastCheckpoint)
+            .where(BroadcastCheckpoint.name == name)
+            .values(
+                last_user_id=last_user_id,
+                sent=BroadcastCheckpoint.sent + sent,
+                blocked=BroadcastCheckpoint.blocked + len(blocked),
+                failed=BroadcastCheckpoint.failed + failed,
+                failed_ids=failed_ids,
+                updated_at=now,
+            )
+        )
+
+
+def _finish_checkpoint(name: str) -> None:
+    with engine.begin() as conn:
+        conn.execute(
+            update(BroadcastCheckpoint)
+            .where(BroadcastCheckpoint.name == name)
+            .values(finished_at=datetime.utcnow())
+        )
+
+
+async def _send_chunk(bot: Bot, chat_ids: list[int], text: str) -> tuple[int, list[int], int, list[int]]:
+    """
+    Надсилає пачку паралельно (темп задає черга вихідних).
+
+    Повертає:
+        (надіслано, id тих, хто заблокував бота,
+         остаточні помилки, id з тимчасовою помилкою — їм треба дослати)
+    """
+    results = await asyncio.gather(
+        *[
+            bot.send_message(
+                chat_id=chat_id,
+                text=text,
+                parse_mode="HTML",
+                disable_web_page_preview=True,
+            )
+            for chat_id in chat_ids
+        ],
+        return_exceptions=True,
+    )
+
+    sent, blocked, failed, retry = 0, [], 0, []
+    for chat_id, result in zip(chat_ids, results):
+        if isinstance(result, TelegramForbiddenError):
+            blocked.append(chat_id)
+        elif isinstance(result, (TelegramBadRequest, TelegramNotFound)):
+            # "chat not found" тощо — повтор нічого не змінить
+            failed += 1
+            print(f"⚠ Не вдалося надіслати користувачу {chat_id}: {result}")
+        elif isinstance(result, Exception):
+            retry.append(chat_id)
+            print(f"⚠ Не вдалося надіслати користувачу {chat_id} (дошлемо пізніше): {result}")
+        elif isinstance(result, BaseException):
+            # Зупинка процесу посеред пачки — чекпоінт цієї пачки не пишемо
+            raise result
+        else:
+            sent += 1
+    return sent, blocked, failed, retry
+
+
+async def _next_chunk(after: int | None) -> list[int]:
+    """
+    Наступні BROADCAST_CHUNK_SIZE незаблокованих отримувачів після after
+    (keyset по PK, окрема коротка сесія на кожну пачку).
+    """
+    stmt = (
+        select(User.telegram_id)
+        .where(User.blocked_at.is_(None))
+        .order_by(User.telegram_id)
+        .limit(BROADCAST_CHUNK_SIZE)
+    )
+    if after is not None:
+        stmt = stmt.where(User.telegram_id > after)
+
+    session = AsyncSessionLocal()
+    try:
+        return list(await session.scalars(stmt))
+    finally:
+        await session.close()
+
+
+async def run_broadcast(bot: Bot, message_key: str, name: str | None = None, restart: bool = False) -> None:
+    """
+    Розсилає текст BotMessage(message_key) усім незаблокованим користувачкам,
+    продовжуючи з чекпоінта name (за замовчуванням name = message_key).
+    """
+    name = name or message_key
+    checkpoint = _load_checkpoint(name, message_key, restart)
+    if checkpoint.finished_at is not None:
+        print(f"➖ Розсилку '{name}' вже завершено {checkpoint.finished_at}. Щоб повторити — --restart")
+        return
+
+    session = AsyncSessionLocal()
+    try:
+        # Без шаблону render_bot_message віддав би заглушку "[Текст ... не знайдено]",
+        # і її отримали б усі — тож спершу перевіряємо, що ключ є
+        if await session.run_sync(get_template, message_key, "uk") is None:
+            print(f"❌ У BotMessages немає тексту '{message_key}' (uk) — розсилку скасовано")
+            return
+        text = await render_bot_message(session, message_key, lang="uk")
+    finally:
+        await session.close()
+
+    last_user_id = checkpoint.last_user_id
+    failed_ids = list(checkpoint.failed_ids or [])
+    if last_user_id is not None:
+        print(f"↪ Продовжуємо '{name}' після telegram_id={last_user_id}")
+
+    # Бот помічає розсилку раз на BROADCAST_WATCH_INTERVAL — даємо йому
+    # звільнити частину ліміту, перш ніж слати на повній швидкості
+    await asyncio.sleep(BROADCAST_WATCH_INTERVAL)
+
+    total = checkpoint.sent
+    while True:
+        chat_ids = await _next_chunk(last_user_id)
+        if not chat_ids:
+            break
+
+        sent, blocked, failed, retry = await _send_chunk(bot, chat_ids, text)
+        last_user_id = chat_ids[-1]
+        failed_ids += retry
+        await asyncio.to_thread(
+            _save_checkpoint, name, last_user_id, sent, blocked, failed, failed_ids
+        )
+
+        total += sent
+        print(f"✅ '{name}': надіслано {total} (до telegram_id={last_user_id})")
+
+    # Досилаємо тим, кому не вдалося через тимчасову помилку (один прохід за запуск)
+    if failed_ids:
+        print(f"↻ '{name}': досилаємо {len(failed_ids)} недоставленим")
+        pending, failed_ids = failed_ids, []
+        for start in range(0, len(pending), BROADCAST_CHUNK_SIZE):
+            chat_ids = pending[start:start + BROADCAST_CHUNK_SIZE]
+            sent, blocked, failed, retry = await _send_chunk(bot, chat_ids, text)
+            failed_ids += retry
+            # Ще не оброблені з pending теж лишаються у failed_ids
+            await asyncio.to_thread(
+                _save_checkpoint, name, last_user_id, sent, blocked, failed,
+                failed_ids + pending[start + BROADCAST_CHUNK_SIZE:],
+            )
+            total += sent
+
+    if failed_ids:
+        print(
+            f"⚠ '{name}': надіслано {total}, не доставлено {len(failed_ids)} — "
+            f"повторний запуск з тією ж назвою дошле їм"
+        )
+        return
+
+    await asyncio.to_thread(_finish_checkpoint, name)
+    print(f"🏁 Розсилку '{name}' завершено")
+
+
+# ==========================
+# БОТ: ПОСТУПАЄМОСЯ ЛІМІТОМ НА ЧАС РОЗСИЛКИ
+# ==========================
+
+_watch_task: asyncio.Task | None = None
+
+
+def _broadcast_active() -> bool:
+    """
+    Чи йде зараз розсилка: є незавершений чекпоінт, оновлений за останні
+    BROADCAST_ACTIVE_TIMEOUT сек (впала розсилка перестає бути активною сама).
+    """
+    since = datetime.utcnow() - timedelta(seconds=BROADCAST_ACTIVE_TIMEOUT)
+    with engine.connect() as conn:
+        return conn.execute(
+            select(
+                exists().where(
+                    BroadcastCheckpoint.finished_at.is_(None),
+                    BroadcastCheckpoint.updated_at > since,
+                )
+            )
+        ).scalar()
+
+
+async def _watch_loop() -> None:
+    active = False
+    while True:
+        try:
+            now_active = await asyncio.to_thread(_broadcast_active)
+        except Exception as e:
+            print(f"⚠ Не вдалося перевірити активні розсилки: {e}")
+            now_active = active
+
+        if now_active != active:
+            active = now_active
+            if active:
+                rate = max(TELEGRAM_GLOBAL_RATE - BROADCAST_RATE, BROADCAST_BOT_MIN_RATE)
+                print(f"📣 Йде розсилка — бот шле не швидше {rate}/с")
+            else:
+                rate = TELEGRAM_GLOBAL_RATE
+                print(f"📣 Розсилок немає — бот шле до {rate}/с")
+            set_global_rate(rate)
+
+        await asyncio.sleep(BROADCAST_WATCH_INTERVAL)
+
+
+def start_broadcast_watch() -> None:
+    """
+    Запускає у боті стеження за розсилками. Викликається на старті (main),
+    після setup_outbound_queue.
+    """
+    global _watch_task
+
+    if _watch_task is None:
+        _watch_task = asyncio.get_running_loop().create_task(_watch_loop())
+
+
+def stop_broadcast_watch() -> None:
+    global _watch_task
+
+    task, _watch_task = _watch_task, None
+    if task is not None:
+        task.cancel()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Масова розсилка тексту з BotMessages")
+    parser.add_argument("message_key", help="ключ BotMessage, який розсилаємо")
+    parser.add_argument("--name", help="назва розсилки для чекпоінта (за замовчуванням — ключ)")
+    parser.add_argument("--restart", action="store_true", help="почати спочатку, ігноруючи чекпоінт")
+    args = parser.parse_args()
+
+    bot = Bot(token=TOKEN)
+    setup_outbound_queue(bot, rate=BROADCAST_RATE)
+    try:
+        await run_broadcast(bot, args.message_key, args.name, args.restart)
+    finally:
+        await async_engine.dispose()
+        await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,273 @@
+import asyncio
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import select, update, tuple_, case, func, bindparam, BigInteger
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+
+from config import CHOICE_BUFFER_FLUSH_MS, CHOICE_BUFFER_MAX_ROWS
+from database import engine, Choice, User, Match, NotificationOutbox, choice_pair_lock_key
+
+
+# ==========================
+# WRITE-BEHIND БУФЕР ВИБОРІВ (Choices)
+# ==========================
+# Увімкнено, якщо CHOICE_BUFFER_FLUSH_MS > 0. Тоді дизлайки та лайки без
+# взаємності не комітяться кожен окремо, а збираються в памʼяті процесу
+# і пишуться одним multi-row INSERT раз на CHOICE_BUFFER_FLUSH_MS мс
+# або одразу, щойно набралось CHOICE_BUFFER_MAX_ROWS записів.
+#
+# - Взаємний лайк перевіряється синхронно (function.record_choice) і такий
+#   лайк пишеться в БД одразу, повз буфер.
+# - Поки запис у буфері, пошук кандидатів бачить його (pending_for) —
+#   оцінена анкета не повернеться в чергу.
+# - Зустрічний лайк міг сидіти в буфері (цього чи іншого процесу) — такі
+#   метчі ловимо вже при flush і пишемо в Matches + NotificationOutbox
+#   у тій самій транзакції; сповіщення розсилає outbox.py.
+# - Якщо процес упаде між flush-ами, вибори за останні CHOICE_BUFFER_FLUSH_MS
+#   загубляться (анкету просто покажуть ще раз).
+
+# chooser_id → {chosen_id: (choice_type, created_at)}
+_pending: dict[int, dict[int, tuple[str, datetime]]] = {}
+
+# Те, що саме зараз пишеться в БД (ще не закомічено) — теж видно для пошуку
+_in_flight: dict[int, dict[int, tuple[str, datetime]]] = {}
+
+_size = 0
+_flush_now = asyncio.Event()
+_flush_task: asyncio.Task | None = None
+_on_matches = None
+
+
+def is_enabled() -> bool:
+    return CHOICE_BUFFER_FLUSH_MS > 0
+
+
+def get(chooser_id: int, chosen_id: int) -> str | None:
+    """
+    Тип вибору (LIKE / DISLIKE), якщо він ще в буфері, інакше None.
+    """
+    for buffer in (_pending, _in_flight):
+        entry = buffer.get(chooser_id, {}).get(chosen_id)
+        if entry is not None:
+            return entry[0]
+    return None
+
+
+def pending_for(chooser_id: int) -> set[int]:
+    """
+    Кого ця користувачка вже оцінила, але це ще не записано в БД.
+    """
+    return set(_pending.get(chooser_id, ())) | set(_in_flight.get(chooser_id, ()))
+
+
+def add(chooser_id: int, chosen_id: int, choice_type: str) -> None:
+    """
+    Кладе вибір у буфер. Повторне натискання по тій самій парі ігнорується.
+    """
+    global _size
+
+    if get(chooser_id, chosen_id) is not None:
+        return
+
+    _pending.setdefault(chooser_id, {})[chosen_id] = (choice_type, datetime.utcnow())
+    _size += 1
+    if _size >= CHOICE_BUFFER_MAX_ROWS:
+        _flush_now.set()
+
+
+def _write(rows: list[dict]) -> int:
+    """
+    Один multi-row INSERT ... ON CONFLICT DO NOTHING (синхронно, з потоку)
+    + оновлення лічильників Users.unread_likes для вставлених виборів
+    і запис Matches + NotificationOutbox для нових метчів (ті самі правила,
+    що й у function._insert_choice).
+
+    Спершу — advisory-локи всіх пар пачки (як у function._insert_choice),
+    у порядку ключа, щоб два flush-і не чекали один одного по колу.
+    Зустрічний вибір, що саме зараз комітиться, ми так дочекаємось і
+    побачимо, а не пропустимо метч.
+
+    Повертає:
+        Скільки сповіщень про метч додано в NotificationOutbox.
+    """
+    lock_keys = sorted({choice_pair_lock_key(r["chooser_id"], r["chosen_id"]) for r in rows})
+    pair_keys = (
+        select(func.unnest(bindparam("keys", lock_keys, type_=ARRAY(BigInteger))).label("key"))
+        .order_by("key")
+        .subquery()
+    )
+
+    with engine.begin() as conn:
+        conn.execute(select(func.pg_advisory_xact_lock(pair_keys.c.key))).all()
+
+        inserted = conn.execute(
+            pg_insert(Choice)
+            .values(rows)
+            .on_conflict_do_nothing()
+            .returning(Choice.chooser_id, Choice.chosen_id, Choice.choice_type)
+        ).all()
+        if not inserted:
+            return 0
+
+        new = {(r.chooser_id, r.chosen_id): r.choice_type for r in inserted}
+
+        # Зустрічні вибори (будь-якого типу) для всіх нових пар — по PK
+        reverse = {
+            (r.chosen_id, r.chooser_id): r.choice_type
+            for r in conn.execute(
+                select(Choice.chooser_id, Choice.chosen_id, Choice.choice_type).where(
+                    tuple_(Choice.chooser_id, Choice.chosen_id).in_([(b, a) for a, b in new])
+                )
+            )
+        }
+
+        matches: set[tuple[int, int]] = set()
+        delta: Counter[int] = Counter()
+        for (a, b), choice_type in new.items():
+            reverse_type = reverse.get((a, b))
+            if choice_type == "LIKE" and reverse_type == "LIKE":
+                matches.add((min(a, b), max(a, b)))
+
+            # Обидва вибори пари в цьому ж flush — ніхто нічиєї відповіді не чекав
+            if (b, a) in new:
+                continue
+            if choice_type == "LIKE" and reverse_type is None:
+                delta[b] += 1
+            if reverse_type == "LIKE":
+                delta[a] -= 1
+
+        delta = {telegram_id: d for telegram_id, d in delta.items() if d}
+        if delta:
+            conn.execute(
+                update(User)
+                .where(User.telegram_id.in_(delta))
+                .values(unread_likes=func.greatest(
+                    User.unread_likes + case(delta, value=User.telegram_id, else_=0), 0
+                ))
+            )
+
+        if not matches:
+            return 0
+
+        # Метчі — у ту ж транзакцію, по два симетричні рядки
+        now = datetime.utcnow()
+        new_matches = conn.execute(
+            pg_insert(Match)
+            .values([
+                {"user_id": user_id, "match_id": match_id, "created_at": now}
+                for a, b in sorted(matches)
+                for user_id, match_id in ((a, b), (b, a))
+            ])
+            .on_conflict_do_nothing()
+            .returning(Match.user_id, Match.match_id)
+        ).all()
+        if not new_matches:
+            return 0
+
+        # І сповіщення про них (transactional outbox)
+        return len(conn.execute(
+            pg_insert(NotificationOutbox)
+            .values([
+                {
+                    "kind": "match",
+                    "user_id": r.user_id,
+                    "other_id": r.match_id,
+                    "created_at": now,
+                    "available_at": now,
+                }
+                for r in new_matches
+            ])
+            .on_conflict_do_nothing()
+            .returning(NotificationOutbox.id)
+        ).all())
+
+
+async def flush() -> int:
+    """
+    Записує все, що зараз у буфері. Якщо запис не вдався — повертаємо
+    записи назад у буфер і спробуємо на наступному flush.
+
+    Повертає:
+        Скільки записів відправлено в БД.
+    """
+    global _pending, _in_flight, _size
+
+    if not _pending or _in_flight:
+        return 0
+
+    _in_flight, _pending, _size = _pending, {}, 0
+    rows = [
+        {
+            "chooser_id": chooser_id,
+            "chosen_id": chosen_id,
+            "choice_type": choice_type,
+            "created_at": created_at,
+        }
+        for chooser_id, chosen in _in_flight.items()
+        for chosen_id, (choice_type, created_at) in chosen.items()
+    ]
+
+    try:
+        notifications = await asyncio.to_thread(_write, rows)
+    except Exception as e:
+        print(f"⚠ Не вдалося записати буфер виборів ({len(rows)} шт.): {e}")
+        for chooser_id, chosen in _in_flight.items():
+            for chosen_id, entry in chosen.items():
+                if chosen_id not in _pending.get(chooser_id, {}):
+                    _pending.setdefault(chooser_id, {})[chosen_id] = entry
+                    _size += 1
+        return 0
+    finally:
+        _in_flight = {}
+
+    # Нові сповіщення про метчі — будимо воркер outbox, не чекаючи його опитування
+    if notifications and _on_matches is not None:
+        _on_matches()
+
+    return len(rows)
+
+
+async def _flush_loop() -> None:
+    while True:
+        try:
+            await asyncio.wait_for(_flush_now.wait(), CHOICE_BUFFER_FLUSH_MS / 1000)
+        except asyncio.TimeoutError:
+            pass
+        _flush_now.clear()
+        await flush()
+
+
+def start_choice_buffer(on_matches=None) -> None:
+    """
+    Запускає періодичний flush (якщо буфер увімкнено).
+
+    on_matches — функція без аргументів, яку кличемо, коли flush записав
+    нові сповіщення про метчі (outbox.wake_outbox_worker).
+    Викликається на старті (bot_app / main).
+    """
+    global _flush_task, _on_matches
+
+    if not is_enabled() or _flush_task is not None:
+        return
+
+    _on_matches = on_matches
+    _flush_task = asyncio.get_running_loop().create_task(_flush_loop())
+
+
+async def stop_choice_buffer() -> None:
+    """
+    Зупиняє flush-цикл і дописує в БД усе, що лишилось у буфері.
+    """
+    global _flush_task
+
+    task, _flush_task = _flush_task, None
+    if task is None:
+        return
+
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    await flush()
@@ -0,0 +1,145 @@
+import bisect
+import time
+
+from sqlalchemy import select, exists, func, bindparam, BigInteger
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import Session
+
+from config import COHORT_CACHE_TTL
+from database import User, Choice
+
+
+# ==========================
+# СПІЛЬНІ СПИСКИ АНКЕТ МІСТА / СЕЛА
+# ==========================
+# Усі мами з одного міста за критерієм "location" отримують той самий базовий
+# список — різняться лише тим, кого вже оцінили. Тож список id когорти
+# (region, city/village) читаємо з БД один раз на COHORT_CACHE_TTL і ділимо
+# між усіма, а особисті виключення накладаємо поверх.
+#
+# Кеш — у памʼяті процесу. Зміни анкет у цьому процесі скидають когорту одразу
+# (on_profile_changed), зміни з інших реплік — по TTL. Прострочені когорти
+# викидаємо при наступному завантаженні, тож кеш не росте без меж.
+
+# Ключ — ("city" | "village", region, назва), значення — (відсортовані id, час завантаження)
+_cohorts: dict[tuple[str, str, str], tuple[list[int], float]] = {}
+
+# Одне вікно перевірки оцінених — limit * _WINDOW_FACTOR id когорти,
+# і не більше _MAX_WINDOWS вікон (запитів) на сторінку
+_WINDOW_FACTOR = 4
+_MAX_WINDOWS = 2
+
+
+def _cohort_key(region: str | None, city: str | None, village: str | None):
+    """
+    Ключ когорти для місця проживання, або None, якщо місце не вказане.
+    """
+    if not region:
+        return None
+    if city:
+        return ("city", region, city)
+    if village:
+        return ("village", region, village)
+    return None
+
+
+def _load_cohort(session: Session, key: tuple[str, str, str]) -> list[int]:
+    """
+    Повертає id усіх анкет когорти (за зростанням telegram_id) — з кешу або
+    одним запитом по індексу ix_users_region_city / ix_users_region_village.
+    """
+    now = time.monotonic()
+    cached = _cohorts.get(key)
+    if cached is not None and now - cached[1] < COHORT_CACHE_TTL:
+        return cached[0]
+
+    for stale in [k for k, (_, loaded) in _cohorts.items() if now - loaded >= COHORT_CACHE_TTL]:
+        del _cohorts[stale]
+
+    kind, region, place = key
+    column = User.city if kind == "city" else User.village
+    ids = list(session.scalars(
+        select(User.telegram_id)
+        .where(User.region == region, column == place)
+        .order_by(User.telegram_id)
+    ))
+
+    _cohorts[key] = (ids, now)
+    return ids
+
+
+def find_location_page(
+    session: Session,
+    me: User,
+    limit: int,
+    after: int | None = None,
+) -> tuple[list[int], int | None] | None:
+    """
+    Критерій "location" через спільний список когорти: наступні limit id після
+    курсора after (у порядку telegram_id), без себе та вже оцінених.
+
+    Список когорти гортаємо в памʼяті, а оцінених перевіряємо лише для
+    обмеженого вікна (limit * _WINDOW_FACTOR id): anti-join unnest(вікно)
+    NOT EXISTS у Choices по PK пари. Якщо за _MAX_WINDOWS вікон сторінка не
+    набралась (анкету вже оцінила більшість міста), повертаємо None —
+    function._find_candidate_page тоді добере її індексованим SQL-запитом.
+
+    Повертає:
+        (список id, курсор — id останнього або None) або None (див. вище)
+    """
+    key = _cohort_key(me.region, me.city, me.village)
+    if key is None:
+        return [], None
+
+    ids = _load_cohort(session, key)
+    start = 0 if after is None else bisect.bisect_right(ids, after)
+    window = limit * _WINDOW_FACTOR
+    if start >= len(ids):
+        return [], None
+
+    result: list[int] = []
+    for _ in range(_MAX_WINDOWS):
+        cohort = func.unnest(
+            bindparam("cohort_ids", ids[start:start + window], type_=ARRAY(BigInteger))
+        ).table_valued("telegram_id").render_derived()
+        start += window
+
+        result.extend(session.scalars(
+            select(cohort.c.telegram_id)
+            .where(
+                cohort.c.telegram_id != me.telegram_id,
+                ~exists().where(
+                    Choice.chooser_id == me.telegram_id,
+                    Choice.chosen_id == cohort.c.telegram_id,
+                ),
+            )
+            .order_by(cohort.c.telegram_id)
+            .limit(limit - len(result))
+        ))
+        if len(result) >= limit or start >= len(ids):
+            # Сторінка набрана або когорта закінчилась — що набрали, те й сторінка
+            return result, (result[-1] if result else None)
+
+    return None
+
+
+def invalidate_cohorts() -> None:
+    """
+    Скидає всі когорти (наступна сторінка перечитає список з БД).
+    """
+    _cohorts.clear()
+
+
+def on_profile_changed(user: User) -> None:
+    """
+    Анкету збережено / змінено місце: скидаємо її нову когорту і ту, де
+    вона була раніше (шукаємо її id у закешованих списках — bisect).
+    """
+    stale = {_cohort_key(user.region, user.city, user.village)} - {None}
+    for key, (ids, _) in _cohorts.items():
+        pos = bisect.bisect_left(ids, user.telegram_id)
+        if pos < len(ids) and ids[pos] == user.telegram_id:
+            stale.add(key)
+
+    for key in stale:
+        _cohorts.pop(key, None)
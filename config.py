@@ -40,6 +40,9 @@ STATUS_OPTIONS = [
 # ==========================
 # Інтереси для анкети (вибір користувачки)
 # ==========================
+# ⚠️ Порядок важливий: індекс інтересу = номер біту в Users.interests_mask.
+# Нові інтереси додаємо лише в кінець, існуючі не переставляємо і не видаляємо
+# (інакше треба перезапустити migrations.py, щоб перерахувати маски).
 INTEREST_OPTIONS = [
     "Грудне вигодовування",
     "Штучне вигодовування",
@@ -49,3 +52,131 @@ INTEREST_OPTIONS = [
     "Онлайн-робота",
     "Фітнес",
 ]
+
+
+# ==========================
+# Кеш текстів бота (BotMessages)
+# ==========================
+# Скільки секунд шаблон живе в памʼяті процесу, перш ніж його перечитаємо з БД.
+# 0 — кеш вимкнено (кожен render_bot_message іде в БД).
+BOT_MESSAGES_CACHE_TTL = int(os.getenv("BOT_MESSAGES_CACHE_TTL", "300"))
+
+
+# ==========================
+# Черга кандидатів у метчингу
+# ==========================
+# Скільки id кандидатів підтягуємо в FSM за один запит
+MATCH_QUEUE_SIZE = int(os.getenv("MATCH_QUEUE_SIZE", "20"))
+
+# Коли в черзі лишається стільки id (або менше) — добираємо наступну порцію у фоні
+MATCH_QUEUE_REFILL_AT = int(os.getenv("MATCH_QUEUE_REFILL_AT", "5"))
+
+# Скільки секунд живе спільний список анкет міста/села (cohort_cache.py) для
+# критерію "location". 0 (за замовчуванням) — кеш вимкнено, кожна сторінка —
+# keyset-запит по ix_users_region_city / ix_users_region_village. Кеш має сенс
+# для одного процесу з дуже гарячими містами; нові анкети з інших реплік
+# він бачить лише через TTL.
+COHORT_CACHE_TTL = int(os.getenv("COHORT_CACHE_TTL", "0"))
+
+# Скільки метчів показуємо на одній сторінці /matches
+MATCHES_PAGE_SIZE = int(os.getenv("MATCHES_PAGE_SIZE", "10"))
+
+# Критерії, де кандидати йдуть за кількістю спільних інтересів (більше — вище),
+# а не просто за telegram_id. Курсор для них — пара [score, telegram_id].
+RANKED_CRITERIA = ("interests", "location_interests")
+
+
+# ==========================
+# Буфер запису лайків / дизлайків (choice_buffer.py)
+# ==========================
+# 0 — кожен вибір комітиться одразу (за замовчуванням).
+# > 0 — дизлайки та лайки без взаємності пишуться пачками раз на стільки мс
+#       або коли набереться CHOICE_BUFFER_MAX_ROWS записів.
+CHOICE_BUFFER_FLUSH_MS = int(os.getenv("CHOICE_BUFFER_FLUSH_MS", "0"))
+CHOICE_BUFFER_MAX_ROWS = int(os.getenv("CHOICE_BUFFER_MAX_ROWS", "500"))
+
+
+# ==========================
+# Ліміти Telegram Bot API (черга вихідних повідомлень, throttling.py)
+# ==========================
+# Скільки повідомлень на секунду бот шле загалом (ліміт Telegram — ~30/с).
+# Поки йде розсилка (broadcast.py), бот сам знижує швидкість до
+# TELEGRAM_GLOBAL_RATE - BROADCAST_RATE — див. BROADCAST_* нижче
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+
+# Мінімальний інтервал (сек) між повідомленнями в один чат (ліміт — ~1/с)
+TELEGRAM_CHAT_INTERVAL = float(os.getenv("TELEGRAM_CHAT_INTERVAL", "1"))
+
+# Скільки повідомлень поспіль можна надіслати в один чат без паузи
+# (наприклад, відповідь + підказка), далі — по TELEGRAM_CHAT_INTERVAL
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+
+# Скільки разів повторюємо відправку після 429 (TelegramRetryAfter)
+TELEGRAM_SEND_RETRIES = int(os.getenv("TELEGRAM_SEND_RETRIES", "3"))
+
+# 429 в окремому чаті гальмує лише цей чат. Усю відправку призупиняємо,
+# лише коли 429 прийшли щонайменше з TELEGRAM_FLOOD_CHATS різних чатів
+# за TELEGRAM_FLOOD_WINDOW сек — тоді це глобальний ліміт бота
+TELEGRAM_FLOOD_CHATS = int(os.getenv("TELEGRAM_FLOOD_CHATS", "3"))
+TELEGRAM_FLOOD_WINDOW = float(os.getenv("TELEGRAM_FLOOD_WINDOW", "1"))
+
+
+# ==========================
+# Черга сповіщень про метчі (NotificationOutbox, outbox.py)
+# ==========================
+# Скільки сповіщень воркер бере з таблиці за раз
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+
+# Як часто (сек) воркер перевіряє таблицю, якщо його не розбудили раніше
+# (сповіщення з інших реплік / після перезапуску)
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "2"))
+
+# На скільки секунд рядок "бронюється" за воркером, поки той надсилає.
+# Якщо процес впаде посеред відправки — після цього рядок візьме інший
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "60"))
+
+# Скільки спроб надіслати, перш ніж здатись (пауза між спробами росте вдвічі)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_RETRY_DELAY = int(os.getenv("OUTBOX_RETRY_DELAY", "10"))
+
+
+# ==========================
+# Масові розсилки (broadcast.py)
+# ==========================
+# Скільки id отримувачів читаємо з курсора за раз і надсилаємо між чекпоінтами.
+# Після падіння повторно можуть піти максимум стільки повідомлень
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "500"))
+
+# Швидкість розсилки (повідомлень/с). Процеси не бачать черг один одного,
+# тож на час розсилки бот віддає їй цю частину свого TELEGRAM_GLOBAL_RATE:
+# при 30 / 25 бот, поки триває розсилка, відповідає зі швидкістю 5/с
+# (але не менше BROADCAST_BOT_MIN_RATE). Без розсилки бот шле на повну
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_BOT_MIN_RATE = float(os.getenv("BROADCAST_BOT_MIN_RATE", "1"))
+
+# Як часто бот перевіряє BroadcastCheckpoints (сек) і скільки сек після
+# останнього чекпоінта розсилка ще вважається активною. Чекпоінт пишеться
+# раз на пачку (BROADCAST_CHUNK_SIZE / BROADCAST_RATE ≈ 20 с), тож таймаут
+# має бути помітно довшим; впала розсилка — за таймаут бот повертає швидкість
+BROADCAST_WATCH_INTERVAL = float(os.getenv("BROADCAST_WATCH_INTERVAL", "10"))
+BROADCAST_ACTIVE_TIMEOUT = float(os.getenv("BROADCAST_ACTIVE_TIMEOUT", "120"))
+
+
+# ==========================
+# Рушій пошуку кандидатів
+# ==========================
+# "sql"    — кожен пошук іде запитом у PostgreSQL (за замовчуванням);
+# "memory" — індекси анкет тримаються в памʼяті процесу (matching_engine.py),
+#            пошук без запитів у БД. Лише для одного процесу бота!
+# "precomputed" — кандидати заздалегідь пораховані фоновою задачею
+#            в таблиці Recommendations (recommendations.py), свайп лише читає її.
+MATCHING_ENGINE = os.getenv("MATCHING_ENGINE", "sql")
+
+# Для MATCHING_ENGINE=precomputed: скільки кандидатів на критерій зберігати
+# для кожної користувачки і як часто (сек) повністю перераховувати таблицю
+RECOMMENDATIONS_PER_USER = int(os.getenv("RECOMMENDATIONS_PER_USER", "500"))
+RECOMMENDATIONS_REFRESH_INTERVAL = int(os.getenv("RECOMMENDATIONS_REFRESH_INTERVAL", "900"))
+
+# Повний перерахунок іде пачками по стільки анкет — кожна пачка в окремій
+# короткій транзакції (лок на запис і WAL на транзакцію обмежені)
+RECOMMENDATIONS_REFRESH_BATCH = int(os.getenv("RECOMMENDATIONS_REFRESH_BATCH", "200"))
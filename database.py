@@ -5,14 +5,20 @@ from sqlalchemy import (
     BigInteger,
     String,
     Text,
-    JSON,
     TIMESTAMP,
     ForeignKey,
     CheckConstraint,
     UniqueConstraint,
+    Index,
+    inspect,
+    text,
 )
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
 from datetime import datetime
+import hashlib
 from config import DATABASE_URL
 
 
@@ -37,8 +43,24 @@ engine = create_engine(
 )
 
 # Фабрика сесій — будемо її використовувати у коді (SessionLocal()).
+# Синхронні сесії лишаються для фонових задач у потоках (choice_buffer,
+# outbox, recommendations), міграцій і скриптів.
 SessionLocal = sessionmaker(bind=engine)
 
+# Асинхронний engine для хендлерів: та сама БД через asyncpg, запити не
+# блокують event loop. URL той самий, міняємо лише драйвер.
+async_engine = create_async_engine(
+    make_url(DATABASE_URL).set(drivername="postgresql+asyncpg"),
+    pool_pre_ping=True,
+    pool_size=5,
+    max_overflow=10,
+)
+
+# Фабрика async-сесій (AsyncSessionLocal()) для роутерів.
+# expire_on_commit=False — після commit атрибути моделей лишаються доступними
+# без прихованого запиту (в async-сесії неявний lazy load неможливий).
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
 # Базовий клас для всіх моделей
 Base = declarative_base()
 
@@ -59,7 +81,10 @@ class User(Base):
       (місто й село взаємовиключні; logіку забезпечуємо на рівні коду).
     - age — вік.
     - status — статус мами (не плутати з внутрішнім статусом, краще потім перейменувати).
-    - interests — JSON-масив інтересів (список рядків).
+    - interests — JSONB-масив інтересів (список рядків).
+    - interests_mask — ті ж інтереси як бітова маска (біт i = INTEREST_OPTIONS[i]).
+    - unread_likes — скільки мам лайкнули її, а вона їх ще не оцінила (для /likes).
+    - blocked_at — коли розсилка побачила, що бот заблокований (NULL — не заблокований).
     - bio — опис про себе.
 
     Також є 2 зв'язки:
@@ -68,6 +93,13 @@ class User(Base):
     """
 
     __tablename__ = "Users"
+    __table_args__ = (
+        # Пошук кандидатів за місцем / статусом. telegram_id в кінці індексу —
+        # щоб ORDER BY telegram_id + keyset-курсор + LIMIT теж ішли по індексу
+        Index("ix_users_region_city", "region", "city", "telegram_id"),
+        Index("ix_users_region_village", "region", "village", "telegram_id"),
+        Index("ix_users_status", "status", "telegram_id"),
+    )
 
     # Telegram ID як первинний ключ (BigInteger, бо Telegram дає великі ID)
     telegram_id = Column(BigInteger, primary_key=True)
@@ -97,8 +129,20 @@ class User(Base):
     # Зараз тут стоїть default="active" — можна потім змінити, якщо захочеш тримати інший формат.
     status = Column(String(50), default="active")
 
-    # Інтереси у форматі JSON (список рядків)
-    interests = Column(JSON)
+    # Інтереси у форматі JSONB (список рядків)
+    interests = Column(JSONB)
+
+    # Ті самі інтереси бітовою маскою (див. function.interests_to_mask).
+    # Спільний інтерес = (interests_mask & моя_маска) <> 0 — без розбору JSON.
+    interests_mask = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+    # Лічильник вхідних лайків без відповіді. Оновлюється разом із записом
+    # вибору (function.record_choice / choice_buffer), а не COUNT(*) по Choices
+    unread_likes = Column(Integer, nullable=False, default=0, server_default="0")
+
+    # Бот заблокований користувачкою (TelegramForbiddenError під час розсилки).
+    # Такі анкети розсилки пропускають; скидається, коли вона знову пише /start
+    blocked_at = Column(TIMESTAMP)
 
     # Короткий опис (BIO)
     bio = Column(Text)
@@ -134,6 +178,7 @@ class Choice(Base):
     - UniqueConstraint(chooser_id, chosen_id) — один користувач може один раз оцінити іншого
       (але ми можемо змінити choice_type з LIKE на DISLIKE і навпаки).
     - CheckConstraint(choice_type IN ('LIKE','DISLIKE')) — захист від некоректних значень.
+    - ix_choices_incoming_likes — частковий індекс (chosen_id, chooser_id) лише по LIKE.
     """
 
     __tablename__ = "Choices"
@@ -142,6 +187,14 @@ class Choice(Base):
         UniqueConstraint("chooser_id", "chosen_id", name="uix_chooser_chosen"),
         # choice_type може бути тільки LIKE або DISLIKE
         CheckConstraint("choice_type IN ('LIKE','DISLIKE')", name="chk_choice_type"),
+        # Вхідні лайки ("хто лайкнув мене", перевірка взаємного лайку):
+        # index-only scan по chosen_id без читання самої таблиці
+        Index(
+            "ix_choices_incoming_likes",
+            "chosen_id",
+            "chooser_id",
+            postgresql_where=text("choice_type = 'LIKE'"),
+        ),
     )
 
     # Хто обрав (foreign key на Users.telegram_id)
@@ -179,6 +232,212 @@ class Choice(Base):
     )
 
 
+def choice_pair_lock_key(a: int, b: int) -> int:
+    """
+    Ключ pg_advisory_xact_lock для пари анкет (однаковий для a→b і b→a).
+
+    Запис вибору тримає цей лок до коміту, тож два зустрічні лайки, що
+    прийшли одночасно, пишуться по черзі і другий бачить перший
+    (інакше в READ COMMITTED кожен не бачить незакоміченого іншого
+    і метч губиться).
+    """
+    lo, hi = sorted((a, b))
+    digest = hashlib.blake2b(f"{lo}:{hi}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+# ==========================
+# МОДЕЛЬ: метчі (Matches)
+# ==========================
+class Match(Base):
+    """
+    Взаємні лайки (метчі).
+
+    - user_id  — чий це метч.
+    - match_id — з ким.
+    - created_at — коли стався метч.
+
+    Кожен метч — два симетричні рядки (A, B) і (B, A), тож "мої метчі" — це
+    діапазон індексу ix_matches_user_page по user_id, без self-join по Choices.
+    Пишеться в тому ж statement / транзакції, що й другий LIKE пари
+    (function._insert_choice, choice_buffer._write), разом із сповіщеннями
+    в NotificationOutbox.
+    """
+
+    __tablename__ = "Matches"
+
+    user_id = Column(
+        BigInteger,
+        ForeignKey("Users.telegram_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+
+    match_id = Column(
+        BigInteger,
+        ForeignKey("Users.telegram_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+
+    created_at = Column(TIMESTAMP, nullable=False, default=datetime.utcnow)
+
+
+# /matches: спочатку нові — (created_at DESC, match_id DESC) + keyset-курсор
+Index(
+    "ix_matches_user_page",
+    Match.user_id,
+    Match.created_at.desc(),
+    Match.match_id.desc(),
+)
+
+
+# ==========================
+# МОДЕЛЬ: черга сповіщень (NotificationOutbox)
+# ==========================
+class NotificationOutbox(Base):
+    """
+    Transactional outbox: сповіщення, які треба надіслати в Telegram.
+
+    - kind      — тип сповіщення ('match').
+    - user_id   — кому надіслати.
+    - other_id  — про кого (для 'match' — з ким метч).
+    - attempts  — скільки разів уже пробували надіслати.
+    - available_at — раніше цього часу рядок не беремо (повтор / lease воркера).
+    - sent_at   — коли надіслано (або коли припинили спроби); NULL — ще в черзі.
+    - last_error — текст останньої помилки відправки.
+
+    Рядок пишеться в тій самій транзакції, що й метч (function._insert_choice,
+    choice_buffer._write), тож метч не загубиться, навіть якщо процес впаде
+    одразу після коміту. Розсилає outbox.py.
+    """
+
+    __tablename__ = "NotificationOutbox"
+    __table_args__ = (
+        # Одне сповіщення на подію — повторний запис нічого не дублює
+        UniqueConstraint("kind", "user_id", "other_id", name="uix_outbox_event"),
+        # Воркер бере лише ненадіслані — індекс лише по них
+        Index(
+            "ix_outbox_pending",
+            "available_at",
+            "id",
+            postgresql_where=text("sent_at IS NULL"),
+        ),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+
+    kind = Column(String(30), nullable=False)
+
+    user_id = Column(
+        BigInteger,
+        ForeignKey("Users.telegram_id", ondelete="CASCADE"),
+        nullable=False,
+    )
+
+    other_id = Column(
+        BigInteger,
+        ForeignKey("Users.telegram_id", ondelete="CASCADE"),
+        nullable=False,
+    )
+
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+
+    created_at = Column(TIMESTAMP, nullable=False, default=datetime.utcnow)
+
+    available_at = Column(TIMESTAMP, nullable=False, default=datetime.utcnow)
+
+    sent_at = Column(TIMESTAMP)
+
+    last_error = Column(Text)
+
+
+# ==========================
+# МОДЕЛЬ: готові кандидати (Recommendations)
+# ==========================
+class Recommendation(Base):
+    """
+    Заздалегідь пораховані кандидати для MATCHING_ENGINE=precomputed.
+
+    - user_id      — для кого кандидат.
+    - candidate_id — кого показати.
+    - criterion    — критерій пошуку ('location', 'status', 'interests', 'location_interests').
+    - score        — кількість спільних інтересів (для критеріїв без ранжування — 0).
+
+    Наповнюється фоновою задачею та при зміні анкети (див. recommendations.py).
+    Хто вже оцінений — відсіюється при читанні, тож рядки після лайку не чистимо.
+    """
+
+    __tablename__ = "Recommendations"
+
+    user_id = Column(
+        BigInteger,
+        ForeignKey("Users.telegram_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+
+    criterion = Column(String(30), primary_key=True)
+
+    candidate_id = Column(
+        BigInteger,
+        ForeignKey("Users.telegram_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+
+    score = Column(Integer, nullable=False, default=0)
+
+
+# Сторінка кандидатів = діапазон цього індексу в порядку видачі
+# (score DESC, candidate_id ASC) — як у function.find_candidate_page
+Index(
+    "ix_recommendations_page",
+    Recommendation.user_id,
+    Recommendation.criterion,
+    Recommendation.score.desc(),
+    Recommendation.candidate_id,
+)
+
+# Для інкрементального оновлення: "прибрати анкету з усіх чужих списків"
+Index("ix_recommendations_candidate", Recommendation.candidate_id)
+
+
+# ==========================
+# МОДЕЛЬ: прогрес розсилок (BroadcastCheckpoints)
+# ==========================
+class BroadcastCheckpoint(Base):
+    """
+    Прогрес масової розсилки (broadcast.py) — щоб її можна було продовжити
+    після зупинки / падіння з того ж місця.
+
+    - name — назва розсилки (за замовчуванням — ключ BotMessage).
+    - message_key — ключ BotMessage, текст якого розсилаємо.
+    - last_user_id — до якого telegram_id включно все вже оброблено.
+    - sent / blocked / failed — лічильники результатів (failed — остаточні
+      помилки на кшталт "chat not found", які повторювати марно).
+    - failed_ids — кому не вдалося надіслати через тимчасову помилку (429 після
+      усіх повторів, мережа, 5xx). Курсор іде далі, а їм розсилка досилає
+      наприкінці; поки список не порожній, розсилка не завершена.
+    - started_at / updated_at / finished_at — час старту, останнього чекпоінта, завершення.
+      Незавершена розсилка зі свіжим updated_at — активна: бот на цей час
+      віддає їй частину свого ліміту (broadcast.start_broadcast_watch).
+    """
+
+    __tablename__ = "BroadcastCheckpoints"
+
+    name = Column(String(100), primary_key=True)
+
+    message_key = Column(String(100), nullable=False)
+
+    last_user_id = Column(BigInteger)
+
+    sent = Column(Integer, nullable=False, default=0)
+    blocked = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    failed_ids = Column(JSONB, nullable=False, default=list, server_default="[]")
+
+    started_at = Column(TIMESTAMP, default=datetime.utcnow)
+    updated_at = Column(TIMESTAMP, default=datetime.utcnow)
+    finished_at = Column(TIMESTAMP)
+
+
 # ==========================
 # МОДЕЛЬ: тексти бота (BotMessages)
 # ==========================
@@ -216,7 +475,7 @@ class BotMessage(Base):
 # ==========================
 # СТВОРЕННЯ ВСІХ ТАБЛИЦЬ
 # ==========================
-def create_tables() -> None:
+def create_tables() -> set[str]:
     """
     Створює всі таблиці в базі даних згідно з описаними моделями.
 
@@ -224,9 +483,17 @@ def create_tables() -> None:
         python database.py
 
     або підтягується з окремого скрипта ініціалізації.
+
+    Існуючі таблиці не змінює — для тригерів/індексів/нових колонок
+    у вже робочій БД є migrations.py.
+
+    Повертає:
+        Назви таблиць, яких до цього не було (migrations.py заповнює їх разово).
     """
+    existing = set(inspect(engine).get_table_names())
     Base.metadata.create_all(engine)
     print("Таблиці створено у PostgreSQL!")
+    return set(Base.metadata.tables) - existing
 
 
 # Якщо запустити файл напряму — створюємо таблиці
@@ -1,22 +1,56 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import exists, ColumnElement, case, literal, literal_column, or_, and_, select, func, update, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import NoResultFound
-from database import User, Choice, BotMessage
+from database import User, Choice, Match, NotificationOutbox, choice_pair_lock_key
 from aiogram.types import Message, ReplyKeyboardRemove
 from keyboard.reply import edit_menu_kb, build_match_kb
 from aiogram.fsm.context import FSMContext
 from state import MatchStates, ProfileStates
-from database import SessionLocal
+from config import (
+    INTEREST_OPTIONS,
+    MATCH_QUEUE_SIZE,
+    MATCH_QUEUE_REFILL_AT,
+    MATCHES_PAGE_SIZE,
+    MATCHING_ENGINE,
+    RANKED_CRITERIA,
+    COHORT_CACHE_TTL,
+)
+from database import AsyncSessionLocal
+from message_cache import CompiledTemplate, get_template, get_templates
+import matching_engine
+import recommendations
+import cohort_cache
+import choice_buffer
+import throttling
 import html
 import asyncio
+import weakref
+from datetime import datetime
 
 
 # ====================== БАЗОВІ ХЕЛПЕРИ ПО КОРИСТУВАЧАМ ======================
 
-def get_user_by_telegram_id(session: Session, telegram_id: int):
+async def get_user_by_telegram_id(session: AsyncSession, telegram_id: int):
     """
     Повертає користувача за telegram_id або None, якщо його ще немає в базі.
     """
-    return session.query(User).filter(User.telegram_id == telegram_id).one_or_none()
+    result = await session.execute(select(User).where(User.telegram_id == telegram_id))
+    return result.scalar_one_or_none()
+
+
+def interests_to_mask(interests: list[str] | None) -> int:
+    """
+    Перетворює список інтересів у бітову маску для Users.interests_mask.
+
+    Біт i відповідає INTEREST_OPTIONS[i]. Невідомі інтереси ігноруються.
+    """
+    mask = 0
+    for interest in interests or []:
+        if interest in INTEREST_OPTIONS:
+            mask |= 1 << INTEREST_OPTIONS.index(interest)
+    return mask
 
 
 async def send_edit_menu(message: Message):
@@ -28,15 +62,17 @@ async def send_edit_menu(message: Message):
       ROW 2: затримка 3 секунд
       ROW 3: додатковий текст з командами (edit_r3_c0)
     """
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        # Основне запитання: "Що саме хочеш оновити..."
-        text_main = render_bot_message(session, "edit_r1_c0", lang="uk")
-
-        # Додаткова підказка з командами /view, /match
-        text_hint = render_bot_message(session, "edit_r3_c0", lang="uk")
+        # Основне запитання: "Що саме хочеш оновити..." +
+        # додаткова підказка з командами /view, /match
+        text_main, text_hint = await render_bot_messages(
+            session,
+            ["edit_r1_c0", "edit_r3_c0"],
+            lang="uk",
+        )
     finally:
-        session.close()
+        await session.close()
 
     # 1️⃣ Надсилаємо основний текст + клавіатуру з пунктами редагування
     await message.answer(
@@ -49,7 +85,23 @@ async def send_edit_menu(message: Message):
     #   + надсилаємо друге повідомлення, якщо воно реально є в БД
     if not (text_hint.startswith("[Текст 'edit_r3_c0'") and "не знайдено" in text_hint):
         await asyncio.sleep(3)
-        await message.answer(text_hint, parse_mode="HTML")
+        # Підказка — найнижчий пріоритет у черзі вихідних
+        with throttling.priority(throttling.PRIORITY_LOW):
+            await message.answer(text_hint, parse_mode="HTML")
+
+
+# Посилання на фонові задачі, щоб їх не прибрав GC до завершення
+_background_tasks: set[asyncio.Task] = set()
+
+
+def spawn_background(coro) -> asyncio.Task:
+    """
+    Запускає корутину фоном (не чекаючи її в хендлері).
+    """
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
 
 
 def get_status_emoji(status: str) -> str:
@@ -71,54 +123,58 @@ def get_status_emoji(status: str) -> str:
     return "👶"
 
 
-def get_excluded_ids(session: Session, me_id: int) -> set[int]:
+def not_rated_by(me_id: int) -> ColumnElement[bool]:
     """
-    Повертає множину telegram_id користувачів, яких НЕ показуємо в пошуку.
+    Умова для запитів по User: анкету ще НЕ оцінювала користувачка me_id.
 
-    Сюди входять:
-    - я сама (me_id)
-    - всі, кого вже лайкала/дизлайкала (з таблиці Choice)
+    Це anti-join NOT EXISTS по Choices (chooser_id, chosen_id) — йде по
+    унікальному індексу пари, і розмір запиту не залежить від того,
+    скільки анкет уже оцінено (на відміну від NOT IN зі списком id).
     """
-    existing_choices = (
-        session.query(Choice.chosen_id)
-        .filter(Choice.chooser_id == me_id)
-        .all()
+    return ~exists().where(
+        Choice.chooser_id == me_id,
+        Choice.chosen_id == User.telegram_id,
     )
-    excluded: set[int] = {me_id}  # завжди виключаємо себе
-    excluded.update(row[0] for row in existing_choices)
-    return excluded
 
 
-# ====================== ПОШУК КАНДИДАТІВ ДЛЯ МЕТЧУ ======================
+def liked_by(liker_id, liked_id) -> ColumnElement[bool]:
+    """
+    Умова "liker_id лайкнула liked_id" (аргументи — id або колонки).
 
-def find_candidates_by_criterion(session: Session, me: User, criterion: str) -> list[User]:
+    'LIKE' іде в SQL літералом, а не параметром, щоб Postgres завжди міг
+    довести предикат часткового індексу ix_choices_incoming_likes
+    (chosen_id, chooser_id) WHERE choice_type = 'LIKE' — тоді перевірка
+    взаємного лайку та "хто лайкнув мене" — index-only scan.
     """
-    Підбирає список кандидатів (користувачів) для метчингу за заданим критерієм.
+    return exists().where(
+        Choice.chosen_id == liked_id,
+        Choice.chooser_id == liker_id,
+        Choice.choice_type == literal_column("'LIKE'"),
+    )
 
-    Параметри:
-        session   – активна сесія БД
-        me        – поточний користувач (мама, яка шукає)
-        criterion – один із:
-                    'location'            – тільки місце проживання
-                    'status'              – тільки статус (мама/вагітна і т.д.)
-                    'interests'           – тільки інтереси (є хоча б один спільний)
-                    'location_interests'  – місце + інтереси
 
-    Повертає:
-        Список з максимум 3-х користувачів User, які підходять під критерій.
+# ====================== ПОШУК КАНДИДАТІВ ДЛЯ МЕТЧУ ======================
+
+def _candidates_query(session: Session, me: User, criterion: str):
+    """
+    Будує запит по User з фільтрами критерію (без сортування й LIMIT).
+
+    Повертає None, якщо за цим критерієм шукати неможливо
+    (наприклад, у самої не вказане місто чи інтереси).
     """
     me_id = me.telegram_id
-    excluded_ids = get_excluded_ids(session, me_id)  # кого вже бачила / себе
 
-    q = session.query(User)
-    if excluded_ids:
-        q = q.filter(~User.telegram_id.in_(excluded_ids))
+    # Не показуємо себе та тих, кого вже оцінила
+    q = session.query(User).filter(
+        User.telegram_id != me_id,
+        not_rated_by(me_id),
+    )
 
     # 1️⃣ Тільки місце проживання
     if criterion == "location":
         # Якщо у самої немає регіону або міста/села – пошук неможливий
         if not me.region or (not me.city and not me.village):
-            return []
+            return None
 
         q = q.filter(User.region == me.region)
 
@@ -127,247 +183,640 @@ def find_candidates_by_criterion(session: Session, me: User, criterion: str) ->
         elif me.village:
             q = q.filter(User.village == me.village)
 
-        candidates = q.all()
-
     # 2️⃣ Тільки статус
     elif criterion == "status":
         if not me.status:
-            return []
+            return None
         q = q.filter(User.status == me.status)
-        candidates = q.all()
 
     # 3️⃣ Тільки інтереси (є хоч один спільний)
     elif criterion == "interests":
-        my_interests = set(me.interests or [])
-        if not my_interests:
-            return []
-
-        candidates_all = q.all()
-        candidates: list[User] = []
+        my_mask = me.interests_mask
+        if not my_mask:
+            return None
 
-        for c in candidates_all:
-            if not c.interests:
-                continue
-            if my_interests & set(c.interests):
-                candidates.append(c)
+        # Перетин інтересів — одна бітова операція в SQL
+        q = q.filter(User.interests_mask.op("&")(my_mask) != 0)
 
     # 4️⃣ Місце + інтереси
     elif criterion == "location_interests":
-        my_interests = set(me.interests or [])
-        if not me.region or (not me.city and not me.village) or not my_interests:
-            return []
+        my_mask = me.interests_mask
+        if not me.region or (not me.city and not me.village) or not my_mask:
+            return None
 
-        # Спочатку фільтр по місцю
-        q_loc = q.filter(User.region == me.region)
+        # Фільтр по місцю
+        q = q.filter(User.region == me.region)
         if me.city:
-            q_loc = q_loc.filter(User.city == me.city)
+            q = q.filter(User.city == me.city)
         elif me.village:
-            q_loc = q_loc.filter(User.village == me.village)
-
-        candidates_all = q_loc.all()
-        candidates: list[User] = []
+            q = q.filter(User.village == me.village)
 
-        for c in candidates_all:
-            if not c.interests:
-                continue
-            # Є перетин інтересів
-            if my_interests & set(c.interests):
-                candidates.append(c)
+        # Є перетин інтересів
+        q = q.filter(User.interests_mask.op("&")(my_mask) != 0)
 
     else:
-        candidates = []
+        return None
 
-    # Обмежуємо до 3-х кандидатів
-    return candidates[:3]
+    return q
 
 
-# ====================== НОТИФІКАЦІЯ ПРО МЕТЧ ======================
+def interest_overlap(my_mask: int) -> ColumnElement[int]:
+    """
+    SQL-вираз: скільки інтересів з my_mask є в анкеті (popcount перетину масок).
 
-async def notify_match(bot, user_a: User, user_b: User):
+    Рахується лише по моїх бітах, тож це сума кількох CASE без звернень
+    до JSON — по одному на кожен мій інтерес.
+    """
+    score = literal(0)
+    for bit in range(len(INTEREST_OPTIONS)):
+        if my_mask & (1 << bit):
+            score = score + case((User.interests_mask.op("&")(1 << bit) != 0, 1), else_=0)
+    return score
+
+
+async def find_candidate_page_async(
+    session: AsyncSession,
+    me: User,
+    criterion: str,
+    limit: int,
+    after=None,
+) -> tuple[list[int], object]:
     """
-    Надсилає обом користувачам повідомлення про новий метч.
+    find_candidate_page для хендлерів.
 
-    Текст повідомлення береться з BotMessage (ключ "match_new"), де можна
-    використати плейсхолдери:
-        {mama}    – ім'я/нік іншої мами у вигляді гіперпосилання на профіль
-        {contact} – короткий контакт (наприклад, @username або tg://user)
+    In-memory рушій (MATCHING_ENGINE=memory) — це CPU-робота під локом
+    рушія (для "interests" — прохід по всіх анкетах), тож її виконуємо
+    в потоці (asyncio.to_thread), щоб не зупиняти event loop. Решта
+    режимів — запити до БД, їх ганяємо через run_sync тієї ж сесії.
+    """
+    if criterion != "likes" and matching_engine.is_enabled():
+        # Буфер змінюється з event loop — знімок беремо тут, а не в потоці
+        pending = choice_buffer.pending_for(me.telegram_id)
+        return await asyncio.to_thread(find_candidate_page, None, me, criterion, limit, after, pending)
+    return await session.run_sync(find_candidate_page, me, criterion, limit, after)
+
+
+def find_candidate_page(
+    session: Session | None,
+    me: User,
+    criterion: str,
+    limit: int,
+    after=None,
+    pending: set[int] | None = None,
+) -> tuple[list[int], object]:
     """
+    Наступна сторінка id кандидатів (див. _find_candidate_page) без тих,
+    кого вже оцінила, але вибір ще чекає запису в буфері (choice_buffer).
 
-    # ---------- Будуємо гіперлінк до Telegram-профілю ----------
+    pending — готовий знімок буфера (для виклику з потоку), інакше
+    береться тут же. session може бути None лише для in-memory рушія.
+    """
+    if pending is None:
+        pending = choice_buffer.pending_for(me.telegram_id)
 
-    def name_link(u: User) -> str:
-        """
-        Ім'я або нікнейм у вигляді гіперпосилання.
+    while True:
+        ids, cursor = _find_candidate_page(session, me, criterion, limit, after)
+        if pending:
+            ids = [i for i in ids if i not in pending]
+        # Уся сторінка відсіялась буфером — беремо наступну, а не "кінець списку"
+        if ids or cursor is None:
+            return ids, cursor
+        after = cursor
 
-        Якщо є username → https://t.me/username
-        Якщо немає → tg://user?id=123
-        """
-        raw_text = u.nickname or u.name or "без імені"
-        # Екрануємо текст, щоб уникнути поламаного HTML
-        text = html.escape(raw_text)
 
-        if u.username:
-            return f'<a href="https://t.me/{u.username}">{text}</a>'
+def _find_candidate_page(
+    session: Session,
+    me: User,
+    criterion: str,
+    limit: int,
+    after=None,
+) -> tuple[list[int], object]:
+    """
+    Наступна сторінка id кандидатів — для черги кандидатів у FSM
+    (без завантаження повних анкет).
 
-        return f'<a href="tg://user?id={u.telegram_id}">{text}</a>'
+    Курсор (after і те, що повертаємо):
+    - для RANKED_CRITERIA — [score, telegram_id] останнього кандидата:
+      сортування score DESC, telegram_id ASC;
+    - для решти — просто telegram_id останнього кандидата.
 
-    # ---------- Контакт (може бути @username або tg://user) ----------
+    Якщо увімкнено MATCHING_ENGINE=memory — відповідає in-memory рушій,
+    без запиту в БД; MATCHING_ENGINE=precomputed — читаємо готову сторінку
+    з таблиці Recommendations. Критерій "location" у SQL-режимі може йти
+    через спільний список анкет міста/села (cohort_cache, якщо
+    COHORT_CACHE_TTL > 0). Критерій "likes" (вхідні лайки, /likes) завжди
+    читається з Choices.
 
-    def contact_link(u: User) -> str:
-        """
-        Коротке посилання для контакту:
-        - якщо є username → @username
-        - інакше         → tg://user?id=...
-        """
-        if u.username:
-            return f"@{u.username}"
-        return f'<a href="tg://user?id={u.telegram_id}">написати в Telegram</a>'
+    Повертає:
+        (список id, курсор для наступної сторінки або None, якщо сторінка порожня)
+    """
+    if criterion == "likes":
+        return find_incoming_likes_page(session, me.telegram_id, limit, after)
+    if matching_engine.is_enabled():
+        return matching_engine.engine.find_candidate_page(me, criterion, limit, after)
+    if MATCHING_ENGINE == "precomputed":
+        return recommendations.find_candidate_page(session, me, criterion, limit, after)
+    if criterion == "location" and COHORT_CACHE_TTL > 0:
+        page = cohort_cache.find_location_page(session, me, limit, after)
+        if page is not None:
+            return page
+        # Кеш не набрав сторінку за кілька вікон (майже всі вже оцінені) —
+        # далі звичайний індексований запит, він відсіє їх за один прохід
+
+    q = candidate_ids_query(session, me, criterion, limit, after)
+    if q is None:
+        return [], None
+
+    rows = q.all()
+    if not rows:
+        return [], None
+
+    last = rows[-1]
+    cursor = [last[1], last[0]] if criterion in RANKED_CRITERIA else last[0]
+    return [row[0] for row in rows], cursor
+
+
+def find_incoming_likes_page(
+    session: Session,
+    me_id: int,
+    limit: int,
+    after: int | None = None,
+) -> tuple[list[int], int | None]:
+    """
+    Хто лайкнув me_id, а вона їх ще не оцінила — наступні limit id після
+    курсора after (у порядку chooser_id).
 
-    name_for_a = name_link(user_b)  # user A бачить B
-    name_for_b = name_link(user_a)  # user B бачить A
-    contact_for_a = contact_link(user_b)
-    contact_for_b = contact_link(user_a)
+    Запит іде прямо по Choices: діапазон часткового індексу
+    ix_choices_incoming_likes (chosen_id = me, chooser_id > after) +
+    anti-join по PK, тож вартість сторінки не залежить від того,
+    скільки всього лайків у анкети.
+    """
+    reply = aliased(Choice)
+    stmt = (
+        select(Choice.chooser_id)
+        .where(
+            Choice.chosen_id == me_id,
+            Choice.choice_type == literal_column("'LIKE'"),
+            ~exists().where(reply.chooser_id == me_id, reply.chosen_id == Choice.chooser_id),
+        )
+        .order_by(Choice.chooser_id)
+        .limit(limit)
+    )
+    if after is not None:
+        stmt = stmt.where(Choice.chooser_id > after)
 
-    # Текст повідомлення забираємо з БД
-    session = SessionLocal()
-    try:
-        # Приклад шаблону в BotMessage:
-        # key="match_new", lang="uk"
-        # text="🎉 <b>У тебе новий метч!</b>\n\n"
-        #      "Ти й інша мама вподобали анкети одна одної 🫶\n\n"
-        #      "👩 Мама: {mama}\n"
-        #      "✉ Контакт: {contact}"
-        text_for_a = render_bot_message(
-            session,
-            key="match_new",
-            lang="uk",
-            mama=name_for_a,
-            contact=contact_for_a,
+    ids = list(session.scalars(stmt))
+    return ids, (ids[-1] if ids else None)
+
+
+def candidate_ids_query(
+    session: Session,
+    me: User,
+    criterion: str,
+    limit: int,
+    after=None,
+):
+    """
+    Запит "наступні limit id кандидатів після курсора after" (для
+    find_candidate_page та EXPLAIN-перевірки індексів у migrations.py).
+    None — шукати неможливо.
+
+    Для RANKED_CRITERIA запит повертає (telegram_id, score): Postgres рахує
+    score лише для відфільтрованих анкет і при LIMIT робить top-N heapsort,
+    а не повне сортування.
+    """
+    q = _candidates_query(session, me, criterion)
+    if q is None:
+        return None
+
+    if criterion in RANKED_CRITERIA:
+        score = interest_overlap(me.interests_mask)
+        if after is not None:
+            last_score, last_id = after
+            q = q.filter(or_(
+                score < last_score,
+                and_(score == last_score, User.telegram_id > last_id),
+            ))
+        return (
+            q.with_entities(User.telegram_id, score)
+            .order_by(score.desc(), User.telegram_id)
+            .limit(limit)
         )
-        text_for_b = render_bot_message(
-            session,
-            key="match_new",
-            lang="uk",
-            mama=name_for_b,
-            contact=contact_for_b,
+
+    # Keyset-пагінація: продовжуємо з місця, де зупинились, по індексу PK
+    if after is not None:
+        q = q.filter(User.telegram_id > after)
+
+    return q.with_entities(User.telegram_id).order_by(User.telegram_id).limit(limit)
+
+
+# ====================== ЛАЙК / ДИЗЛАЙК ======================
+
+async def record_choice(session: AsyncSession, chooser_id: int, chosen_id: int, choice_type: str) -> str:
+    """
+    Async-версія для хендлерів: те саме, що _record_choice, через run_sync.
+    """
+    return await session.run_sync(_record_choice, chooser_id, chosen_id, choice_type)
+
+
+def _record_choice(session: Session, chooser_id: int, chosen_id: int, choice_type: str) -> str:
+    """
+    Зберігає LIKE / DISLIKE одним запитом і одразу каже, що вийшло.
+
+    Один statement на один round-trip:
+        WITH ins AS (INSERT ... ON CONFLICT DO NOTHING RETURNING 1)
+        SELECT (є рядок в ins), EXISTS(зустрічний LIKE)
+    Повторне натискання не кидає IntegrityError — ON CONFLICT просто
+    нічого не вставляє.
+
+    Якщо увімкнено буфер (CHOICE_BUFFER_FLUSH_MS > 0), дизлайки та лайки
+    без взаємності лише кладемо в choice_buffer; перевірка взаємності
+    лишається синхронною (БД + буфер), і взаємний лайк пишемо одразу.
+
+    Сповіщення про метч тут не надсилаємо — вони лягають у NotificationOutbox
+    в тому ж statement (або в тій же транзакції flush буфера) і їх розсилає
+    outbox.py.
+
+    Повертає:
+        "new"       — вибір збережено;
+        "duplicate" — ця пара вже була оцінена раніше (нічого не змінюємо);
+        "mutual"    — новий LIKE, і кандидатка вже лайкнула у відповідь.
+    """
+    if choice_buffer.is_enabled():
+        if choice_buffer.get(chooser_id, chosen_id) is not None:
+            return "duplicate"
+
+        if choice_type != "LIKE":
+            choice_buffer.add(chooser_id, chosen_id, choice_type)
+            return "new"
+
+        # Лише читання, без коміту: чи вже оцінена пара і чи є зустрічний LIKE
+        already, reverse_like = session.execute(select(
+            exists().where(Choice.chooser_id == chooser_id, Choice.chosen_id == chosen_id),
+            liked_by(chosen_id, chooser_id),
+        )).one()
+        if already:
+            return "duplicate"
+        buffered_reverse_like = choice_buffer.get(chosen_id, chooser_id) == "LIKE"
+        if not reverse_like and not buffered_reverse_like:
+            choice_buffer.add(chooser_id, chosen_id, choice_type)
+            return "new"
+
+        # Взаємний лайк — пишемо одразу. Якщо зустрічний лайк ще в буфері,
+        # Matches і сповіщення запише вже flush, коли він потрапить у БД
+        result = _insert_choice(session, chooser_id, chosen_id, choice_type)
+        if result == "new" and buffered_reverse_like:
+            # БД зустрічного лайку ще не бачить — взаємність знаємо з буфера
+            return "mutual"
+        # "duplicate" — цей же LIKE паралельно вже записали (подвійне
+        # натискання, інша репліка): метч другий раз не показуємо
+        return result
+
+    return _insert_choice(session, chooser_id, chosen_id, choice_type)
+
+
+def _insert_choice(session: Session, chooser_id: int, chosen_id: int, choice_type: str) -> str:
+    """
+    Синхронний запис вибору одним statement (CTE з INSERT ... ON CONFLICT).
+
+    У тому ж statement оновлюємо лічильники Users.unread_likes:
+    - новий LIKE, а кандидатка мене ще не оцінювала → їй +1;
+    - кандидатка лайкнула мене раніше, а я щойно її оцінила → мені −1.
+    А якщо це взаємний лайк — там же пишемо обидва рядки Matches і
+    сповіщення обом у NotificationOutbox (transactional outbox).
+
+    Перед ним беремо advisory-лок пари (choice_pair_lock_key): зустрічний
+    вибір, що пишеться в цю ж мить, дочекається нашого коміту, і його
+    statement (новий snapshot у READ COMMITTED) побачить наш рядок.
+    """
+    session.execute(select(func.pg_advisory_xact_lock(choice_pair_lock_key(chooser_id, chosen_id))))
+
+    now = datetime.utcnow()
+    ins = (
+        pg_insert(Choice)
+        .values(
+            chooser_id=chooser_id,
+            chosen_id=chosen_id,
+            choice_type=choice_type,
+            created_at=now,
         )
-    finally:
-        session.close()
+        .on_conflict_do_nothing()
+        .returning(Choice.chooser_id)
+        .cte("ins")
+    )
+    inserted = exists(select(ins.c.chooser_id))
+    they_liked_me = liked_by(chosen_id, chooser_id)
+
+    # Я щойно відповіла на її лайк — мінус один непрочитаний у мене
+    answered = (
+        update(User)
+        .where(User.telegram_id == chooser_id, inserted, they_liked_me)
+        .values(unread_likes=func.greatest(User.unread_likes - 1, 0))
+        .returning(User.telegram_id)
+        .cte("answered")
+    )
+    counters = [answered]
+
+    if choice_type == "LIKE":
+        # Вона мене ще не оцінювала — у неї новий непрочитаний лайк
+        unread = (
+            update(User)
+            .where(
+                User.telegram_id == chosen_id,
+                inserted,
+                ~exists().where(Choice.chooser_id == chosen_id, Choice.chosen_id == chooser_id),
+            )
+            .values(unread_likes=User.unread_likes + 1)
+            .returning(User.telegram_id)
+            .cte("unread")
+        )
+        counters.append(unread)
+        mutual = they_liked_me
+
+        # Взаємний лайк — метч для обох (два симетричні рядки)
+        pairs = union_all(*[
+            select(
+                literal(user_id).label("user_id"),
+                literal(match_id).label("match_id"),
+                literal(now).label("created_at"),
+            ).where(inserted, they_liked_me)
+            for user_id, match_id in ((chooser_id, chosen_id), (chosen_id, chooser_id))
+        ])
+        matched = (
+            pg_insert(Match)
+            .from_select(["user_id", "match_id", "created_at"], pairs)
+            .on_conflict_do_nothing()
+            .returning(Match.user_id, Match.match_id)
+            .cte("matched")
+        )
+
+        # Сповіщення кожній про її новий метч — лише для справді нових рядків Matches
+        outbox = (
+            pg_insert(NotificationOutbox)
+            .from_select(
+                ["kind", "user_id", "other_id", "attempts", "created_at", "available_at"],
+                select(
+                    literal("match"),
+                    matched.c.user_id,
+                    matched.c.match_id,
+                    literal(0),
+                    literal(now),
+                    literal(now),
+                ),
+                include_defaults=False,
+            )
+            .on_conflict_do_nothing()
+            .returning(NotificationOutbox.id)
+            .cte("outbox")
+        )
+        counters.append(outbox)
+    else:
+        mutual = literal(False)
+
+    # CTE з UPDATE виконуються, лише якщо на них є посилання в запиті
+    row = session.execute(
+        select(
+            inserted,
+            mutual,
+            *[select(func.count()).select_from(cte).scalar_subquery() for cte in counters],
+        )
+    ).one()
+    session.commit()
 
-    # ---------- Відправляємо повідомлення ----------
+    is_inserted, is_mutual = row[0], row[1]
+    if not is_inserted:
+        return "duplicate"
+    return "mutual" if is_mutual else "new"
 
-    await bot.send_message(
-        chat_id=user_a.telegram_id,
-        text=text_for_a,
-        parse_mode="HTML",
-        disable_web_page_preview=True,
+
+# ====================== НОТИФІКАЦІЯ ПРО МЕТЧ ======================
+
+def profile_link(u: User) -> str:
+    """
+    Ім'я або нікнейм у вигляді гіперпосилання.
+
+    Якщо є username → https://t.me/username
+    Якщо немає → tg://user?id=123
+    """
+    raw_text = u.nickname or u.name or "без імені"
+    # Екрануємо текст, щоб уникнути поламаного HTML
+    text = html.escape(raw_text)
+
+    if u.username:
+        return f'<a href="https://t.me/{u.username}">{text}</a>'
+
+    return f'<a href="tg://user?id={u.telegram_id}">{text}</a>'
+
+
+def contact_link(u: User) -> str:
+    """
+    Коротке посилання для контакту:
+    - якщо є username → @username
+    - інакше         → tg://user?id=...
+    """
+    if u.username:
+        return f"@{u.username}"
+    return f'<a href="tg://user?id={u.telegram_id}">написати в Telegram</a>'
+
+
+def render_match_notifications(session: Session, others: list[User]) -> list[str]:
+    """
+    Тексти сповіщень про метч (ключ "match_new") одним render_bot_messages.
+
+    others — з ким метч (по одній анкеті на сповіщення). Плейсхолдери шаблону:
+        {mama}    – ім'я/нік іншої мами у вигляді гіперпосилання на профіль
+        {contact} – короткий контакт (наприклад, @username або tg://user)
+
+    Надсилає їх outbox.py (з пріоритетом PRIORITY_HIGH у черзі вихідних).
+    """
+    # Приклад шаблону в BotMessage:
+    # key="match_new", lang="uk"
+    # text="🎉 <b>У тебе новий метч!</b>\n\n"
+    #      "Ти й інша мама вподобали анкети одна одної 🫶\n\n"
+    #      "👩 Мама: {mama}\n"
+    #      "✉ Контакт: {contact}"
+    return _render_bot_messages(
+        session,
+        [
+            ("match_new", {"mama": profile_link(other), "contact": contact_link(other)})
+            for other in others
+        ],
+        lang="uk",
     )
 
-    await bot.send_message(
-        chat_id=user_b.telegram_id,
-        text=text_for_b,
-        parse_mode="HTML",
-        disable_web_page_preview=True,
+
+# ====================== МОЇ МЕТЧІ (/matches) ======================
+
+async def find_matches_page(
+    session: AsyncSession,
+    me_id: int,
+    limit: int = MATCHES_PAGE_SIZE,
+    after: tuple[datetime, int] | None = None,
+) -> tuple[list[User], tuple[datetime, int] | None]:
+    """
+    Наступна сторінка метчів me_id: спочатку нові (created_at DESC, match_id DESC).
+
+    Курсор — (created_at, match_id) останнього метчу попередньої сторінки;
+    сторінка — діапазон індексу ix_matches_user_page + JOIN анкет по PK,
+    тож однаково швидка і для першої, і для сотої сторінки.
+
+    Повертає:
+        (анкети метчів, курсор наступної сторінки або None, якщо далі нічого)
+    """
+    stmt = (
+        select(User, Match.created_at)
+        .join(Match, Match.match_id == User.telegram_id)
+        .where(Match.user_id == me_id)
+        .order_by(Match.created_at.desc(), Match.match_id.desc())
+        .limit(limit + 1)
     )
+    if after is not None:
+        last_at, last_id = after
+        stmt = stmt.where(or_(
+            Match.created_at < last_at,
+            and_(Match.created_at == last_at, Match.match_id < last_id),
+        ))
+
+    # limit + 1 — щоб одразу знати, чи є наступна сторінка
+    rows = (await session.execute(stmt)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    cursor = (rows[-1].created_at, rows[-1].User.telegram_id) if has_more else None
+    return [row.User for row in rows], cursor
 
 
 # ====================== ОСНОВНИЙ ФЛОУ ПОШУКУ (МЕТЧИНГ) ======================
 
-async def run_match_flow(message: Message, state: FSMContext, criterion: str):
+async def run_match_flow(
+    message: Message,
+    state: FSMContext,
+    criterion: str,
+    fresh: bool = False,
+):
     """
-    Запускає логіку пошуку кандидатів за обраним критерієм та показує першого кандидата.
+    Показує наступного кандидата за обраним критерієм.
+
+    Кандидати йдуть з черги telegram_id у FSM (candidate_queue):
+    - на старті пошуку (fresh=True) або коли черга спорожніла — один запит
+      шукає одразу MATCH_QUEUE_SIZE кандидатів після курсора match_cursor
+      (за інтересами — спершу ті, з ким більше спільного);
+    - на кожен лайк/дизлайк просто беремо наступний id з черги
+      і дістаємо одну анкету по PK;
+    - коли в черзі лишається мало id — добираємо наступну порцію у фоні.
 
-    Кроки:
-    1. Дістаємо поточного користувача з БД.
-    2. Підбираємо список кандидатів за критерієм.
-    3. Якщо кандидатів немає – показуємо відповідне повідомлення.
-    4. Якщо є – показуємо анкету першого кандидата та ставимо стан like/dislike.
+    Якщо кандидатів немає – показуємо відповідне повідомлення і чистимо стан.
     """
     me_id = message.from_user.id
-    session = SessionLocal()
 
-    try:
-        # 1. Отримуємо поточного користувача
-        me = get_user_by_telegram_id(session, me_id)
-        if me is None:
-            # Якщо користувача немає в БД – просимо пройти /start
-            # Приклад шаблону:
-            # key="match_user_not_found"
-            # "Тебе ще немає в базі 🧐\nСпочатку заповни анкету через /start."
-            text = render_bot_message(session, "match_user_not_found", lang="uk")
-            await message.answer(text, parse_mode="HTML")
+    # Черга в FSM — read-modify-write: під локом, щоб фонове дозаповнення
+    # не вклинилось між get_data і update_data
+    async with _candidate_queue_lock(me_id):
+        data = await state.get_data()
+
+        # Продовжуємо чергу лише в межах того самого пошуку
+        if fresh or data.get("current_criterion") != criterion:
+            queue: list[int] = []
+            cursor = None
+        else:
+            queue = list(data.get("candidate_queue") or [])
+            cursor = data.get("match_cursor")
+
+        session = AsyncSessionLocal()
+
+        try:
+            cand = None
+            # (текст, клавіатура), якщо показувати нікого — надсилаємо після session.close()
+            notice = None
+            while cand is None:
+                if not queue:
+                    # 1. Черга порожня — шукаємо нову порцію кандидатів
+                    me = await get_user_by_telegram_id(session, me_id)
+                    if me is None:
+                        # Якщо користувача немає в БД – просимо пройти /start
+                        # Приклад шаблону:
+                        # key="match_user_not_found"
+                        # "Тебе ще немає в базі 🧐\nСпочатку заповни анкету через /start."
+                        text = await render_bot_message(session, "match_user_not_found", lang="uk")
+                        notice = (text, None)
+                        break
+
+                    # Якщо після курсора нікого — пробуємо ще раз з початку списку:
+                    # там могли зʼявитися нові анкети з меншим telegram_id.
+                    queue, next_cursor = await find_candidate_page_async(
+                        session, me, criterion, MATCH_QUEUE_SIZE, cursor
+                    )
+                    if not queue and cursor is not None:
+                        queue, next_cursor = await find_candidate_page_async(
+                            session, me, criterion, MATCH_QUEUE_SIZE
+                        )
+
+                    # 2. Якщо кандидатів немає – показуємо відповідне повідомлення
+                    if not queue:
+                        text = await _render_no_candidates(session, criterion)
+                        notice = (text, ReplyKeyboardRemove())
+                        break
+
+                    cursor = next_cursor
+
+                # 3. Беремо наступного з черги (анкету могли вже видалити — тоді далі)
+                cand = await session.get(User, queue.pop(0))
+
+            if cand is not None:
+                # Підготовка даних з fallback-ами
+                nickname = cand.nickname or "не вказано"
+                age = str(cand.age) if cand.age is not None else "не вказано"
+                bio = cand.bio or "не вказано"
+                status = cand.status or "не вказано"
+
+                # Екрануємо весь юзерський текст, щоб не поламати HTML
+                nickname_safe = html.escape(nickname)
+                bio_safe = html.escape(bio)
+                status_safe = html.escape(status)
+
+                # Текст анкети кандидата беремо з BotMessage
+                # Приклад шаблону:
+                # key="match_candidate_profile"
+                # text="👤 <b>Кандидат</b>\n"
+                #      "━━━━━━━━━━━━━━\n"
+                #      "✨ <b>Нікнейм:</b> {nickname}\n"
+                #      "🎂 <b>Вік:</b> {age}\n"
+                #      "👶 <b>Статус:</b> {status}\n"
+                #      "📜 <b>BIO:</b>\n{bio}"
+                text = await render_bot_message(
+                    session,
+                    key="match_candidate_profile",
+                    lang="uk",
+                    nickname=nickname_safe,
+                    age=age,
+                    status=status_safe,
+                    bio=bio_safe,
+                )
+
+        finally:
+            # Закриваємо сесію перед відправкою повідомлень
+            await session.close()
+
+        if cand is None:
             await state.clear()
-            return
-
-        # 2. Шукаємо кандидатів
-        candidates = find_candidates_by_criterion(session, me, criterion)
-
-        # 3. Якщо кандидатів немає – показуємо відповідне повідомлення
-        if not candidates:
-            if criterion == "location":
-                key = "match_no_candidates_location"
-                # Наприклад: "Поки що немає кандидатів за місцем проживання 😔\n..."
-            elif criterion == "location_interests":
-                key = "match_no_candidates_location_interests"
-                # Наприклад: "Поки що немає кандидатів за місцем проживання та інтересами 😔\n..."
-            elif criterion == "interests":
-                key = "match_no_candidates_interests"
-                # Наприклад: "Поки що немає кандидатів за інтересами 😔\n..."
-            else:
-                key = "match_no_candidates_default"
-                # Наприклад: "Поки що немає кандидатів за заданим критерієм 😔\n..."
-
-            text = render_bot_message(session, key, lang="uk")
-            await message.answer(
-                text,
-                reply_markup=ReplyKeyboardRemove(),
-                parse_mode="HTML",
+        else:
+            # Зберігаємо, кого оцінюємо, за яким критерієм, решту черги та курсор
+            await state.update_data(
+                current_candidate_id=cand.telegram_id,
+                current_criterion=criterion,
+                candidate_queue=queue,
+                match_cursor=cursor,
             )
-            await state.clear()
-            return
 
-        # 4. Беремо одного кандидата (першого зі списку)
-        cand = candidates[0]
-
-        # Підготовка даних з fallback-ами
-        nickname = cand.nickname or "не вказано"
-        age = str(cand.age) if cand.age is not None else "не вказано"
-        bio = cand.bio or "не вказано"
-        status = cand.status or "не вказано"
-
-        # Екрануємо весь юзерський текст, щоб не поламати HTML
-        nickname_safe = html.escape(nickname)
-        bio_safe = html.escape(bio)
-        status_safe = html.escape(status)
-
-        # Текст анкети кандидата беремо з BotMessage
-        # Приклад шаблону:
-        # key="match_candidate_profile"
-        # text="👤 <b>Кандидат</b>\n"
-        #      "━━━━━━━━━━━━━━\n"
-        #      "✨ <b>Нікнейм:</b> {nickname}\n"
-        #      "🎂 <b>Вік:</b> {age}\n"
-        #      "👶 <b>Статус:</b> {status}\n"
-        #      "📜 <b>BIO:</b>\n{bio}"
-        text = render_bot_message(
-            session,
-            key="match_candidate_profile",
-            lang="uk",
-            nickname=nickname_safe,
-            age=age,
-            status=status_safe,
-            bio=bio_safe,
-        )
-
-    finally:
-        # Закриваємо сесію перед відправкою повідомлень
-        session.close()
+            # 4. Черга закінчується — добираємо наступну порцію у фоні
+            refill_key = (me_id, criterion)
+            if len(queue) <= MATCH_QUEUE_REFILL_AT and refill_key not in _refilling_queues:
+                _refilling_queues.add(refill_key)
+                spawn_background(_refill_candidate_queue(state, me_id, criterion, cursor))
 
-    # Зберігаємо, кого оцінюємо, і за яким критерієм
-    await state.update_data(
-        current_candidate_id=cand.telegram_id,
-        current_criterion=criterion,
-    )
+    if cand is None:
+        await send_replies(message, [notice])
+        return
 
     # Показуємо кандидата + клавіатуру лайк/дизлайк
     await message.answer(
@@ -378,10 +827,97 @@ async def run_match_flow(message: Message, state: FSMContext, criterion: str):
     await state.set_state(MatchStates.like_dislike)
 
 
+async def _render_no_candidates(session: AsyncSession, criterion: str) -> str:
+    """
+    Текст "немає кандидатів" під конкретний критерій.
+    """
+    if criterion == "location":
+        key = "match_no_candidates_location"
+        # Наприклад: "Поки що немає кандидатів за місцем проживання 😔\n..."
+    elif criterion == "location_interests":
+        key = "match_no_candidates_location_interests"
+        # Наприклад: "Поки що немає кандидатів за місцем проживання та інтересами 😔\n..."
+    elif criterion == "interests":
+        key = "match_no_candidates_interests"
+        # Наприклад: "Поки що немає кандидатів за інтересами 😔\n..."
+    elif criterion == "likes":
+        key = "likes_inbox_done"
+        # Наприклад: "Це всі, хто тебе лайкнув 💌\nЩоб шукати далі — /match"
+    else:
+        key = "match_no_candidates_default"
+        # Наприклад: "Поки що немає кандидатів за заданим критерієм 😔\n..."
+
+    return await render_bot_message(session, key, lang="uk")
+
+
+# (telegram_id, критерій), для яких зараз уже йде фонове дозаповнення черги
+_refilling_queues: set[tuple[int, str]] = set()
+
+# telegram_id → лок черги кандидатів у FSM. WeakValueDictionary: лок живе,
+# поки його хтось тримає / чекає, тож словник не росте з кількістю користувачок
+_candidate_queue_locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def _candidate_queue_lock(me_id: int) -> asyncio.Lock:
+    """
+    Лок на candidate_queue / match_cursor користувачки: run_match_flow і
+    фонове дозаповнення змінюють їх лише під ним.
+    """
+    lock = _candidate_queue_locks.get(me_id)
+    if lock is None:
+        lock = _candidate_queue_locks[me_id] = asyncio.Lock()
+    return lock
+
+
+async def _refill_candidate_queue(
+    state: FSMContext,
+    me_id: int,
+    criterion: str,
+    after,
+):
+    """
+    Фоном дочитує наступну порцію id кандидатів після курсора after і додає в чергу.
+
+    Пошук іде без локу; під локом перечитуємо актуальний стан і дописуємо
+    в нього. Якщо за цей час пошук перезапустили / зупинили (змінився
+    критерій або курсор), результат просто відкидаємо.
+    """
+    try:
+        session = AsyncSessionLocal()
+        try:
+            me = await get_user_by_telegram_id(session, me_id)
+            if me is None:
+                return
+            ids, next_cursor = await find_candidate_page_async(
+                session, me, criterion, MATCH_QUEUE_SIZE, after
+            )
+        finally:
+            await session.close()
+
+        if not ids:
+            # Кінець списку: коли черга спорожніє, run_match_flow сам
+            # почне спочатку (wrap-around)
+            return
+
+        async with _candidate_queue_lock(me_id):
+            data = await state.get_data()
+            if data.get("current_criterion") != criterion or data.get("match_cursor") != after:
+                return
+
+            queue = list(data.get("candidate_queue") or [])
+            queued = set(queue)
+            await state.update_data(
+                candidate_queue=queue + [i for i in ids if i not in queued],
+                match_cursor=next_cursor,
+            )
+    finally:
+        _refilling_queues.discard((me_id, criterion))
+
+
 # ====================== ЗБЕРЕЖЕННЯ АНКЕТИ З FSM-СТАНУ ======================
 
-def save_user_profile_from_state(
-    session: Session,
+async def save_user_profile_from_state(
+    session: AsyncSession,
     telegram_id: int,
     tg_username: str | None,
     data: dict,
@@ -397,7 +933,7 @@ def save_user_profile_from_state(
                       name, nickname, region, city, village, age,
                       status, interests (list), bio
     """
-    user = get_user_by_telegram_id(session, telegram_id)
+    user = await get_user_by_telegram_id(session, telegram_id)
     if user is None:
         user = User(telegram_id=telegram_id)
 
@@ -410,17 +946,21 @@ def save_user_profile_from_state(
     user.age = data.get("age")
     user.status = data.get("status")
     user.interests = data.get("interests", [])
+    user.interests_mask = interests_to_mask(user.interests)
     user.bio = data.get("bio")
     user.username = tg_username
 
     session.add(user)
-    session.commit()
+    await session.commit()
+
+    # Оновлюємо індекси пошуку кандидатів (якщо вони в памʼяті)
+    matching_engine.on_profile_changed(user)
     return user
 
 
 # ====================== ТЕКСТИ БОТА З БАЗИ (BotMessage) ======================
 
-def render_bot_message(session: Session, key: str, lang: str = "uk", **kwargs) -> str:
+async def render_bot_message(session: AsyncSession, key: str, lang: str = "uk", **kwargs) -> str:
     """
     Дістає текст бота з таблиці BotMessage та підставляє змінні.
 
@@ -439,23 +979,81 @@ def render_bot_message(session: Session, key: str, lang: str = "uk", **kwargs) -
         Готовий рядок для відправки користувачу.
         Якщо ключ не знайдено – повертає "[Текст 'key' не знайдено]".
         Якщо не вистачає змінної – додає попередження в кінці.
+
+    Шаблони беруться через кеш процесу (message_cache), тому повторні
+    виклики з тим самим ключем не ходять у БД.
     """
-    msg = (
-        session.query(BotMessage)
-        .filter_by(key=key, lang=lang)
-        .one_or_none()
-    )
+    template = await session.run_sync(get_template, key, lang)
+    return _format_template(key, template, kwargs)
+
+
+async def render_bot_messages(
+    session: AsyncSession,
+    keys: list[str | tuple[str, dict]],
+    lang: str = "uk",
+) -> list[str]:
+    """
+    Рендерить кілька текстів бота за один раз.
+
+    Усі шаблони дістаються одним запитом (WHERE key IN (...)), а не окремим
+    запитом на кожен ключ, як при послідовних викликах render_bot_message.
 
-    if msg is None:
+    Параметри:
+        session – активна сесія БД
+        keys    – список ключів; якщо шаблону потрібні змінні — передаємо
+                  пару (key, {"name": ..., ...})
+        lang    – мова повідомлень ("uk" за замовчуванням)
+
+    Повертає:
+        Список готових рядків у тому ж порядку, що й keys
+        (фолбеки ті самі, що в render_bot_message).
+
+    Приклад:
+        text_main, text_hint = await render_bot_messages(
+            session, ["edit_r1_c0", "edit_r3_c0"]
+        )
+    """
+    return await session.run_sync(_render_bot_messages, keys, lang)
+
+
+def _render_bot_messages(
+    session: Session,
+    keys: list[str | tuple[str, dict]],
+    lang: str = "uk",
+) -> list[str]:
+    """
+    Синхронна частина render_bot_messages — для run_sync і фонових задач
+    у потоках (outbox), де сесія звичайна.
+    """
+    items = [(k, {}) if isinstance(k, str) else k for k in keys]
+    templates = get_templates(session, [key for key, _ in items], lang)
+
+    return [
+        _format_template(key, templates.get(key), kwargs)
+        for key, kwargs in items
+    ]
+
+
+def _format_template(key: str, template: CompiledTemplate | None, kwargs: dict) -> str:
+    """
+    Підставляє змінні в шаблон з фолбеками (спільна частина render_bot_message*).
+    """
+    if template is None:
         # Фолбек, якщо тексту ще немає в БД
-        template = f"[Текст '{key}' не знайдено]"
-    else:
-        template = msg.text
+        return f"[Текст '{key}' не знайдено]"
 
-    try:
-        # Підставляємо змінні {name}, {age}, {mama}, {contact}, ...
-        return template.format(**kwargs)
-    except KeyError as e:
-        # Якщо забули якусь змінну передати — не падаємо, а показуємо попередження
-        missing = e.args[0]
-        return template + f"\n\n[⚠️ Не вистачає змінної: {missing}]"
+    # Підставляємо змінні {name}, {age}, {mama}, {contact}, ...
+    # Якщо якоїсь не вистачає — не падаємо, а показуємо попередження в кінці
+    return template.render(kwargs)
+
+
+async def send_replies(message: Message, replies: list[tuple[str, object]]):
+    """
+    Надсилає підготовлені відповіді (текст, клавіатура) по черзі.
+
+    Хендлери рендерять тексти всередині сесії, а надсилають уже після
+    session.close(): відправка може чекати в черзі вихідних (throttling),
+    і з'єднання з пулу не має весь цей час висіти у відкритій транзакції.
+    """
+    for text, reply_markup in replies:
+        await message.answer(text, reply_markup=reply_markup, parse_mode="HTML")
@@ -0,0 +1,33 @@
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from datetime import datetime
+
+
+# Префікс callback_data кнопки "Ще" у /matches
+MATCHES_MORE_PREFIX = "matches_more:"
+
+
+# 1️⃣ Наступна сторінка метчів (/matches)
+def build_matches_more_kb(cursor: tuple[datetime, int]) -> InlineKeyboardMarkup:
+    """
+    Кнопка "Ще метчі". Курсор (created_at, match_id) їде прямо в callback_data
+    (≈50 байт при ліміті Telegram 64), тож FSM-стан для гортання не потрібен.
+    """
+    created_at, match_id = cursor
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="Ще метчі ▶",
+                    callback_data=f"{MATCHES_MORE_PREFIX}{created_at.isoformat()}|{match_id}",
+                ),
+            ],
+        ],
+    )
+
+
+def parse_matches_cursor(callback_data: str) -> tuple[datetime, int]:
+    """
+    Зворотне до build_matches_more_kb: callback_data → (created_at, match_id).
+    """
+    created_at, match_id = callback_data.removeprefix(MATCHES_MORE_PREFIX).split("|")
+    return datetime.fromisoformat(created_at), int(match_id)
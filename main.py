@@ -1,5 +1,17 @@
 from config import TOKEN
+from database import async_engine
+from message_cache import (
+    preload_templates,
+    start_templates_listener,
+    stop_templates_listener,
+)
+from matching_engine import load_engine
+from recommendations import start_recommendations_job, stop_recommendations_job
+from choice_buffer import start_choice_buffer, stop_choice_buffer
+from outbox import start_outbox_worker, stop_outbox_worker, wake_outbox_worker
+from broadcast import start_broadcast_watch, stop_broadcast_watch
 from router import all_routers
+from throttling import setup_outbound_queue
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram import Bot, Dispatcher
 import asyncio
@@ -7,6 +19,8 @@ import asyncio
 
 async def main():
     bot = Bot(token=TOKEN)
+    # Усі вихідні повідомлення — через чергу з лімітами Telegram
+    setup_outbound_queue(bot)
     dp = Dispatcher(storage=MemoryStorage())
 
     # 👇 інжектимо бота в модуль нагадувань, щоб не потрібен був env
@@ -16,8 +30,41 @@ async def main():
     for router in all_routers:
         dp.include_router(router)
 
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    # Тексти бота (BotMessages) тягнемо в памʼять одним запитом
+    preload_templates()
+
+    # Слухач змін BotMessages (LISTEN/NOTIFY) — без нього кеш оновиться по TTL
+    try:
+        await start_templates_listener()
+    except Exception as e:
+        print(f"⚠ Слухач змін BotMessages не запущений: {e}")
+
+    # In-memory індекси пошуку кандидатів (лише якщо MATCHING_ENGINE=memory)
+    load_engine()
+
+    # Фоновий перерахунок Recommendations (лише якщо MATCHING_ENGINE=precomputed)
+    start_recommendations_job()
+
+    # Пакетний запис лайків / дизлайків (лише якщо CHOICE_BUFFER_FLUSH_MS > 0)
+    start_choice_buffer(wake_outbox_worker)
+
+    # Розсилка сповіщень про метчі з NotificationOutbox
+    start_outbox_worker(bot)
+
+    # Поки broadcast.py розсилає, бот віддає йому частину ліміту Telegram
+    start_broadcast_watch()
+
+    try:
+        await bot.delete_webhook(drop_pending_updates=True)
+        await dp.start_polling(bot)
+    finally:
+        stop_templates_listener()
+        stop_recommendations_job()
+        await stop_choice_buffer()
+        stop_outbox_worker()
+        stop_broadcast_watch()
+        # Закриваємо пул async-зʼєднань (asyncpg)
+        await async_engine.dispose()
 
 
 if __name__ == "__main__":
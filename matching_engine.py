@@ -0,0 +1,508 @@
+import bisect
+import heapq
+import threading
+from collections import deque
+
+import numpy as np
+from sqlalchemy import select
+
+from config import MATCHING_ENGINE
+from database import SessionLocal, User, Choice
+import recommendations
+import cohort_cache
+
+
+# ==========================
+# IN-MEMORY ПОШУК КАНДИДАТІВ
+# ==========================
+# Опційна заміна SQL-пошуку (MATCHING_ENGINE=memory): усі атрибути, потрібні
+# для метчингу, тримаються в памʼяті процесу у вигляді компактних індексів,
+# тож пошук кандидатів не ходить у БД взагалі.
+#
+# ⚠️ Кожен процес має власну копію індексів і бачить лише зміни, зроблені
+# в ньому самому. Тому цей режим — для одного процесу (main.py або один
+# воркер uvicorn). Для кількох реплік лишаємо MATCHING_ENGINE=sql.
+
+
+class ColumnarSnapshot:
+    """
+    Колонковий зріз анкет у масивах NumPy: рядок i — одна анкета.
+
+    - ids     — telegram_id (int64)
+    - region  — код області  (int32, 0 = не вказано)
+    - city    — код міста    (int32, 0 = не вказано)
+    - village — код села     (int32, 0 = не вказано)
+    - status  — код статусу  (int32, 0 = не вказано)
+    - age     — вік          (int16, -1 = не вказано)
+    - mask    — interests_mask (uint64)
+
+    Рядки тексту замінені цілими кодами, тож фільтр "та сама локація +
+    хоч один спільний інтерес" — один векторизований прохід по масивах,
+    без циклу по анкетах у Python. status / age — для таких самих
+    векторизованих фільтрів (status_code() дає код для порівняння).
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._codes: dict[str, int] = {}
+        self._rows: dict[int, int] = {}
+        self._size = 0
+
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.region = np.zeros(capacity, dtype=np.int32)
+        self.city = np.zeros(capacity, dtype=np.int32)
+        self.village = np.zeros(capacity, dtype=np.int32)
+        self.status = np.zeros(capacity, dtype=np.int32)
+        self.age = np.full(capacity, -1, dtype=np.int16)
+        self.mask = np.zeros(capacity, dtype=np.uint64)
+
+    def _code(self, value: str | None) -> int:
+        """
+        Цілий код рядка (область/місто/село). None і "" → 0.
+        """
+        if not value:
+            return 0
+        return self._codes.setdefault(value, len(self._codes) + 1)
+
+    def status_code(self, status: str | None) -> int | None:
+        """
+        Код статусу для порівняння з колонкою status (None — такого ще немає).
+        """
+        return self._codes.get(status) if status else None
+
+    def _grow(self) -> None:
+        capacity = max(len(self.ids) * 2, 1024)
+        for name in ("ids", "region", "city", "village", "status", "age", "mask"):
+            old = getattr(self, name)
+            new = np.full(capacity, -1 if name == "age" else 0, dtype=old.dtype)
+            new[: self._size] = old[: self._size]
+            setattr(self, name, new)
+
+    def set_row(self, telegram_id: int, profile: tuple) -> None:
+        """
+        Додає анкету або перезаписує її рядок (profile — як у MatchingEngine).
+        """
+        region, city, village, status, mask, age = profile
+
+        row = self._rows.get(telegram_id)
+        if row is None:
+            if self._size == len(self.ids):
+                self._grow()
+            row = self._size
+            self._size += 1
+            self._rows[telegram_id] = row
+            self.ids[row] = telegram_id
+
+        self.region[row] = self._code(region)
+        self.city[row] = self._code(city)
+        self.village[row] = self._code(village)
+        self.status[row] = self._code(status)
+        self.age[row] = age if age is not None else -1
+        self.mask[row] = mask
+
+    def rank_location_interests(
+        self,
+        me: User,
+        excluded: set[int],
+        limit: int,
+        after=None,
+    ) -> tuple[list[int], list | None]:
+        """
+        Кандидати з тієї ж локації, що й me, з хоча б одним спільним інтересом,
+        ранжовані як у SQL: score (кількість спільних інтересів) DESC,
+        telegram_id ASC. after — курсор [score, telegram_id] попередньої сторінки.
+
+        excluded — id, які не пропонуємо (сама me та вже оцінені анкети).
+
+        Повертає:
+            (id сторінки, курсор останнього або None)
+        """
+        n = self._size
+        ids = self.ids[:n]
+
+        region = self._codes.get(me.region)
+        if me.city:
+            place, column = self._codes.get(me.city), self.city[:n]
+        else:
+            place, column = self._codes.get(me.village), self.village[:n]
+        if region is None or place is None:
+            return [], None
+
+        # popcount перетину масок — лише по моїх бітах (їх одиниці)
+        my_mask = me.interests_mask or 0
+        masks = self.mask[:n]
+        score = np.zeros(n, dtype=np.int64)
+        for bit in range(my_mask.bit_length()):
+            if my_mask & (1 << bit):
+                score += ((masks >> np.uint64(bit)) & np.uint64(1)).astype(np.int64)
+
+        eligible = (self.region[:n] == region) & (column == place) & (score > 0)
+        if after is not None:
+            last_score, last_id = after
+            eligible &= (score < last_score) | ((score == last_score) & (ids > last_id))
+
+        excluded_rows = [self._rows[i] for i in excluded if i in self._rows]
+        if excluded_rows:
+            eligible[excluded_rows] = False
+
+        rows = np.flatnonzero(eligible)
+        if not len(rows):
+            return [], None
+
+        # Один int64-ключ на (score DESC, telegram_id ASC): score ≤ 64, id < 2^57
+        keys = ((64 - score[rows]) << 57) | ids[rows]
+        if len(rows) > limit:
+            # limit найкращих без повного сортування
+            top = np.argpartition(keys, limit - 1)[:limit]
+            rows, keys = rows[top], keys[top]
+        rows = rows[np.argsort(keys)]
+
+        page = ids[rows].tolist()
+        return page, [int(score[rows[-1]]), page[-1]]
+
+
+class MatchingEngine:
+    """
+    Індекси для пошуку кандидатів.
+
+    - (region, city)    → відсортований список telegram_id
+    - (region, village) → відсортований список telegram_id
+    - status            → відсортований список telegram_id
+    - біт інтересу      → відсортований список telegram_id
+    - telegram_id       → (region, city, village, status, interests_mask, age)
+    - chooser_id        → множина chosen_id (кого вже оцінила)
+    - ColumnarSnapshot  — ті самі анкети в масивах NumPy (для location_interests)
+
+    Видача та курсори такі самі, як у SQL-пошуку (function.find_candidate_page):
+    за telegram_id, а для interests / location_interests — за кількістю
+    спільних інтересів, тож черга кандидатів у FSM працює однаково
+    з обома рушіями.
+    """
+
+    def __init__(self):
+        self._profiles: dict[int, tuple] = {}
+        self._by_city: dict[tuple[str, str], list[int]] = {}
+        self._by_village: dict[tuple[str, str], list[int]] = {}
+        self._by_status: dict[str, list[int]] = {}
+        self._by_interest: dict[int, list[int]] = {}
+        self._rated: dict[int, set[int]] = {}
+        self._columns = ColumnarSnapshot()
+
+        # Пошук може йти з фонового потоку (дозаповнення черги), а оновлення —
+        # з event loop, тому всі звернення до індексів — під локом.
+        # Пошук тримає лок увесь O(N)-прохід, тож оновлення на нього не чекають:
+        # кладуть зміну в _pending і застосовують її, лише якщо лок вільний.
+        # Інакше зміну застосує той, хто візьме лок наступним (_drain) —
+        # будь-який пошук спершу доганяє _pending і бачить усі попередні зміни
+        self._lock = threading.Lock()
+        self._pending: deque = deque()
+
+    # ---------- Завантаження ----------
+
+    def load(self) -> int:
+        """
+        Повністю перечитує анкети та вибори з БД (потоково, без ORM-обʼєктів).
+
+        Повертає:
+            Кількість завантажених анкет.
+        """
+        profiles: dict[int, tuple] = {}
+        rated: dict[int, set[int]] = {}
+
+        session = SessionLocal()
+        try:
+            rows = session.execute(
+                select(
+                    User.telegram_id,
+                    User.region,
+                    User.city,
+                    User.village,
+                    User.status,
+                    User.interests_mask,
+                    User.age,
+                ).execution_options(yield_per=10_000)
+            )
+            for telegram_id, *profile in rows:
+                profiles[telegram_id] = tuple(profile)
+
+            choices = session.execute(
+                select(Choice.chooser_id, Choice.chosen_id).execution_options(yield_per=10_000)
+            )
+            for chooser_id, chosen_id in choices:
+                rated.setdefault(chooser_id, set()).add(chosen_id)
+        finally:
+            session.close()
+
+        with self._lock:
+            # Зміни, що прийшли до / під час читання з БД, накладемо поверх нового стану
+            self._profiles = profiles
+            self._rated = rated
+            self._by_city, self._by_village = {}, {}
+            self._by_status, self._by_interest = {}, {}
+
+            # Спершу збираємо списки, а сортуємо один раз у кінці
+            for telegram_id, profile in profiles.items():
+                for index, key in self._index_keys(profile):
+                    index.setdefault(key, []).append(telegram_id)
+
+            for index in (self._by_city, self._by_village, self._by_status, self._by_interest):
+                for ids in index.values():
+                    ids.sort()
+
+            self._columns = ColumnarSnapshot(capacity=max(len(profiles), 1024))
+            for telegram_id, profile in profiles.items():
+                self._columns.set_row(telegram_id, profile)
+
+            self._drain()
+
+        return len(profiles)
+
+    # ---------- Інкрементальні оновлення ----------
+
+    def upsert_user(self, user: User) -> None:
+        """
+        Оновлює індекси після збереження анкети (нової або відредагованої).
+        """
+        profile = (
+            user.region,
+            user.city,
+            user.village,
+            user.status,
+            user.interests_mask or 0,
+            user.age,
+        )
+        self._submit(self._apply_upsert, user.telegram_id, profile)
+
+    def record_choice(self, chooser_id: int, chosen_id: int) -> None:
+        """
+        Запамʼятовує лайк/дизлайк, щоб більше не пропонувати цю анкету.
+        """
+        self._submit(self._apply_choice, chooser_id, chosen_id)
+
+    def _submit(self, apply, *args) -> None:
+        """
+        Ставить зміну в _pending і застосовує, якщо лок вільний — не блокуючись
+        (викликається з event loop, поки в потоці може йти пошук).
+        """
+        self._pending.append((apply, args))
+        if self._lock.acquire(blocking=False):
+            try:
+                self._drain()
+            finally:
+                self._lock.release()
+
+    def _drain(self) -> None:
+        """
+        Застосовує всі відкладені зміни по черзі. Лише під self._lock.
+        """
+        while self._pending:
+            apply, args = self._pending.popleft()
+            apply(*args)
+
+    def _apply_upsert(self, telegram_id: int, profile: tuple) -> None:
+        old = self._profiles.get(telegram_id)
+        if old == profile:
+            return
+        if old is not None:
+            self._unindex(telegram_id, old)
+
+        self._profiles[telegram_id] = profile
+        for index, key in self._index_keys(profile):
+            bisect.insort(index.setdefault(key, []), telegram_id)
+
+        self._columns.set_row(telegram_id, profile)
+
+    def _apply_choice(self, chooser_id: int, chosen_id: int) -> None:
+        self._rated.setdefault(chooser_id, set()).add(chosen_id)
+
+    # ---------- Пошук ----------
+
+    def find_candidate_page(
+        self,
+        me: User,
+        criterion: str,
+        limit: int,
+        after=None,
+    ) -> tuple[list[int], object]:
+        """
+        Аналог function.find_candidate_page без запитів до БД:
+        (наступні limit id кандидатів після курсора after, новий курсор).
+        """
+        me_id = me.telegram_id
+        my_mask = me.interests_mask or 0
+
+        with self._lock:
+            self._drain()
+            rated = self._rated.get(me_id, set())
+
+            if criterion in ("location", "location_interests"):
+                if not me.region or (not me.city and not me.village):
+                    return [], None
+                if criterion == "location_interests" and not my_mask:
+                    return [], None
+
+                if criterion == "location_interests":
+                    return self._columns.rank_location_interests(
+                        me, rated | {me_id}, limit, after
+                    )
+
+                if me.city:
+                    ids = self._by_city.get((me.region, me.city), [])
+                else:
+                    ids = self._by_village.get((me.region, me.village), [])
+                source = self._after(ids, after)
+
+            elif criterion == "status":
+                if not me.status:
+                    return [], None
+                source = self._after(self._by_status.get(me.status, []), after)
+
+            elif criterion == "interests":
+                if not my_mask:
+                    return [], None
+                # Усі, в кого є хоч один мій інтерес (без дублікатів)
+                lists = [
+                    ids
+                    for bit, ids in self._by_interest.items()
+                    if my_mask & (1 << bit)
+                ]
+                pool = _unique_sorted(heapq.merge(*lists))
+                return self._rank(pool, me_id, rated, my_mask, limit, after)
+
+            else:
+                return [], None
+
+            result: list[int] = []
+            for telegram_id in source:
+                if telegram_id == me_id or telegram_id in rated:
+                    continue
+                result.append(telegram_id)
+                if len(result) >= limit:
+                    break
+
+            return result, (result[-1] if result else None)
+
+    def _rank(self, pool, me_id: int, rated: set[int], my_mask: int, limit: int, after):
+        """
+        Top-k за (score DESC, telegram_id ASC) через купу розміру limit —
+        без сортування всього пулу. score — кількість спільних інтересів.
+        """
+        profiles = self._profiles
+        last = None if after is None else (-after[0], after[1])
+
+        keys = (
+            (-(profiles[i][4] & my_mask).bit_count(), i)
+            for i in pool
+            if i != me_id and i not in rated
+        )
+        if last is not None:
+            keys = (key for key in keys if key > last)
+
+        top = heapq.nsmallest(limit, keys)
+        if not top:
+            return [], None
+        return [i for _, i in top], [-top[-1][0], top[-1][1]]
+
+    # ---------- Внутрішнє ----------
+
+    def _index_keys(self, profile: tuple):
+        """
+        Пари (індекс, ключ), у які потрапляє анкета з такими атрибутами.
+        """
+        region, city, village, status, mask, _age = profile
+
+        if region and city:
+            yield self._by_city, (region, city)
+        if region and village:
+            yield self._by_village, (region, village)
+        if status:
+            yield self._by_status, status
+
+        bit = 0
+        while mask >> bit:
+            if mask & (1 << bit):
+                yield self._by_interest, bit
+            bit += 1
+
+    def _unindex(self, telegram_id: int, profile: tuple) -> None:
+        for index, key in self._index_keys(profile):
+            ids = index.get(key)
+            if not ids:
+                continue
+            pos = bisect.bisect_left(ids, telegram_id)
+            if pos < len(ids) and ids[pos] == telegram_id:
+                del ids[pos]
+            if not ids:
+                del index[key]
+
+    @staticmethod
+    def _after(ids: list[int], after_id: int | None):
+        """
+        Ітератор по відсортованому списку, починаючи після after_id.
+        """
+        start = 0 if after_id is None else bisect.bisect_right(ids, after_id)
+        return (ids[i] for i in range(start, len(ids)))
+
+
+def _unique_sorted(iterable):
+    """
+    Прибирає підряд однакові значення з відсортованого потоку.
+    """
+    last = None
+    for value in iterable:
+        if value != last:
+            yield value
+            last = value
+
+
+# ==========================
+# ЕКЗЕМПЛЯР ПРОЦЕСУ
+# ==========================
+
+engine: MatchingEngine | None = None
+
+
+def is_enabled() -> bool:
+    """
+    True, якщо in-memory рушій увімкнений і вже завантажений.
+    """
+    return engine is not None
+
+
+def load_engine() -> int:
+    """
+    Створює та завантажує рушій, якщо MATCHING_ENGINE=memory.
+    Викликається на старті (bot_app.on_startup / main.main).
+
+    Повертає:
+        Кількість завантажених анкет (0, якщо рушій вимкнений).
+    """
+    global engine
+
+    if MATCHING_ENGINE != "memory":
+        return 0
+
+    new_engine = MatchingEngine()
+    loaded = new_engine.load()
+    engine = new_engine
+    return loaded
+
+
+def on_profile_changed(user: User) -> None:
+    """
+    Хук після commit анкети (реєстрація / редагування місця, статусу, інтересів):
+    оновлює дані активного рушія пошуку та скидає кеш когорти міста/села.
+    """
+    cohort_cache.on_profile_changed(user)
+
+    if engine is not None:
+        engine.upsert_user(user)
+    elif MATCHING_ENGINE == "precomputed":
+        recommendations.refresh_user_soon(user.telegram_id)
+
+
+def on_choice_recorded(chooser_id: int, chosen_id: int) -> None:
+    """
+    Хук після збереження лайку/дизлайку.
+    """
+    if engine is not None:
+        engine.record_choice(chooser_id, chosen_id)
@@ -0,0 +1,413 @@
+import asyncio
+import json
+import string
+import time
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from config import BOT_MESSAGES_CACHE_TTL
+from database import BotMessage, SessionLocal, engine
+
+
+# Канал Postgres LISTEN/NOTIFY, куди тригер на BotMessages шле зміни
+# (див. migrations.migrate_bot_messages_notify)
+BOT_MESSAGES_CHANNEL = "bot_messages_changed"
+
+# Пауза перед повторним підключенням слухача, якщо з'єднання впало
+LISTENER_RECONNECT_DELAY = 5
+
+
+# Які змінні код передає в кожен шаблон (render_bot_message(..., **kwargs)).
+# Шаблони, яких тут немає, рендеряться без змінних. Якщо текст у БД містить
+# плейсхолдер, якого код не передає, — це видно одразу при завантаженні,
+# а не користувачці у вигляді "[⚠️ Не вистачає змінної: ...]".
+TEMPLATE_PLACEHOLDERS: dict[str, set[str]] = {
+    "profile_region_selected": {"region"},
+    "profile_summary": {
+        "name", "nickname", "region", "location_line",
+        "age", "status", "interests", "bio",
+    },
+    "view_profile_card": {
+        "status_emoji", "name", "nickname", "region", "location",
+        "age", "status", "interests_block", "bio",
+    },
+    "edit_name_saved": {"name"},
+    "edit_nickname_saved": {"nickname"},
+    "edit_city_saved": {"region", "city"},
+    "edit_village_saved": {"region", "village"},
+    "edit_age_saved": {"age"},
+    "edit_status_saved": {"status"},
+    "match_new": {"mama", "contact"},
+    "match_candidate_profile": {"nickname", "age", "status", "bio"},
+    "likes_inbox_header": {"count"},
+    "matches_list_item": {"mama", "contact"},
+}
+
+_formatter = string.Formatter()
+
+
+# ==========================
+# СКОМПІЛЬОВАНИЙ ШАБЛОН
+# ==========================
+class CompiledTemplate:
+    """
+    Шаблон BotMessage, розібраний один раз при завантаженні.
+
+    - fields   — плейсхолдери в порядку появи ({name}, {age}, ...);
+    - problems — що не так із шаблоном (порожньо, якщо все ок).
+
+    render() лише склеює готові шматки тексту зі значеннями,
+    без повторного парсингу рядка на кожен виклик.
+    """
+
+    __slots__ = ("key", "text", "fields", "problems", "_parts", "_simple", "_broken")
+
+    def __init__(self, key: str, text: str):
+        self.key = key
+        self.text = text
+        self.problems: list[str] = []
+        self._broken = False
+
+        try:
+            parsed = list(_formatter.parse(text))
+        except ValueError as e:
+            # Непарні фігурні дужки тощо — віддаватимемо текст як є
+            self.problems.append(f"некоректний шаблон: {e}")
+            self._broken = True
+            parsed = []
+
+        fields: list[str] = []
+        parts: list[tuple[str, str | None, str, str | None]] = []
+        simple = True
+
+        for literal, field, spec, conversion in parsed:
+            if field is None:
+                parts.append((literal, None, "", None))
+                continue
+
+            # {user.name}, {items[0]}, {x:{width}} — рідкість, для них fallback на str.format
+            name = field.split(".", 1)[0].split("[", 1)[0]
+            if name != field or (spec and "{" in spec):
+                simple = False
+
+            if not name or name.isdigit():
+                self.problems.append(f"позиційний плейсхолдер {{{field}}} (потрібні іменовані)")
+                self._broken = True
+            elif name not in fields:
+                fields.append(name)
+
+            parts.append((literal, name, spec or "", conversion))
+
+        unknown = [f for f in fields if f not in TEMPLATE_PLACEHOLDERS.get(key, set())]
+        if unknown:
+            names = ", ".join(f"{{{f}}}" for f in unknown)
+            self.problems.append(f"код не передає змінні {names}")
+
+        self.fields = tuple(fields)
+        self._parts = parts
+        self._simple = simple
+
+    def render(self, kwargs: dict) -> str:
+        """
+        Підставляє змінні. Поведінка як у str.format, але:
+        - якщо змінної не вистачає — повертає шаблон з попередженням у кінці;
+        - якщо шаблон некоректний (зокрема не зійшовся зі значеннями при
+          підстановці: {user.name}, {items[0]}, {age:d} тощо) — повертає текст як є.
+        """
+        if self._broken:
+            return self.text
+
+        for name in self.fields:
+            if name not in kwargs:
+                return self.text + f"\n\n[⚠️ Не вистачає змінної: {name}]"
+
+        try:
+            return self._format(kwargs)
+        except (KeyError, AttributeError, IndexError, ValueError, TypeError) as e:
+            print(f"⚠ BotMessage '{self.key}': не вдалося підставити змінні: {e!r}")
+            return self.text
+
+    def _format(self, kwargs: dict) -> str:
+        if not self._simple:
+            return self.text.format(**kwargs)
+
+        out = []
+        for literal, name, spec, conversion in self._parts:
+            out.append(literal)
+            if name is None:
+                continue
+            value = kwargs[name]
+            if conversion == "r":
+                value = repr(value)
+            elif conversion == "a":
+                value = ascii(value)
+            elif conversion == "s":
+                value = str(value)
+            out.append(format(value, spec))
+        return "".join(out)
+
+
+def _compile(key: str, text: str | None) -> CompiledTemplate | None:
+    """
+    Компілює шаблон і одразу повідомляє про проблеми в ньому.
+    """
+    if text is None:
+        return None
+
+    compiled = CompiledTemplate(key, text)
+    for problem in compiled.problems:
+        print(f"⚠ BotMessage '{key}': {problem}")
+    return compiled
+
+
+# ==========================
+# КЕШ ШАБЛОНІВ BotMessage У ПАМ'ЯТІ ПРОЦЕСУ
+# ==========================
+
+# Ключ — (key, lang), значення — (шаблон, час завантаження за time.monotonic()).
+# Шаблон None — негативний кеш: такого ключа в БД немає, і до кінця TTL
+# ми його повторно не шукаємо.
+_templates: dict[tuple[str, str], tuple[CompiledTemplate | None, float]] = {}
+
+
+def get_template(session: Session, key: str, lang: str = "uk") -> CompiledTemplate | None:
+    """
+    Повертає скомпільований шаблон (key, lang) з кешу.
+
+    Якщо запису в кеші немає або він старший за BOT_MESSAGES_CACHE_TTL —
+    перечитуємо його з БД і кладемо в кеш (в т.ч. відсутність ключа).
+
+    Повертає:
+        CompiledTemplate або None, якщо такого ключа в БД немає.
+    """
+    now = time.monotonic()
+    cached = _templates.get((key, lang))
+    if cached is not None and now - cached[1] < BOT_MESSAGES_CACHE_TTL:
+        return cached[0]
+
+    text = session.execute(
+        select(BotMessage.text).filter_by(key=key, lang=lang)
+    ).scalar_one_or_none()
+
+    compiled = _compile(key, text)
+    _templates[(key, lang)] = (compiled, now)
+    return compiled
+
+
+def get_templates(
+    session: Session,
+    keys: list[str],
+    lang: str = "uk",
+) -> dict[str, CompiledTemplate | None]:
+    """
+    Те саме, що get_template, але для кількох ключів одразу.
+
+    Усе, чого немає в кеші (або прострочене), дочитуємо ОДНИМ запитом
+    WHERE key IN (...), тож на один апдейт — максимум один запит за текстами.
+
+    Повертає:
+        dict {key: шаблон або None, якщо ключа в БД немає}.
+    """
+    now = time.monotonic()
+    result: dict[str, CompiledTemplate | None] = {}
+    missing: list[str] = []
+
+    for key in dict.fromkeys(keys):  # унікальні ключі, порядок зберігаємо
+        cached = _templates.get((key, lang))
+        if cached is not None and now - cached[1] < BOT_MESSAGES_CACHE_TTL:
+            result[key] = cached[0]
+        else:
+            missing.append(key)
+
+    if missing:
+        rows = session.execute(
+            select(BotMessage.key, BotMessage.text)
+            .where(BotMessage.key.in_(missing), BotMessage.lang == lang)
+        ).all()
+        found = dict(rows)
+
+        for key in missing:
+            compiled = _compile(key, found.get(key))
+            _templates[(key, lang)] = (compiled, now)
+            result[key] = compiled
+
+    return result
+
+
+def preload_templates() -> int:
+    """
+    Завантажує всі тексти з BotMessages одним запитом, компілює їх
+    і повністю оновлює кеш.
+
+    Викликається на старті бота (bot_app.on_startup / main.main), щоб перші
+    апдейти вже не ходили в БД за текстами, а зламані шаблони
+    (див. TEMPLATE_PLACEHOLDERS) було видно в логах одразу.
+
+    Повертає:
+        Кількість завантажених шаблонів.
+    """
+    session = SessionLocal()
+    try:
+        rows = session.execute(
+            select(BotMessage.key, BotMessage.lang, BotMessage.text)
+        ).all()
+    finally:
+        session.close()
+
+    # Компілюємо окремо і підміняємо вміст кешу за раз: preload може йти
+    # з потоку, поки event loop читає кеш
+    now = time.monotonic()
+    fresh = {(key, lang): (_compile(key, text), now) for key, lang, text in rows}
+    _templates.clear()
+    _templates.update(fresh)
+
+    return len(rows)
+
+
+def invalidate_template(key: str | None = None, lang: str | None = None) -> None:
+    """
+    Викидає шаблон з кешу — наступний render_bot_message перечитає його з БД.
+
+    - key=None          → чистимо весь кеш;
+    - lang=None         → чистимо ключ для всіх мов;
+    - інакше            → лише (key, lang).
+    """
+    if key is None:
+        _templates.clear()
+        return
+
+    if lang is not None:
+        _templates.pop((key, lang), None)
+        return
+
+    for cached_key in [k for k in _templates if k[0] == key]:
+        _templates.pop(cached_key, None)
+
+
+# ==========================
+# СЛУХАЧ ЗМІН BotMessages (Postgres LISTEN/NOTIFY)
+# ==========================
+# Коли запущено кілька реплік bot_app, кожна тримає свій кеш. Тригер на
+# BotMessages шле NOTIFY з (key, lang) зміненого рядка, а слухач у кожній
+# репліці викидає з кешу тільки цей ключ — без періодичного опитування таблиці.
+
+_listen_conn = None
+_listen_fd: int | None = None
+_reconnect_task: asyncio.Task | None = None
+
+
+def _handle_notification(payload: str) -> None:
+    """
+    Обробляє один NOTIFY: "*" — скинути весь кеш, інакше JSON {"key", "lang"}.
+    """
+    if payload == "*":
+        invalidate_template()
+        return
+
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        # Незрозумілий payload — надійніше скинути все
+        invalidate_template()
+        return
+
+    invalidate_template(data.get("key"), data.get("lang"))
+
+
+def _connect_listener():
+    """
+    Відкриває окреме (не з пулу) з'єднання в autocommit-режимі та підписується на канал.
+    """
+    cargs, cparams = engine.dialect.create_connect_args(engine.url)
+    conn = engine.dialect.connect(*cargs, **cparams)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"LISTEN {BOT_MESSAGES_CHANNEL}")
+    return conn
+
+
+def _on_listener_readable() -> None:
+    """
+    Колбек event loop: на сокеті слухача є дані — забираємо всі NOTIFY.
+    """
+    conn = _listen_conn
+    try:
+        conn.poll()
+    except Exception as e:
+        print(f"⚠ Слухач BotMessages втратив з'єднання: {e}")
+        global _reconnect_task
+        stop_templates_listener()
+        _reconnect_task = asyncio.get_running_loop().create_task(_reconnect_listener())
+        return
+
+    while conn.notifies:
+        notify = conn.notifies.pop(0)
+        _handle_notification(notify.payload)
+
+
+async def _reconnect_listener() -> None:
+    """
+    Перепідключає слухача з паузою. Поки його не було, зміни могли загубитись,
+    тому після підключення повністю перечитуємо кеш.
+
+    І підключення, і перечитування — блокуючий psycopg2, тож у потоці:
+    поки БД лежить, спроби не зупиняють event loop.
+    """
+    while _listen_conn is None:
+        await asyncio.sleep(LISTENER_RECONNECT_DELAY)
+        try:
+            await start_templates_listener()
+        except Exception as e:
+            print(f"⚠ Не вдалося перепідключити слухача BotMessages: {e}")
+            continue
+        try:
+            await asyncio.to_thread(preload_templates)
+        except Exception as e:
+            print(f"⚠ Не вдалося перечитати BotMessages після перепідключення: {e}")
+
+
+async def start_templates_listener() -> None:
+    """
+    Запускає фонового слухача змін BotMessages у поточному event loop.
+
+    Викликається на старті (bot_app.on_startup / main.main). Постійного
+    потоку не тримає: лише connect іде через to_thread, а сокет з'єднання
+    просто реєструється в event loop.
+    """
+    global _listen_conn, _listen_fd
+
+    if _listen_conn is not None:
+        return
+
+    # Блокуючий connect — у потоці, щоб не тримати event loop
+    conn = await asyncio.to_thread(_connect_listener)
+    if _listen_conn is not None:
+        # Поки підключались, слухача вже запустили
+        conn.close()
+        return
+    _listen_conn, _listen_fd = conn, conn.fileno()
+    asyncio.get_running_loop().add_reader(_listen_fd, _on_listener_readable)
+
+
+def stop_templates_listener() -> None:
+    """
+    Зупиняє слухача та закриває його з'єднання (на shutdown або при обриві).
+    """
+    global _listen_conn, _listen_fd
+
+    conn, _listen_conn = _listen_conn, None
+    fd, _listen_fd = _listen_fd, None
+    if conn is None:
+        return
+
+    try:
+        asyncio.get_running_loop().remove_reader(fd)
+    except RuntimeError:
+        # Немає активного event loop (наприклад, процес уже зупиняється)
+        pass
+
+    try:
+        conn.close()
+    except Exception:
+        pass
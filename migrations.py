@@ -0,0 +1,368 @@
+import json
+import sys
+
+from sqlalchemy import text, update, case, literal, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Connection
+
+from config import INTEREST_OPTIONS, MATCH_QUEUE_SIZE
+from database import engine, create_tables, User, Choice, SessionLocal
+from function import candidate_ids_query, liked_by
+from message_cache import BOT_MESSAGES_CHANNEL
+
+
+# ==========================
+# МІГРАЦІЇ СХЕМИ (ідемпотентні)
+# ==========================
+# create_tables() створює лише таблиці, яких ще немає, і не чіпає існуючі.
+# Усе, що треба дотягнути в уже робочій БД (тригери, індекси, нові колонки),
+# живе тут. Кожну міграцію можна запускати скільки завгодно разів:
+#   python migrations.py
+
+
+def migrate_bot_messages_notify(conn: Connection) -> None:
+    """
+    Тригер на BotMessages, який шле NOTIFY при кожній зміні тексту.
+
+    Payload — JSON {"key": ..., "lang": ...} зміненого рядка
+    (для UPDATE — і старий, і новий ключ). На TRUNCATE шлемо "*",
+    тобто "скинь увесь кеш". Слухач — message_cache.start_templates_listener().
+    """
+    conn.execute(text(f"""
+        CREATE OR REPLACE FUNCTION bot_messages_notify() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                PERFORM pg_notify('{BOT_MESSAGES_CHANNEL}', '*');
+                RETURN NULL;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM pg_notify(
+                    '{BOT_MESSAGES_CHANNEL}',
+                    json_build_object('key', OLD.key, 'lang', OLD.lang)::text
+                );
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM pg_notify(
+                    '{BOT_MESSAGES_CHANNEL}',
+                    json_build_object('key', NEW.key, 'lang', NEW.lang)::text
+                );
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """))
+
+    conn.execute(text('DROP TRIGGER IF EXISTS trg_bot_messages_notify ON "BotMessages"'))
+    conn.execute(text("""
+        CREATE TRIGGER trg_bot_messages_notify
+        AFTER INSERT OR UPDATE OR DELETE ON "BotMessages"
+        FOR EACH ROW EXECUTE FUNCTION bot_messages_notify()
+    """))
+
+    conn.execute(text('DROP TRIGGER IF EXISTS trg_bot_messages_truncate ON "BotMessages"'))
+    conn.execute(text("""
+        CREATE TRIGGER trg_bot_messages_truncate
+        AFTER TRUNCATE ON "BotMessages"
+        FOR EACH STATEMENT EXECUTE FUNCTION bot_messages_notify()
+    """))
+
+
+def migrate_users_interests_jsonb(conn: Connection) -> None:
+    """
+    Users.interests: JSON → JSONB.
+
+    JSONB потрібен для оператора ? (has_key), яким migrate_users_interests_mask
+    рахує маски інтересів прямо в SQL.
+    """
+    data_type = conn.execute(text("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'Users' AND column_name = 'interests'
+    """)).scalar_one_or_none()
+
+    if data_type == "json":
+        conn.execute(text(
+            'ALTER TABLE "Users" ALTER COLUMN interests TYPE JSONB USING interests::jsonb'
+        ))
+
+
+def migrate_users_interests_mask(conn: Connection) -> None:
+    """
+    Колонка Users.interests_mask + перерахунок масок з Users.interests.
+
+    Біт i = INTEREST_OPTIONS[i] (як у function.interests_to_mask).
+    Маску рахуємо одним UPDATE, але переписуємо лише рядки, де вона
+    розʼїхалась: звичайний повторний запуск нічого не чіпає, а після
+    доповнення INTEREST_OPTIONS оновляться тільки потрібні анкети.
+
+    GIN-індекс по interests (пошук через ?|) більше нічим не читається —
+    спільні інтереси рахуються по масці, — тож його прибираємо, щоб не
+    обслуговувати на кожен запис анкети.
+    """
+    conn.execute(text("DROP INDEX IF EXISTS ix_users_interests_gin"))
+
+    conn.execute(text(
+        'ALTER TABLE "Users" ADD COLUMN IF NOT EXISTS '
+        "interests_mask BIGINT NOT NULL DEFAULT 0"
+    ))
+
+    mask = literal(0)
+    for i, interest in enumerate(INTEREST_OPTIONS):
+        mask = mask.op("|")(case((User.interests.has_key(interest), 1 << i), else_=0))
+
+    conn.execute(
+        update(User)
+        .where(
+            User.interests.is_not(None),
+            User.interests_mask.is_distinct_from(mask),
+        )
+        .values(interests_mask=mask)
+    )
+
+
+def migrate_users_matching_indexes(conn: Connection) -> None:
+    """
+    Складені індекси під пошук кандидатів за місцем проживання та статусом.
+
+    Без них find_candidate_page на великій таблиці робить Seq Scan по Users.
+    Перевірити, що запити їх справді використовують:
+        python migrations.py --explain
+    """
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_users_region_city '
+        'ON "Users" (region, city, telegram_id)'
+    ))
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_users_region_village '
+        'ON "Users" (region, village, telegram_id)'
+    ))
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_users_status '
+        'ON "Users" (status, telegram_id)'
+    ))
+
+
+def migrate_choices_incoming_likes_index(conn: Connection) -> None:
+    """
+    Частковий індекс вхідних лайків: (chosen_id, chooser_id) WHERE choice_type = 'LIKE'.
+
+    Перевірка взаємного лайку (function.liked_by) і "хто лайкнув мене" йдуть
+    index-only scan по ньому, а не по PK з дочитуванням choice_type з таблиці.
+
+    ⚠️ На дуже великій таблиці Choices CREATE INDEX блокує запис на час
+    побудови — тоді краще заздалегідь створити його вручну:
+        CREATE INDEX CONCURRENTLY ix_choices_incoming_likes ...
+    (IF NOT EXISTS нижче його просто пропустить).
+    """
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_choices_incoming_likes '
+        'ON "Choices" (chosen_id, chooser_id) WHERE choice_type = \'LIKE\''
+    ))
+
+
+def migrate_users_unread_likes(conn: Connection) -> None:
+    """
+    Колонка Users.unread_likes + разове заповнення лічильника з Choices:
+    вхідні LIKE від тих, кого користувачка ще не оцінила.
+
+    Заповнюємо лише тоді, коли колонку щойно додали: далі лічильник
+    підтримує шлях запису виборів, а повторний перерахунок на кожному
+    деплої затирав би живі інкременти і ріс разом з Choices.
+    ADD COLUMN тримає ACCESS EXCLUSIVE на Users до коміту, тож паралельні
+    записи виборів дочекаються заповнення, а не загубляться.
+    """
+    exists_already = conn.execute(text("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'Users' AND column_name = 'unread_likes'
+    """)).scalar_one_or_none()
+    if exists_already:
+        return
+
+    conn.execute(text(
+        'ALTER TABLE "Users" ADD COLUMN unread_likes INTEGER NOT NULL DEFAULT 0'
+    ))
+    conn.execute(text("""
+        UPDATE "Users" u SET unread_likes = (
+            SELECT count(*) FROM "Choices" c
+            WHERE c.chosen_id = u.telegram_id
+              AND c.choice_type = 'LIKE'
+              AND NOT EXISTS (
+                  SELECT 1 FROM "Choices" r
+                  WHERE r.chooser_id = u.telegram_id AND r.chosen_id = c.chooser_id
+              )
+        )
+        WHERE EXISTS (
+            SELECT 1 FROM "Choices" c
+            WHERE c.chosen_id = u.telegram_id AND c.choice_type = 'LIKE'
+        )
+    """))
+
+
+def backfill_matches(conn: Connection) -> None:
+    """
+    Заповнює Matches з уже наявних взаємних лайків у Choices
+    (два симетричні рядки на пару; час метчу — час другого лайку).
+
+    Self-join усіх Choices — тому лише раз, коли таблицю Matches щойно
+    створено (див. BACKFILLS); далі нові метчі пише шлях запису виборів.
+    """
+    conn.execute(text("""
+        INSERT INTO "Matches" (user_id, match_id, created_at)
+        SELECT a.chooser_id, a.chosen_id,
+               COALESCE(GREATEST(a.created_at, b.created_at), now() AT TIME ZONE 'utc')
+        FROM "Choices" a
+        JOIN "Choices" b ON b.chooser_id = a.chosen_id AND b.chosen_id = a.chooser_id
+        WHERE a.choice_type = 'LIKE' AND b.choice_type = 'LIKE'
+        ON CONFLICT DO NOTHING
+    """))
+
+
+def migrate_users_blocked_at(conn: Connection) -> None:
+    """
+    Колонка Users.blocked_at — позначка "бот заблокований" для розсилок
+    (broadcast.py пропускає такі анкети).
+    """
+    conn.execute(text('ALTER TABLE "Users" ADD COLUMN IF NOT EXISTS blocked_at TIMESTAMP'))
+
+
+def migrate_broadcast_failed_ids(conn: Connection) -> None:
+    """
+    Колонка BroadcastCheckpoints.failed_ids — кому розсилка ще має дослати
+    після тимчасової помилки (broadcast.py).
+    """
+    conn.execute(text(
+        'ALTER TABLE "BroadcastCheckpoints" ADD COLUMN IF NOT EXISTS '
+        "failed_ids JSONB NOT NULL DEFAULT '[]'"
+    ))
+
+
+# Порядок важливий: нові міграції додаємо в кінець списку
+MIGRATIONS = [
+    migrate_bot_messages_notify,
+    migrate_users_interests_jsonb,
+    migrate_users_interests_mask,
+    migrate_users_matching_indexes,
+    migrate_choices_incoming_likes_index,
+    migrate_users_unread_likes,
+    migrate_users_blocked_at,
+    migrate_broadcast_failed_ids,
+]
+
+# Разові заповнення нових таблиць з уже наявних даних: запускаються лише
+# в той прогін, коли create_tables() щойно створив таблицю
+BACKFILLS = {
+    "Matches": backfill_matches,
+}
+
+
+def run_migrations() -> None:
+    """
+    Створює відсутні таблиці та проганяє всі міграції в одній транзакції,
+    а для щойно створених таблиць — ще й їх разові заповнення (BACKFILLS).
+    """
+    created = create_tables()
+    with engine.begin() as conn:
+        for migration in MIGRATIONS:
+            migration(conn)
+            print(f"✅ {migration.__name__}")
+
+        for table, backfill in BACKFILLS.items():
+            if table in created:
+                backfill(conn)
+                print(f"✅ {backfill.__name__}")
+
+
+# ==========================
+# EXPLAIN-ПЕРЕВІРКА ІНДЕКСІВ
+# ==========================
+
+def _plan_indexes(plan: dict) -> set[str]:
+    """
+    Збирає назви всіх індексів, які використовує план (рекурсивно по вузлах).
+    """
+    found = set()
+    if "Index Name" in plan:
+        found.add(plan["Index Name"])
+    for child in plan.get("Plans", []):
+        found |= _plan_indexes(child)
+    return found
+
+
+def _explain_uses(session, title: str, statement, index_names: list[str]) -> bool:
+    """
+    EXPLAIN одного запиту: True, якщо план використовує хоч один з index_names.
+    """
+    sql = statement.compile(
+        dialect=postgresql.dialect(),
+        compile_kwargs={"literal_binds": True},
+    )
+    raw = session.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+    plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+
+    used = _plan_indexes(plan)
+    matched = [name for name in index_names if name in used]
+    if matched:
+        print(f"✅ {title}: {matched[0]}")
+        return True
+
+    print(
+        f"⚠ {title}: очікували {' / '.join(index_names)}, "
+        f"а план використовує: {sorted(used) or 'Seq Scan'}"
+    )
+    return False
+
+
+def explain_matching_queries() -> bool:
+    """
+    Проганяє EXPLAIN для запитів пошуку кандидатів (як у find_candidate_page)
+    і перевірки взаємного лайку та перевіряє, що вони йдуть по індексах із
+    migrate_users_matching_indexes / migrate_choices_incoming_likes_index.
+
+    За зразок беремо реальні анкети з БД (з містом, із селом, зі статусом).
+    На маленькій таблиці Postgres чесно обирає Seq Scan — це нормально,
+    показовий результат буде на реальному обсязі даних.
+
+    Повертає:
+        True, якщо всі перевірені запити використовують очікуваний індекс.
+    """
+    checks = [
+        ("location (місто)", "location", User.city.is_not(None), "ix_users_region_city"),
+        ("location (село)", "location", User.village.is_not(None), "ix_users_region_village"),
+        # Статусів лише два, тож при LIMIT Postgres часто вигідніше йти по PK
+        # у порядку telegram_id і відсіювати статус на льоту — теж без Seq Scan
+        ("status", "status", User.status.is_not(None), "ix_users_status", "Users_pkey"),
+    ]
+
+    ok = True
+    session = SessionLocal()
+    try:
+        for title, criterion, sample_filter, *index_names in checks:
+            me = session.scalars(select(User).where(sample_filter).limit(1)).first()
+            if me is None:
+                print(f"➖ {title}: немає анкети-зразка, пропускаю")
+                continue
+
+            q = candidate_ids_query(session, me, criterion, MATCH_QUEUE_SIZE)
+            ok &= _explain_uses(session, title, q.statement, index_names)
+
+        like = session.scalars(
+            select(Choice).where(Choice.choice_type == "LIKE").limit(1)
+        ).first()
+        if like is None:
+            print("➖ взаємний лайк: немає лайків-зразків, пропускаю")
+        else:
+            ok &= _explain_uses(
+                session,
+                "взаємний лайк",
+                select(liked_by(like.chooser_id, like.chosen_id)),
+                ["ix_choices_incoming_likes"],
+            )
+    finally:
+        session.close()
+
+    return ok
+
+
+if __name__ == "__main__":
+    if "--explain" in sys.argv:
+        sys.exit(0 if explain_matching_queries() else 1)
+    run_migrations()
@@ -0,0 +1,214 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from sqlalchemy import select, update
+
+from config import (
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_POLL_INTERVAL,
+    OUTBOX_LEASE_SECONDS,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_RETRY_DELAY,
+)
+from database import engine, SessionLocal, NotificationOutbox, User
+from function import render_match_notifications
+import throttling
+
+
+# ==========================
+# ВОРКЕР NotificationOutbox
+# ==========================
+# Сповіщення про метч пишуться в NotificationOutbox у тій самій транзакції,
+# що й метч, а надсилає їх цей фоновий воркер — поза хендлером лайку.
+#
+# Кожна ітерація:
+#   1) одним UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED LIMIT n)
+#      бронює пачку рядків (available_at += OUTBOX_LEASE_SECONDS) — кілька
+#      реплік беруть різні рядки і не чекають одна одну;
+#   2) надсилає пачку паралельно (PRIORITY_HIGH у черзі вихідних);
+#   3) позначає надіслані (sent_at), решту відкладає на повтор.
+#
+# Доставка "хоча б раз": якщо процес впаде між відправкою і кроком 3, рядок
+# після lease візьмуть ще раз. Дублів подій немає — на (kind, user_id,
+# other_id) унікальний ключ, а sent_at ставимо лише ненадісланим.
+
+_wake = asyncio.Event()
+_worker_task: asyncio.Task | None = None
+
+
+def _claim_batch() -> list[tuple[int, int, str | None]]:
+    """
+    Бронює до OUTBOX_BATCH_SIZE готових сповіщень і рендерить їх тексти
+    (синхронно, з потоку).
+
+    Повертає:
+        [(id, кому, текст або None — якщо анкети вже немає)]
+    """
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        pending = (
+            select(NotificationOutbox.id)
+            .where(
+                NotificationOutbox.sent_at.is_(None),
+                NotificationOutbox.available_at <= now,
+                NotificationOutbox.kind == "match",
+            )
+            .order_by(NotificationOutbox.available_at, NotificationOutbox.id)
+            .limit(OUTBOX_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+        claimed = conn.execute(
+            update(NotificationOutbox)
+            .where(NotificationOutbox.id.in_(pending))
+            .values(
+                available_at=now + timedelta(seconds=OUTBOX_LEASE_SECONDS),
+                attempts=NotificationOutbox.attempts + 1,
+            )
+            .returning(NotificationOutbox.id, NotificationOutbox.user_id, NotificationOutbox.other_id)
+        ).all()
+
+    if not claimed:
+        return []
+
+    session = SessionLocal()
+    try:
+        others = {
+            u.telegram_id: u
+            for u in session.query(User).filter(
+                User.telegram_id.in_({r.other_id for r in claimed})
+            )
+        }
+        ready = [r for r in claimed if r.other_id in others]
+        texts = dict(zip(
+            [r.id for r in ready],
+            render_match_notifications(session, [others[r.other_id] for r in ready]),
+        ))
+    finally:
+        session.close()
+
+    return [(r.id, r.user_id, texts.get(r.id)) for r in claimed]
+
+
+def _finish(results: list[tuple[int, Exception | None]]) -> None:
+    """
+    Записує результат відправки пачки (синхронно, з потоку):
+    - надіслано → sent_at;
+    - бот заблокований / чат не знайдено / спроби вичерпано → sent_at + last_error
+      (більше не пробуємо);
+    - інша помилка → повтор через OUTBOX_RETRY_DELAY * 2^(спроба - 1) сек.
+    """
+    now = datetime.utcnow()
+    sent = [outbox_id for outbox_id, error in results if error is None]
+    failed = {outbox_id: error for outbox_id, error in results if error is not None}
+
+    with engine.begin() as conn:
+        if sent:
+            conn.execute(
+                update(NotificationOutbox)
+                .where(NotificationOutbox.id.in_(sent), NotificationOutbox.sent_at.is_(None))
+                .values(sent_at=now, last_error=None)
+            )
+
+        if not failed:
+            return
+
+        attempts = dict(conn.execute(
+            select(NotificationOutbox.id, NotificationOutbox.attempts)
+            .where(NotificationOutbox.id.in_(failed))
+        ).all())
+        for outbox_id, error in failed.items():
+            give_up = (
+                isinstance(error, (TelegramForbiddenError, TelegramBadRequest, LookupError))
+                or attempts.get(outbox_id, OUTBOX_MAX_ATTEMPTS) >= OUTBOX_MAX_ATTEMPTS
+            )
+            delay = OUTBOX_RETRY_DELAY * 2 ** (attempts.get(outbox_id, 1) - 1)
+            conn.execute(
+                update(NotificationOutbox)
+                .where(NotificationOutbox.id == outbox_id, NotificationOutbox.sent_at.is_(None))
+                .values(
+                    last_error=str(error)[:1000],
+                    **({"sent_at": now} if give_up else {"available_at": now + timedelta(seconds=delay)}),
+                )
+            )
+
+
+async def _send(bot, chat_id: int, text: str | None) -> None:
+    if text is None:
+        raise LookupError("анкети, про яку сповіщення, вже немає")
+    await bot.send_message(
+        chat_id=chat_id,
+        text=text,
+        parse_mode="HTML",
+        disable_web_page_preview=True,
+    )
+
+
+async def deliver_batch(bot) -> int:
+    """
+    Одна ітерація воркера: бронює пачку, надсилає, фіксує результат.
+
+    Повертає:
+        Скільки сповіщень було в пачці (0 — черга порожня).
+    """
+    batch = await asyncio.to_thread(_claim_batch)
+    if not batch:
+        return 0
+
+    # Усю пачку — паралельно; черга вихідних тримає ліміти Telegram
+    with throttling.priority(throttling.PRIORITY_HIGH):
+        errors = await asyncio.gather(
+            *[_send(bot, chat_id, text) for _, chat_id, text in batch],
+            return_exceptions=True,
+        )
+
+    results = [(outbox_id, error) for (outbox_id, _, _), error in zip(batch, errors)]
+    for (outbox_id, chat_id, _), error in zip(batch, errors):
+        if error is not None:
+            print(f"⚠ Сповіщення #{outbox_id} користувачу {chat_id} не надіслано: {error}")
+
+    await asyncio.to_thread(_finish, results)
+    return len(batch)
+
+
+async def _outbox_loop(bot) -> None:
+    while True:
+        try:
+            delivered = await deliver_batch(bot)
+        except Exception as e:
+            print(f"⚠ Помилка воркера NotificationOutbox: {e}")
+            delivered = 0
+
+        # Повна пачка — мабуть, є ще; інакше чекаємо побудки або опитування
+        if delivered < OUTBOX_BATCH_SIZE:
+            try:
+                await asyncio.wait_for(_wake.wait(), OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            _wake.clear()
+
+
+def wake_outbox_worker() -> None:
+    """
+    Щойно записали нові сповіщення — воркер візьметься за них одразу,
+    а не на наступному опитуванні.
+    """
+    _wake.set()
+
+
+def start_outbox_worker(bot) -> None:
+    """
+    Запускає воркер. Викликається на старті (bot_app / main).
+    """
+    global _worker_task
+
+    if _worker_task is None:
+        _worker_task = asyncio.get_running_loop().create_task(_outbox_loop(bot))
+
+
+def stop_outbox_worker() -> None:
+    global _worker_task
+
+    task, _worker_task = _worker_task, None
+    if task is not None:
+        task.cancel()
@@ -0,0 +1,345 @@
+import asyncio
+import time
+
+from sqlalchemy import select, insert, delete, exists, and_, or_, case, literal, func, true
+from sqlalchemy.orm import Session, aliased
+
+from config import (
+    INTEREST_OPTIONS,
+    MATCHING_ENGINE,
+    RANKED_CRITERIA,
+    RECOMMENDATIONS_PER_USER,
+    RECOMMENDATIONS_REFRESH_INTERVAL,
+    RECOMMENDATIONS_REFRESH_BATCH,
+)
+from database import engine, User, Choice, Recommendation
+
+
+# ==========================
+# ГОТОВІ КАНДИДАТИ (MATCHING_ENGINE=precomputed)
+# ==========================
+# Замість пошуку на кожен свайп — таблиця Recommendations, яку:
+#   - повністю перераховує фонова задача раз на RECOMMENDATIONS_REFRESH_INTERVAL
+#     (пачками по RECOMMENDATIONS_REFRESH_BATCH анкет, по одному set-based
+#     INSERT ... SELECT на критерій для всієї пачки; серед реплік це робить
+#     лише одна — та, що тримає _LEADER_LOCK);
+#   - точково оновлює refresh_user() після збереження / редагування анкети
+#     (з хендлерів — refresh_user_soon(), у потоці).
+# run_match_flow лише читає наступну сторінку по індексу ix_recommendations_page.
+
+CRITERIA = ("location", "status", "interests", "location_interests")
+
+# Ключі pg_advisory-локів:
+# - _LEADER_LOCK — сесійний лок "хто з реплік рахує повний перерахунок";
+# - _WRITE_LOCK  — транзакційний лок на запис Recommendations: refresh_all і
+#   refresh_user не пишуть одночасно (інакше конфлікт по PK відкотить перерахунок).
+_LEADER_LOCK = 7_140_001
+_WRITE_LOCK = 7_140_002
+
+# Зʼєднання, яке тримає _LEADER_LOCK (None — ця репліка не лідер)
+_leader_conn = None
+
+_refresh_task: asyncio.Task | None = None
+
+# Фонові refresh_user_soon — тримаємо посилання, щоб їх не прибрав GC
+_user_refresh_tasks: set[asyncio.Task] = set()
+
+
+def _pair_conditions(me, other, criterion: str) -> list:
+    """
+    Умови "other — кандидат для me" за критерієм (me, other — аліаси User).
+
+    Ті самі правила, що й у function._candidates_query, але для пар анкет,
+    а не для однієї конкретної користувачки.
+    """
+    same_place = and_(
+        me.region.is_not(None),
+        other.region == me.region,
+        or_(
+            and_(me.city.is_not(None), other.city == me.city),
+            and_(me.city.is_(None), me.village.is_not(None), other.village == me.village),
+        ),
+    )
+    common_interest = me.interests_mask.op("&")(other.interests_mask) != 0
+
+    if criterion == "location":
+        conditions = [same_place]
+    elif criterion == "status":
+        conditions = [me.status.is_not(None), other.status == me.status]
+    elif criterion == "interests":
+        conditions = [common_interest]
+    else:
+        conditions = [same_place, common_interest]
+
+    return conditions + [
+        other.telegram_id != me.telegram_id,
+        # correlate_except: me — з зовнішнього запиту, крізь LATERAL
+        ~exists().where(
+            Choice.chooser_id == me.telegram_id,
+            Choice.chosen_id == other.telegram_id,
+        ).correlate_except(Choice),
+    ]
+
+
+def _pair_score(me, other, criterion: str):
+    """
+    Кількість спільних інтересів пари (popcount перетину масок); 0 — якщо
+    критерій не ранжується.
+    """
+    if criterion not in RANKED_CRITERIA:
+        return literal(0)
+
+    common = me.interests_mask.op("&")(other.interests_mask)
+    score = literal(0)
+    for bit in range(len(INTEREST_OPTIONS)):
+        score = score + case((common.op("&")(1 << bit) != 0, 1), else_=0)
+    return score
+
+
+def _pairs_select(criterion: str, user_ids: list[int] | None = None, candidate_id: int | None = None):
+    """
+    SELECT (user_id, criterion, candidate_id, score): для кожної анкети —
+    її RECOMMENDATIONS_PER_USER найкращих кандидатів за критерієм.
+
+    Top-K кожної анкети — окремий CROSS JOIN LATERAL (... ORDER BY ... LIMIT k),
+    а не row_number() по всіх парах: для location / status його обслуговують
+    індекси ix_users_region_* / ix_users_status і кожна анкета читає лише
+    k рядків. Ранжовані критерії рахують score по кандидатах своєї анкети,
+    але в памʼяті тримають лише її top-K.
+    """
+    me, other = aliased(User), aliased(User)
+    score = _pair_score(me, other, criterion)
+
+    if criterion in RANKED_CRITERIA:
+        order_by = (score.desc(), other.telegram_id)
+    else:
+        # score = 0 — порядок лише за telegram_id, як в індексах
+        order_by = (other.telegram_id,)
+
+    top = (
+        select(other.telegram_id.label("candidate_id"), score.label("score"))
+        .where(*_pair_conditions(me, other, criterion))
+        .order_by(*order_by)
+        .limit(RECOMMENDATIONS_PER_USER)
+    )
+    if candidate_id is not None:
+        top = top.where(other.telegram_id == candidate_id)
+    top = top.lateral("top")
+
+    stmt = (
+        select(
+            me.telegram_id.label("user_id"),
+            literal(criterion).label("criterion"),
+            top.c.candidate_id,
+            top.c.score,
+        )
+        .select_from(me)
+        .join(top, true())
+    )
+    if user_ids is not None:
+        stmt = stmt.where(me.telegram_id.in_(user_ids))
+    return stmt
+
+
+def _insert_pairs(conn, criterion: str, **filters) -> int:
+    result = conn.execute(
+        insert(Recommendation).from_select(
+            ["user_id", "criterion", "candidate_id", "score"],
+            _pairs_select(criterion, **filters),
+        )
+    )
+    return result.rowcount
+
+
+def refresh_all() -> int:
+    """
+    Повністю перераховує Recommendations (синхронно, викликати з потоку).
+
+    Keyset по анкетах пачками по RECOMMENDATIONS_REFRESH_BATCH: кожна пачка —
+    окрема транзакція (DELETE списків пачки + INSERT нових), тож _WRITE_LOCK
+    тримаємо недовго (refresh_user чекає щонайбільше одну пачку), а WAL і
+    мертві рядки на транзакцію обмежені. Списки кожної анкети підміняються
+    атомарно — читачі бачать або старий, або новий список, а не порожній.
+
+    Повертає:
+        Кількість записаних рядків.
+    """
+    total = 0
+    after = None
+    while True:
+        with engine.begin() as conn:
+            conn.execute(select(func.pg_advisory_xact_lock(_WRITE_LOCK)))
+
+            batch = select(User.telegram_id).order_by(User.telegram_id).limit(RECOMMENDATIONS_REFRESH_BATCH)
+            if after is not None:
+                batch = batch.where(User.telegram_id > after)
+            user_ids = list(conn.scalars(batch))
+            if not user_ids:
+                return total
+
+            conn.execute(delete(Recommendation).where(Recommendation.user_id.in_(user_ids)))
+            for criterion in CRITERIA:
+                total += _insert_pairs(conn, criterion, user_ids=user_ids)
+
+        after = user_ids[-1]
+
+
+def refresh_user(user_id: int) -> None:
+    """
+    Оновлює рекомендації однієї анкети після її збереження / редагування:
+    - її власні списки кандидатів за всіма критеріями;
+    - її місце в чужих списках (критерії симетричні, тож це ті самі пари
+      у зворотний бік; чужі списки тут не обрізаємо — це зробить наступний
+      повний перерахунок).
+    """
+    with engine.begin() as conn:
+        conn.execute(select(func.pg_advisory_xact_lock(_WRITE_LOCK)))
+        conn.execute(delete(Recommendation).where(
+            or_(Recommendation.user_id == user_id, Recommendation.candidate_id == user_id)
+        ))
+        for criterion in CRITERIA:
+            _insert_pairs(conn, criterion, user_ids=[user_id])
+            _insert_pairs(conn, criterion, candidate_id=user_id)
+
+
+async def _refresh_user_in_thread(user_id: int) -> None:
+    try:
+        await asyncio.to_thread(refresh_user, user_id)
+    except Exception as e:
+        print(f"⚠ Не вдалося оновити Recommendations для {user_id}: {e}")
+
+
+def refresh_user_soon(user_id: int) -> None:
+    """
+    refresh_user без блокування event loop: з хендлера — фоном у потоці,
+    поза event loop (скрипти) — одразу.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        refresh_user(user_id)
+        return
+
+    task = loop.create_task(_refresh_user_in_thread(user_id))
+    _user_refresh_tasks.add(task)
+    task.add_done_callback(_user_refresh_tasks.discard)
+
+
+def find_candidate_page(
+    session: Session,
+    me: User,
+    criterion: str,
+    limit: int,
+    after=None,
+) -> tuple[list[int], object]:
+    """
+    Аналог function.find_candidate_page: наступна сторінка з Recommendations
+    (діапазон індексу ix_recommendations_page), з тими самими курсорами.
+
+    Тих, кого вже оцінила після останнього перерахунку, відсіюємо тут же.
+    """
+    stmt = select(Recommendation.candidate_id, Recommendation.score).where(
+        Recommendation.user_id == me.telegram_id,
+        Recommendation.criterion == criterion,
+        ~exists().where(
+            Choice.chooser_id == me.telegram_id,
+            Choice.chosen_id == Recommendation.candidate_id,
+        ),
+    )
+
+    ranked = criterion in RANKED_CRITERIA
+    if after is not None:
+        if ranked:
+            last_score, last_id = after
+            stmt = stmt.where(or_(
+                Recommendation.score < last_score,
+                and_(Recommendation.score == last_score, Recommendation.candidate_id > last_id),
+            ))
+        else:
+            stmt = stmt.where(Recommendation.candidate_id > after)
+
+    rows = session.execute(
+        stmt.order_by(Recommendation.score.desc(), Recommendation.candidate_id).limit(limit)
+    ).all()
+    if not rows:
+        return [], None
+
+    last = rows[-1]
+    cursor = [last.score, last.candidate_id] if ranked else last.candidate_id
+    return [row.candidate_id for row in rows], cursor
+
+
+# ==========================
+# ФОНОВИЙ ПЕРЕРАХУНОК
+# ==========================
+
+def _is_leader() -> bool:
+    """
+    Чи ця репліка рахує повний перерахунок (синхронно, з потоку).
+
+    Лідер — той, хто тримає сесійний pg_try_advisory_lock(_LEADER_LOCK) на
+    окремому зʼєднанні. Якщо лідер упав, Postgres відпускає лок разом
+    із його зʼєднанням, і на наступному колі його підхопить інша репліка.
+    """
+    global _leader_conn
+
+    if _leader_conn is not None:
+        try:
+            _leader_conn.exec_driver_sql("SELECT 1")
+            _leader_conn.commit()
+            return True
+        except Exception:
+            # Зʼєднання (а з ним і лок) втрачене — пробуємо взяти заново
+            _leader_conn.invalidate()
+            _leader_conn = None
+
+    conn = engine.connect()
+    if conn.scalar(select(func.pg_try_advisory_lock(_LEADER_LOCK))):
+        conn.commit()
+        _leader_conn = conn
+        return True
+    conn.close()
+    return False
+
+
+def _release_leadership() -> None:
+    global _leader_conn
+
+    conn, _leader_conn = _leader_conn, None
+    if conn is not None:
+        # invalidate закриває саме зʼєднання — разом з ним зникає і лок
+        # (звичайний close повернув би його в пул з локом)
+        conn.invalidate()
+
+
+async def _refresh_loop() -> None:
+    while True:
+        started = time.monotonic()
+        try:
+            if await asyncio.to_thread(_is_leader):
+                # Важкий set-based запит — в окремому потоці, щоб не блокувати event loop
+                total = await asyncio.to_thread(refresh_all)
+                print(f"✅ Recommendations перераховано: {total} рядків за {time.monotonic() - started:.1f} с")
+        except Exception as e:
+            print(f"⚠ Не вдалося перерахувати Recommendations: {e}")
+        await asyncio.sleep(RECOMMENDATIONS_REFRESH_INTERVAL)
+
+
+def start_recommendations_job() -> None:
+    """
+    Запускає періодичний перерахунок (перший — одразу), якщо
+    MATCHING_ENGINE=precomputed. Викликається на старті (bot_app.on_startup / main.main).
+    """
+    global _refresh_task
+
+    if MATCHING_ENGINE == "precomputed" and _refresh_task is None:
+        _refresh_task = asyncio.get_running_loop().create_task(_refresh_loop())
+
+
+def stop_recommendations_job() -> None:
+    global _refresh_task
+
+    task, _refresh_task = _refresh_task, None
+    if task is not None:
+        task.cancel()
+    _release_leadership()
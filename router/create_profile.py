@@ -10,8 +10,8 @@ from aiogram.types import (
 )
 
 from config import VALID_REGIONS, STATUS_OPTIONS, INTEREST_OPTIONS
-from database import SessionLocal
-from function import save_user_profile_from_state, render_bot_message
+from database import AsyncSessionLocal
+from function import save_user_profile_from_state, render_bot_message, render_bot_messages, send_replies
 from keyboard.reply import (
     location_type_kb,
     status_kb,
@@ -22,6 +22,7 @@ from keyboard.reply import (
     edit_menu_kb,
 )
 from state import ProfileStates, EditProfileStates
+import throttling
 
 router_state = Router()
 
@@ -56,18 +57,18 @@ async def process_name(message: Message, state: FSMContext):
     await state.update_data(name=name)
 
     # Дістаємо тексти з BotMessage згідно start.csv
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        # ROW 6: "Дуже приємно познайомитись 🌸 ..."
-        text_after_name = render_bot_message(session, "start_r6_c0", lang="uk")
-
-        # ROW 8: "Але перед цим я швиденько розповім тобі як я працюю..."
-        text_how_it_works = render_bot_message(session, "start_r8_c0", lang="uk")
-
+        # ROW 6:  "Дуже приємно познайомитись 🌸 ..."
+        # ROW 8:  "Але перед цим я швиденько розповім тобі як я працюю..."
         # ROW 10: "А тепер давай хутко заповнювати профіль... Напиши нікнейм..."
-        text_ask_nickname = render_bot_message(session, "start_r10_c0", lang="uk")
+        text_after_name, text_how_it_works, text_ask_nickname = await render_bot_messages(
+            session,
+            ["start_r6_c0", "start_r8_c0", "start_r10_c0"],
+            lang="uk",
+        )
     finally:
-        session.close()
+        await session.close()
 
     # 1️⃣ Відповідь після імені
     await message.answer(text_after_name, parse_mode="HTML")
@@ -100,11 +101,11 @@ async def process_nickname(message: Message, state: FSMContext):
     """
     await state.update_data(nickname=(message.text or "").strip())
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        text = render_bot_message(session, "profile_region_choose", lang="uk")
+        text = await render_bot_message(session, "profile_region_choose", lang="uk")
     finally:
-        session.close()
+        await session.close()
 
     await message.answer(
         text,
@@ -131,81 +132,62 @@ async def process_region(message: Message, state: FSMContext):
     data = await state.get_data()
     page = data.get("regions_page", 0)
 
-    session = SessionLocal()
-    try:
-        # 🔹 Пагінація: назад
-        if text == "⬅️ Назад":
-            page = max(page - 1, 0)
-            await state.update_data(regions_page=page)
-
-            msg_text = render_bot_message(session, "profile_region_choose", lang="uk")
-            await message.answer(
-                msg_text,
-                reply_markup=build_regions_kb(page),
-                parse_mode="HTML",
-            )
-            return
+    # (текст, клавіатура) — надсилаємо вже після закриття сесії
+    replies = []
 
-        # 🔹 Пагінація: вперед
-        if text == "Вперед ➡️":
-            max_page = math.ceil(len(VALID_REGIONS) / PAGE_SIZE) - 1
-            page = min(page + 1, max_page)
+    session = AsyncSessionLocal()
+    try:
+        # 🔹 Пагінація: назад / вперед
+        if text in ("⬅️ Назад", "Вперед ➡️"):
+            if text == "⬅️ Назад":
+                page = max(page - 1, 0)
+            else:
+                max_page = math.ceil(len(VALID_REGIONS) / PAGE_SIZE) - 1
+                page = min(page + 1, max_page)
             await state.update_data(regions_page=page)
 
-            msg_text = render_bot_message(session, "profile_region_choose", lang="uk")
-            await message.answer(
-                msg_text,
-                reply_markup=build_regions_kb(page),
-                parse_mode="HTML",
-            )
-            return
+            msg_text = await render_bot_message(session, "profile_region_choose", lang="uk")
+            replies.append((msg_text, build_regions_kb(page)))
 
         # 🔹 Скасувати
-        if text == "Скасувати":
-            msg_text = render_bot_message(session, "profile_region_cancelled", lang="uk")
+        elif text == "Скасувати":
+            msg_text = await render_bot_message(session, "profile_region_cancelled", lang="uk")
             await state.clear()
-            await message.answer(msg_text, parse_mode="HTML")
-            return
+            replies.append((msg_text, None))
 
         # 🔹 Вибір області з кнопок
-        if text not in VALID_REGIONS:
-            # Повідомлення про помилку
-            err_text = render_bot_message(session, "profile_region_not_found", lang="uk")
-            await message.answer(err_text, parse_mode="HTML")
-
-            # Повторно просимо обрати область
-            choose_text = render_bot_message(session, "profile_region_choose", lang="uk")
-            await message.answer(
-                choose_text,
-                reply_markup=build_regions_kb(page),
-                parse_mode="HTML",
+        elif text not in VALID_REGIONS:
+            # Повідомлення про помилку + повторно просимо обрати область
+            err_text, choose_text = await render_bot_messages(
+                session,
+                ["profile_region_not_found", "profile_region_choose"],
+                lang="uk",
             )
-            return
-
-        # ✅ Коректна область
-        region = text
-        await state.update_data(region=region)
+            replies.append((err_text, None))
+            replies.append((choose_text, build_regions_kb(page)))
 
-        # "Область: {region}"
-        region_text = render_bot_message(
-            session,
-            "profile_region_selected",
-            lang="uk",
-            region=region,
-        )
-        await message.answer(region_text, parse_mode="HTML")
+        else:
+            # ✅ Коректна область
+            region = text
+            await state.update_data(region=region)
 
-        # Запитуємо тип населеного пункту
-        ask_loc_type = render_bot_message(session, "profile_ask_location_type", lang="uk")
-        await message.answer(
-            ask_loc_type,
-            reply_markup=location_type_kb(),
-            parse_mode="HTML",
-        )
-        await state.set_state(ProfileStates.location_type)
+            # "Область: {region}" + запитуємо тип населеного пункту
+            region_text, ask_loc_type = await render_bot_messages(
+                session,
+                [
+                    ("profile_region_selected", {"region": region}),
+                    "profile_ask_location_type",
+                ],
+                lang="uk",
+            )
+            replies.append((region_text, None))
+            replies.append((ask_loc_type, location_type_kb()))
+            await state.set_state(ProfileStates.location_type)
 
     finally:
-        session.close()
+        await session.close()
+
+    await send_replies(message, replies)
 
 
 # ====================== 4. ТИП НАСЕЛЕНОГО ПУНКТУ ======================
@@ -220,52 +202,46 @@ async def process_location_type(message: Message, state: FSMContext):
     Якщо введено щось інше — просимо обрати з кнопок.
     """
     text = (message.text or "").strip().lower()
-    session = SessionLocal()
+    session = AsyncSessionLocal()
 
     try:
         if text == "місто":
             await state.update_data(location_type="city")
+            await state.set_state(ProfileStates.city)
 
-            msg_text = render_bot_message(session, "profile_ask_city", lang="uk")
-            await message.answer(
-                msg_text,
-                reply_markup=ReplyKeyboardMarkup(
-                    keyboard=[],
-                    resize_keyboard=True,
-                ),
-                parse_mode="HTML",
+            msg_text = await render_bot_message(session, "profile_ask_city", lang="uk")
+            reply_markup = ReplyKeyboardMarkup(
+                keyboard=[],
+                resize_keyboard=True,
             )
-            await state.set_state(ProfileStates.city)
 
         elif text == "село":
             await state.update_data(location_type="village")
+            await state.set_state(ProfileStates.village)
 
-            msg_text = render_bot_message(session, "profile_ask_village", lang="uk")
-            await message.answer(
-                msg_text,
-                reply_markup=ReplyKeyboardMarkup(
-                    keyboard=[],
-                    resize_keyboard=True,
-                ),
-                parse_mode="HTML",
+            msg_text = await render_bot_message(session, "profile_ask_village", lang="uk")
+            reply_markup = ReplyKeyboardMarkup(
+                keyboard=[],
+                resize_keyboard=True,
             )
-            await state.set_state(ProfileStates.village)
 
         else:
             # Некоректна відповідь — просимо обрати з кнопок
-            err_text = render_bot_message(
+            msg_text = await render_bot_message(
                 session,
                 "profile_location_type_invalid",
                 lang="uk",
             )
-            await message.answer(
-                err_text,
-                reply_markup=location_type_kb(),
-                parse_mode="HTML",
-            )
+            reply_markup = location_type_kb()
 
     finally:
-        session.close()
+        await session.close()
+
+    await message.answer(
+        msg_text,
+        reply_markup=reply_markup,
+        parse_mode="HTML",
+    )
 
 
 # ====================== 5. МІСТО ======================
@@ -277,11 +253,11 @@ async def process_city(message: Message, state: FSMContext):
     """
     await state.update_data(city=(message.text or "").strip(), village=None)
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        msg_text = render_bot_message(session, "profile_ask_age", lang="uk")
+        msg_text = await render_bot_message(session, "profile_ask_age", lang="uk")
     finally:
-        session.close()
+        await session.close()
 
     await message.answer(msg_text, parse_mode="HTML")
     await state.set_state(ProfileStates.age)
@@ -296,11 +272,11 @@ async def process_village(message: Message, state: FSMContext):
     """
     await state.update_data(village=(message.text or "").strip(), city=None)
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        msg_text = render_bot_message(session, "profile_ask_age", lang="uk")
+        msg_text = await render_bot_message(session, "profile_ask_age", lang="uk")
     finally:
-        session.close()
+        await session.close()
 
     await message.answer(msg_text, parse_mode="HTML")
     await state.set_state(ProfileStates.age)
@@ -314,41 +290,41 @@ async def process_age(message: Message, state: FSMContext):
     Обробка віку. Приймаємо лише числа в межах 14–60.
     """
     text = (message.text or "").strip()
-    session = SessionLocal()
+    session = AsyncSessionLocal()
 
     try:
         if not text.isdigit():
-            err_text = render_bot_message(
+            msg_text = await render_bot_message(
                 session,
                 "profile_age_not_digit",
                 lang="uk",
             )
-            await message.answer(err_text, parse_mode="HTML")
-            return
+            reply_markup = None
 
-        age = int(text)
-        if age < 14 or age > 60:
-            err_text = render_bot_message(
+        elif not 14 <= int(text) <= 60:
+            msg_text = await render_bot_message(
                 session,
                 "profile_age_out_of_range",
                 lang="uk",
             )
-            await message.answer(err_text, parse_mode="HTML")
-            return
+            reply_markup = None
 
-        await state.update_data(age=age)
+        else:
+            await state.update_data(age=int(text))
+            await state.set_state(ProfileStates.status)
 
-        # Питаємо статус
-        ask_status = render_bot_message(session, "profile_ask_status", lang="uk")
-        await message.answer(
-            ask_status,
-            reply_markup=status_kb(),
-            parse_mode="HTML",
-        )
-        await state.set_state(ProfileStates.status)
+            # Питаємо статус
+            msg_text = await render_bot_message(session, "profile_ask_status", lang="uk")
+            reply_markup = status_kb()
 
     finally:
-        session.close()
+        await session.close()
+
+    await message.answer(
+        msg_text,
+        reply_markup=reply_markup,
+        parse_mode="HTML",
+    )
 
 
 # ====================== 8. СТАТУС ======================
@@ -359,42 +335,40 @@ async def process_status(message: Message, state: FSMContext):
     Обробка статусу (мама, вагітна тощо).
     """
     status = (message.text or "").strip()
-    session = SessionLocal()
+    session = AsyncSessionLocal()
 
     try:
         if status not in STATUS_OPTIONS:
-            err_text = render_bot_message(
+            msg_text = await render_bot_message(
                 session,
                 "profile_status_invalid",
                 lang="uk",
             )
-            await message.answer(
-                err_text,
-                reply_markup=status_kb(),
-                parse_mode="HTML",
-            )
-            return
+            reply_markup = status_kb()
 
-        await state.update_data(status=status)
+        else:
+            await state.update_data(status=status)
+            await state.set_state(ProfileStates.interests)
 
-        # Переходимо до вибору інтересів
-        data = await state.get_data()
-        selected_interests = data.get("interests", [])
+            # Переходимо до вибору інтересів
+            data = await state.get_data()
+            selected_interests = data.get("interests", [])
 
-        ask_interests = render_bot_message(
-            session,
-            "profile_ask_interests",
-            lang="uk",
-        )
-        await message.answer(
-            ask_interests,
-            reply_markup=build_interests_kb(selected_interests),
-            parse_mode="HTML",
-        )
-        await state.set_state(ProfileStates.interests)
+            msg_text = await render_bot_message(
+                session,
+                "profile_ask_interests",
+                lang="uk",
+            )
+            reply_markup = build_interests_kb(selected_interests)
 
     finally:
-        session.close()
+        await session.close()
+
+    await message.answer(
+        msg_text,
+        reply_markup=reply_markup,
+        parse_mode="HTML",
+    )
 
 
 # ====================== 9. ІНТЕРЕСИ ======================
@@ -419,82 +393,61 @@ async def process_interests(message: Message, state: FSMContext):
     data = await state.get_data()
     selected = set(data.get("interests", []))
 
-    session = SessionLocal()
+    # (текст, клавіатура) — надсилаємо вже після закриття сесії
+    replies = []
+
+    session = AsyncSessionLocal()
 
     try:
-        # 🔹 Користувач натиснув "Готово"
-        if text == "Готово":
-            if not selected:
-                # Потрібно вибрати хоча б один інтерес
-                err_text = render_bot_message(
-                    session,
-                    "profile_interests_empty",
-                    lang="uk",
-                )
-                await message.answer(err_text, parse_mode="HTML")
-
-                ask_again = render_bot_message(
-                    session,
-                    "profile_interests_choose_again",
-                    lang="uk",
-                )
-                await message.answer(
-                    ask_again,
-                    reply_markup=build_interests_kb(list(selected)),
-                    parse_mode="HTML",
-                )
-                return
-
-            # Зберігаємо вибір і переходимо до BIO
-            await state.update_data(interests=list(selected))
+        # 🔹 Користувач натиснув "Готово", але нічого не вибрав
+        if text == "Готово" and not selected:
+            # Потрібно вибрати хоча б один інтерес
+            err_text, ask_again = await render_bot_messages(
+                session,
+                ["profile_interests_empty", "profile_interests_choose_again"],
+                lang="uk",
+            )
+            replies.append((err_text, None))
+            replies.append((ask_again, build_interests_kb(list(selected))))
 
-            ask_bio = render_bot_message(session, "profile_ask_bio", lang="uk")
-            await message.answer(ask_bio, parse_mode="HTML")
+        # 🔹 "Готово" — зберігаємо вибір і переходимо до BIO
+        elif text == "Готово":
+            await state.update_data(interests=list(selected))
             await state.set_state(ProfileStates.bio)
-            return
+
+            ask_bio = await render_bot_message(session, "profile_ask_bio", lang="uk")
+            replies.append((ask_bio, None))
 
         # 🔹 Натиснуто щось, що не є інтересом
-        if text not in INTEREST_OPTIONS:
-            err_text = render_bot_message(
+        elif text not in INTEREST_OPTIONS:
+            err_text, ask_again = await render_bot_messages(
                 session,
-                "profile_interests_invalid",
+                ["profile_interests_invalid", "profile_interests_choose_again"],
                 lang="uk",
             )
-            await message.answer(err_text, parse_mode="HTML")
-
-            ask_again = render_bot_message(
-                session,
-                "profile_interests_choose_again",
-                lang="uk",
-            )
-            await message.answer(
-                ask_again,
-                reply_markup=build_interests_kb(list(selected)),
-                parse_mode="HTML",
-            )
-            return
+            replies.append((err_text, None))
+            replies.append((ask_again, build_interests_kb(list(selected))))
 
         # 🔹 Тогл інтересу
-        if text in selected:
-            selected.remove(text)
         else:
-            selected.add(text)
+            if text in selected:
+                selected.remove(text)
+            else:
+                selected.add(text)
 
-        await state.update_data(interests=list(selected))
+            await state.update_data(interests=list(selected))
 
-        updated_text = render_bot_message(
-            session,
-            "profile_interests_updated",
-            lang="uk",
-        )
-        await message.answer(
-            updated_text,
-            reply_markup=build_interests_kb(list(selected)),
-            parse_mode="HTML",
-        )
+            updated_text = await render_bot_message(
+                session,
+                "profile_interests_updated",
+                lang="uk",
+            )
+            replies.append((updated_text, build_interests_kb(list(selected))))
 
     finally:
-        session.close()
+        await session.close()
+
+    await send_replies(message, replies)
 
 
 # ====================== 10. BIO ======================
@@ -528,7 +481,7 @@ async def process_bio(message: Message, state: FSMContext):
     interests_list = data.get("interests") or []
     interests = ", ".join(interests_list) if interests_list else "не вказано"
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
         # приклад шаблону в БД:
         # "Ось як виглядає твоя анкета:\n\n"
@@ -540,7 +493,7 @@ async def process_bio(message: Message, state: FSMContext):
         # "👶 Статус: {status}\n"
         # "🧩 Інтереси: {interests}\n"
         # "📜 BIO: {bio}"
-        text = render_bot_message(
+        text = await render_bot_message(
             session,
             "profile_summary",
             lang="uk",
@@ -554,7 +507,7 @@ async def process_bio(message: Message, state: FSMContext):
             bio=bio,
         )
     finally:
-        session.close()
+        await session.close()
 
     await message.answer(
         text,
@@ -580,35 +533,31 @@ async def confirm_yes(message: Message, state: FSMContext):
     telegram_id = message.from_user.id
     tg_username = message.from_user.username  # може бути None
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
         # Збереження профілю
-        save_user_profile_from_state(session, telegram_id, tg_username, data)
-
-        # Повідомлення про успішне збереження
-        text_saved = render_bot_message(
-            session,
-            "profile_confirm_saved",
-            lang="uk",
-        )
+        await save_user_profile_from_state(session, telegram_id, tg_username, data)
 
-        # Підказка з командами /view, /edit, /match
-        text_commands = render_bot_message(
+        # Повідомлення про успішне збереження +
+        # підказка з командами /view, /edit, /match
+        text_saved, text_commands = await render_bot_messages(
             session,
-            "profile_confirm_commands",
+            ["profile_confirm_saved", "profile_confirm_commands"],
             lang="uk",
         )
     finally:
-        session.close()
+        await session.close()
 
     await state.clear()
 
     await message.answer(text_saved, parse_mode="HTML")
-    await message.answer(
-        text_commands,
-        reply_markup=ReplyKeyboardRemove(),
-        parse_mode="HTML",
-    )
+    # Підказка з командами — низький пріоритет у черзі вихідних
+    with throttling.priority(throttling.PRIORITY_LOW):
+        await message.answer(
+            text_commands,
+            reply_markup=ReplyKeyboardRemove(),
+            parse_mode="HTML",
+        )
 
 
 # ====================== 12. ПІДТВЕРДЖЕННЯ (ЗМІНИТИ) ======================
@@ -625,19 +574,19 @@ async def confirm_no(message: Message, state: FSMContext):
     telegram_id = message.from_user.id
     tg_username = message.from_user.username
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
         # 1️⃣ Зберігаємо поточний профіль
-        save_user_profile_from_state(session, telegram_id, tg_username, data)
+        await save_user_profile_from_state(session, telegram_id, tg_username, data)
 
         # 2️⃣ Текст про збереження та перехід до редагування
-        text = render_bot_message(
+        text = await render_bot_message(
             session,
             "profile_confirm_change",
             lang="uk",
         )
     finally:
-        session.close()
+        await session.close()
 
     await message.answer(
         text,
@@ -5,8 +5,15 @@ from aiogram import Router, F
 from aiogram.types import Message, ReplyKeyboardMarkup, ReplyKeyboardRemove, CallbackQuery
 from aiogram.fsm.context import FSMContext
 
-from database import SessionLocal
-from function import get_user_by_telegram_id, send_edit_menu, render_bot_message
+from database import AsyncSessionLocal
+from function import (
+    get_user_by_telegram_id,
+    send_edit_menu,
+    render_bot_message,
+    render_bot_messages,
+    send_replies,
+    interests_to_mask,
+)
 from keyboard.reply import (
     status_kb,
     location_type_kb,
@@ -16,6 +23,7 @@ from keyboard.reply import (
     edit_menu_kb,
 )
 from state import EditProfileStates
+from matching_engine import on_profile_changed
 from config import VALID_REGIONS, STATUS_OPTIONS
 
 edit_router = Router()
@@ -28,13 +36,13 @@ async def edit_name_start(message: Message, state: FSMContext):
     """
     Початок редагування імені.
     """
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        text = render_bot_message(session, "edit_name_start", lang="uk")
+        text = await render_bot_message(session, "edit_name_start", lang="uk")
         # Приклад шаблону:
         # "Введи нове ім'я 🥰"
     finally:
-        session.close()
+        await session.close()
 
     await message.answer(text, parse_mode="HTML")
     await state.set_state(EditProfileStates.name)
@@ -45,12 +53,12 @@ async def edit_nickname_start(message: Message, state: FSMContext):
     """
     Початок редагування нікнейму.
     """
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        text = render_bot_message(session, "edit_nickname_start", lang="uk")
+        text = await render_bot_message(session, "edit_nickname_start", lang="uk")
         # "Введи новий нікнейм, який будуть бачити інші мами ✨"
     finally:
-        session.close()
+        await session.close()
 
     await message.answer(text, parse_mode="HTML")
     await state.set_state(EditProfileStates.nickname)
@@ -62,12 +70,12 @@ async def edit_location_start(message: Message, state: FSMContext):
     Початок редагування місця проживання.
     Перший крок — вибір області.
     """
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        text = render_bot_message(session, "edit_location_start", lang="uk")
+        text = await render_bot_message(session, "edit_location_start", lang="uk")
         # Наприклад: "Тепер обери свою область зі списку нижче:"
     finally:
-        session.close()
+        await session.close()
 
     await message.answer(
         text,
@@ -82,12 +90,12 @@ async def edit_age_start(message: Message, state: FSMContext):
     """
     Початок редагування віку.
     """
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        text = render_bot_message(session, "edit_age_start", lang="uk")
+        text = await render_bot_message(session, "edit_age_start", lang="uk")
         # "Напиши новий вік (лише число) 🎂"
     finally:
-        session.close()
+        await session.close()
 
     await message.answer(text, parse_mode="HTML")
     await state.set_state(EditProfileStates.age)
@@ -98,12 +106,12 @@ async def edit_status_start(message: Message, state: FSMContext):
     """
     Початок редагування статусу (мама / вагітна / інше).
     """
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        text = render_bot_message(session, "edit_status_start", lang="uk")
+        text = await render_bot_message(session, "edit_status_start", lang="uk")
         # "Обери свій новий статус 👶"
     finally:
-        session.close()
+        await session.close()
 
     await message.answer(
         text,
@@ -119,18 +127,18 @@ async def edit_interests_start(message: Message, state: FSMContext):
     Початок редагування інтересів.
     Підтягуємо поточні інтереси користувачки з БД.
     """
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        user = get_user_by_telegram_id(session, message.from_user.id)
+        user = await get_user_by_telegram_id(session, message.from_user.id)
         current_interests = user.interests or []
 
-        text = render_bot_message(session, "edit_interests_start", lang="uk")
+        text = await render_bot_message(session, "edit_interests_start", lang="uk")
         # Наприклад:
         # "Оновимо інтереси 🧩\n"
         # "Натискай на пункти, щоб додати / прибрати.\n"
         # "Коли закінчиш — натисни «Готово ✅»."
     finally:
-        session.close()
+        await session.close()
 
     await state.update_data(interests=current_interests)
 
@@ -147,12 +155,12 @@ async def edit_bio_start(message: Message, state: FSMContext):
     """
     Початок редагування BIO.
     """
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        text = render_bot_message(session, "edit_bio_start", lang="uk")
+        text = await render_bot_message(session, "edit_bio_start", lang="uk")
         # "Напиши новий BIO 📝\nТе, що будуть бачити інші мами:"
     finally:
-        session.close()
+        await session.close()
 
     await message.answer(text, parse_mode="HTML")
     await state.set_state(EditProfileStates.bio)
@@ -167,31 +175,28 @@ async def edit_menu_fallback(message: Message, state: FSMContext):
     - Інакше — просимо обрати пункт з меню.
     """
     text = (message.text or "").strip()
-    session = SessionLocal()
+    session = AsyncSessionLocal()
 
     try:
         # Якщо прийшла команда — виходимо з режиму редагування
         if text.startswith("/"):
             await state.clear()
-            msg = render_bot_message(session, "edit_menu_exit", lang="uk")
+            msg = await render_bot_message(session, "edit_menu_exit", lang="uk")
             # "Вийшла з режиму редагування ✅\nМожеш користуватися командами далі 🙂"
-            await message.answer(
-                msg,
-                reply_markup=ReplyKeyboardRemove(),
-                parse_mode="HTML",
-            )
-            return
-
-        # Будь-який інший текст — просимо обрати з меню
-        msg = render_bot_message(session, "edit_menu_invalid", lang="uk")
-        # "Будь ласка, обери, що хочеш змінити, з кнопок нижче ✏️"
-        await message.answer(
-            msg,
-            reply_markup=edit_menu_kb(),
-            parse_mode="HTML",
-        )
+            reply_markup = ReplyKeyboardRemove()
+        else:
+            # Будь-який інший текст — просимо обрати з меню
+            msg = await render_bot_message(session, "edit_menu_invalid", lang="uk")
+            # "Будь ласка, обери, що хочеш змінити, з кнопок нижче ✏️"
+            reply_markup = edit_menu_kb()
     finally:
-        session.close()
+        await session.close()
+
+    await message.answer(
+        msg,
+        reply_markup=reply_markup,
+        parse_mode="HTML",
+    )
 
 
 # ======================================================================
@@ -213,48 +218,44 @@ async def edit_name_save(message: Message, state: FSMContext):
     """
     new_name = (message.text or "").strip()
 
-    session = SessionLocal()
-    try:
-        # ❌ Порожній текст
-        if not new_name:
-            text = render_bot_message(session, "profile_name_empty", lang="uk")
-            await message.answer(text, parse_mode="HTML")
-            return
-
-        # ❌ Має містити хоча б одну літеру
-        if not re.search(r"[A-Za-zА-Яа-яЇїЄєІіҐґ]", new_name):
-            text = render_bot_message(session, "profile_name_no_letter", lang="uk")
-            await message.answer(text, parse_mode="HTML")
-            return
-
-        # ❌ Лише цифри
-        if new_name.isdigit():
-            text = render_bot_message(session, "profile_name_digits_only", lang="uk")
-            await message.answer(text, parse_mode="HTML")
-            return
-
-        # ❌ Занадто коротке
-        if len(new_name) < 2:
-            text = render_bot_message(session, "profile_name_too_short", lang="uk")
-            await message.answer(text, parse_mode="HTML")
-            return
-
-        # ✅ Зберігаємо в БД
-        user = get_user_by_telegram_id(session, message.from_user.id)
-        if user:
-            user.name = new_name
-            session.commit()
+    # ❌ Валідація — ключ тексту з поясненням, що не так
+    if not new_name:
+        err_key = "profile_name_empty"
+    elif not re.search(r"[A-Za-zА-Яа-яЇїЄєІіҐґ]", new_name):
+        # Має містити хоча б одну літеру
+        err_key = "profile_name_no_letter"
+    elif new_name.isdigit():
+        err_key = "profile_name_digits_only"
+    elif len(new_name) < 2:
+        err_key = "profile_name_too_short"
+    else:
+        err_key = None
 
-        # Повідомлення про успішне оновлення
-        success_text = render_bot_message(
-            session,
-            "edit_name_saved",
-            lang="uk",
-            name=new_name,
-        )
-        # Наприклад: "Ім'я оновлено на: {name} ✅"
+    session = AsyncSessionLocal()
+    try:
+        if err_key:
+            err_text = await render_bot_message(session, err_key, lang="uk")
+        else:
+            # ✅ Зберігаємо в БД
+            user = await get_user_by_telegram_id(session, message.from_user.id)
+            if user:
+                user.name = new_name
+                await session.commit()
+
+            # Повідомлення про успішне оновлення
+            success_text = await render_bot_message(
+                session,
+                "edit_name_saved",
+                lang="uk",
+                name=new_name,
+            )
+            # Наприклад: "Ім'я оновлено на: {name} ✅"
     finally:
-        session.close()
+        await session.close()
+
+    if err_key:
+        await message.answer(err_text, parse_mode="HTML")
+        return
 
     await message.answer(success_text, parse_mode="HTML")
     await state.set_state(EditProfileStates.menu)
@@ -270,14 +271,14 @@ async def edit_nickname_save(message: Message, state: FSMContext):
     """
     new_nickname = (message.text or "").strip()
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        user = get_user_by_telegram_id(session, message.from_user.id)
+        user = await get_user_by_telegram_id(session, message.from_user.id)
         if user:
             user.nickname = new_nickname
-            session.commit()
+            await session.commit()
 
-        success_text = render_bot_message(
+        success_text = await render_bot_message(
             session,
             "edit_nickname_saved",
             lang="uk",
@@ -285,7 +286,7 @@ async def edit_nickname_save(message: Message, state: FSMContext):
         )
         # "Нікнейм оновлено на: {nickname} ✅"
     finally:
-        session.close()
+        await session.close()
 
     await message.answer(success_text, parse_mode="HTML")
     await state.set_state(EditProfileStates.menu)
@@ -303,94 +304,65 @@ async def edit_region(message: Message, state: FSMContext):
     data = await state.get_data()
     page = data.get("regions_page", 0)
 
-    session = SessionLocal()
-    try:
-        # 🔹 Пагінація: назад
-        if text == "⬅️ Назад":
-            page = max(page - 1, 0)
-            await state.update_data(regions_page=page)
-
-            choose_text = render_bot_message(
-                session,
-                "profile_region_choose",
-                lang="uk",
-            )
-            await message.answer(
-                choose_text,
-                reply_markup=build_regions_kb(page),
-                parse_mode="HTML",
-            )
-            return
+    # (текст, клавіатура) — надсилаємо вже після закриття сесії
+    replies = []
 
-        # 🔹 Пагінація: вперед
-        if text == "Вперед ➡️":
-            max_page = math.ceil(len(VALID_REGIONS) / PAGE_SIZE) - 1
-            page = min(page + 1, max_page)
+    session = AsyncSessionLocal()
+    try:
+        # 🔹 Пагінація: назад / вперед
+        if text in ("⬅️ Назад", "Вперед ➡️"):
+            if text == "⬅️ Назад":
+                page = max(page - 1, 0)
+            else:
+                max_page = math.ceil(len(VALID_REGIONS) / PAGE_SIZE) - 1
+                page = min(page + 1, max_page)
             await state.update_data(regions_page=page)
 
-            choose_text = render_bot_message(
+            choose_text = await render_bot_message(
                 session,
                 "profile_region_choose",
                 lang="uk",
             )
-            await message.answer(
-                choose_text,
-                reply_markup=build_regions_kb(page),
-                parse_mode="HTML",
-            )
-            return
+            replies.append((choose_text, build_regions_kb(page)))
 
         # 🔹 Скасувати
-        if text == "Скасувати":
+        elif text == "Скасувати":
             await state.clear()
-            cancel_text = render_bot_message(
+            cancel_text = await render_bot_message(
                 session,
                 "edit_region_cancelled",
                 lang="uk",
             )
             # Наприклад: "Зміна місця проживання скасована 🙂"
-            await message.answer(cancel_text, parse_mode="HTML")
-            return
+            replies.append((cancel_text, None))
 
         # 🔹 Вибір області з кнопок
-        if text not in VALID_REGIONS:
-            err_text = render_bot_message(
+        elif text not in VALID_REGIONS:
+            err_text, choose_text = await render_bot_messages(
                 session,
-                "profile_region_not_found",
+                ["profile_region_not_found", "profile_region_choose"],
                 lang="uk",
             )
-            await message.answer(err_text, parse_mode="HTML")
+            replies.append((err_text, None))
+            replies.append((choose_text, build_regions_kb(page)))
 
-            choose_text = render_bot_message(
+        else:
+            # ✅ Коректна область — зберігаємо у стейт і переходимо до типу населеного пункту
+            region = text
+            await state.update_data(region=region)
+            await state.set_state(EditProfileStates.location_type)
+
+            ask_loc_type = await render_bot_message(
                 session,
-                "profile_region_choose",
+                "profile_ask_location_type",
                 lang="uk",
             )
-            await message.answer(
-                choose_text,
-                reply_markup=build_regions_kb(page),
-                parse_mode="HTML",
-            )
-            return
-
-        # ✅ Коректна область — зберігаємо у стейт і переходимо до типу населеного пункту
-        region = text
-        await state.update_data(region=region)
-
-        ask_loc_type = render_bot_message(
-            session,
-            "profile_ask_location_type",
-            lang="uk",
-        )
-        await message.answer(
-            ask_loc_type,
-            reply_markup=location_type_kb(),
-            parse_mode="HTML",
-        )
-        await state.set_state(EditProfileStates.location_type)
+            replies.append((ask_loc_type, location_type_kb()))
 
     finally:
-        session.close()
+        await session.close()
+
+    await send_replies(message, replies)
 
 
 # ---------- МІСЦЕ ПРОЖИВАННЯ (2/3 — ТИП: МІСТО / СЕЛО) ----------
@@ -401,51 +373,45 @@ async def edit_location_type(message: Message, state: FSMContext):
     Обираємо, чи живе мама в місті чи в селі.
     """
     text = (message.text or "").strip().lower()
-    session = SessionLocal()
+    session = AsyncSessionLocal()
 
     try:
         if text == "місто":
             await state.update_data(location_type="city")
+            await state.set_state(EditProfileStates.city)
 
-            msg = render_bot_message(session, "profile_ask_city", lang="uk")
-            await message.answer(
-                msg,
-                reply_markup=ReplyKeyboardMarkup(
-                    keyboard=[],
-                    resize_keyboard=True,
-                ),
-                parse_mode="HTML",
+            msg = await render_bot_message(session, "profile_ask_city", lang="uk")
+            reply_markup = ReplyKeyboardMarkup(
+                keyboard=[],
+                resize_keyboard=True,
             )
-            await state.set_state(EditProfileStates.city)
 
         elif text == "село":
             await state.update_data(location_type="village")
+            await state.set_state(EditProfileStates.village)
 
-            msg = render_bot_message(session, "profile_ask_village", lang="uk")
-            await message.answer(
-                msg,
-                reply_markup=ReplyKeyboardMarkup(
-                    keyboard=[],
-                    resize_keyboard=True,
-                ),
-                parse_mode="HTML",
+            msg = await render_bot_message(session, "profile_ask_village", lang="uk")
+            reply_markup = ReplyKeyboardMarkup(
+                keyboard=[],
+                resize_keyboard=True,
             )
-            await state.set_state(EditProfileStates.village)
 
         else:
-            err_text = render_bot_message(
+            msg = await render_bot_message(
                 session,
                 "profile_location_type_invalid",
                 lang="uk",
             )
-            await message.answer(
-                err_text,
-                reply_markup=location_type_kb(),
-                parse_mode="HTML",
-            )
+            reply_markup = location_type_kb()
 
     finally:
-        session.close()
+        await session.close()
+
+    await message.answer(
+        msg,
+        reply_markup=reply_markup,
+        parse_mode="HTML",
+    )
 
 
 # ---------- МІСЦЕ ПРОЖИВАННЯ (3/3 — ЗБЕРЕЖЕННЯ МІСТА) ----------
@@ -459,16 +425,17 @@ async def edit_city_save(message: Message, state: FSMContext):
     data = await state.get_data()
     region = data.get("region")
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        user = get_user_by_telegram_id(session, message.from_user.id)
+        user = await get_user_by_telegram_id(session, message.from_user.id)
         if user:
             user.region = region
             user.city = city
             user.village = None
-            session.commit()
+            await session.commit()
+            on_profile_changed(user)
 
-        success_text = render_bot_message(
+        success_text = await render_bot_message(
             session,
             "edit_city_saved",
             lang="uk",
@@ -477,7 +444,7 @@ async def edit_city_save(message: Message, state: FSMContext):
         )
         # "Місце проживання оновлено: {region}, місто {city} ✅"
     finally:
-        session.close()
+        await session.close()
 
     await message.answer(success_text, parse_mode="HTML")
     await state.set_state(EditProfileStates.menu)
@@ -495,16 +462,17 @@ async def edit_village_save(message: Message, state: FSMContext):
     data = await state.get_data()
     region = data.get("region")
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        user = get_user_by_telegram_id(session, message.from_user.id)
+        user = await get_user_by_telegram_id(session, message.from_user.id)
         if user:
             user.region = region
             user.village = village
             user.city = None
-            session.commit()
+            await session.commit()
+            on_profile_changed(user)
 
-        success_text = render_bot_message(
+        success_text = await render_bot_message(
             session,
             "edit_village_saved",
             lang="uk",
@@ -513,7 +481,7 @@ async def edit_village_save(message: Message, state: FSMContext):
         )
         # "Місце проживання оновлено: {region}, село {village} ✅"
     finally:
-        session.close()
+        await session.close()
 
     await message.answer(success_text, parse_mode="HTML")
     await state.set_state(EditProfileStates.menu)
@@ -528,43 +496,42 @@ async def edit_age_save(message: Message, state: FSMContext):
     Збереження нового віку (з перевірками, як при реєстрації).
     """
     text = (message.text or "").strip()
-    session = SessionLocal()
 
-    try:
-        if not text.isdigit():
-            err_text = render_bot_message(
-                session,
-                "profile_age_not_digit",
-                lang="uk",
-            )
-            await message.answer(err_text, parse_mode="HTML")
-            return
+    # ❌ Валідація — лише число в межах 14–60
+    if not text.isdigit():
+        err_key = "profile_age_not_digit"
+    elif not 14 <= int(text) <= 60:
+        err_key = "profile_age_out_of_range"
+    else:
+        err_key = None
 
-        age = int(text)
-        if age < 14 or age > 60:
-            err_text = render_bot_message(
+    session = AsyncSessionLocal()
+    try:
+        if err_key:
+            err_text = await render_bot_message(session, err_key, lang="uk")
+        else:
+            # Зберігаємо
+            age = int(text)
+            user = await get_user_by_telegram_id(session, message.from_user.id)
+            if user:
+                user.age = age
+                await session.commit()
+                # Вік є в колонковому зрізі in-memory рушія (ColumnarSnapshot.age)
+                on_profile_changed(user)
+
+            success_text = await render_bot_message(
                 session,
-                "profile_age_out_of_range",
+                "edit_age_saved",
                 lang="uk",
+                age=age,
             )
-            await message.answer(err_text, parse_mode="HTML")
-            return
-
-        # Зберігаємо
-        user = get_user_by_telegram_id(session, message.from_user.id)
-        if user:
-            user.age = age
-            session.commit()
-
-        success_text = render_bot_message(
-            session,
-            "edit_age_saved",
-            lang="uk",
-            age=age,
-        )
-        # "Вік оновлено на: {age} ✅"
+            # "Вік оновлено на: {age} ✅"
     finally:
-        session.close()
+        await session.close()
+
+    if err_key:
+        await message.answer(err_text, parse_mode="HTML")
+        return
 
     await message.answer(success_text, parse_mode="HTML")
     await state.set_state(EditProfileStates.menu)
@@ -579,36 +546,41 @@ async def edit_status_save(message: Message, state: FSMContext):
     Збереження нового статусу.
     """
     status = (message.text or "").strip()
-    session = SessionLocal()
+    session = AsyncSessionLocal()
 
     try:
         if status not in STATUS_OPTIONS:
-            err_text = render_bot_message(
+            err_text = await render_bot_message(
                 session,
                 "profile_status_invalid",
                 lang="uk",
             )
-            await message.answer(
-                err_text,
-                reply_markup=status_kb(),
-                parse_mode="HTML",
-            )
-            return
+        else:
+            err_text = None
 
-        user = get_user_by_telegram_id(session, message.from_user.id)
-        if user:
-            user.status = status
-            session.commit()
+            user = await get_user_by_telegram_id(session, message.from_user.id)
+            if user:
+                user.status = status
+                await session.commit()
+                on_profile_changed(user)
 
-        success_text = render_bot_message(
-            session,
-            "edit_status_saved",
-            lang="uk",
-            status=status,
-        )
-        # "Статус оновлено на: {status} ✅"
+            success_text = await render_bot_message(
+                session,
+                "edit_status_saved",
+                lang="uk",
+                status=status,
+            )
+            # "Статус оновлено на: {status} ✅"
     finally:
-        session.close()
+        await session.close()
+
+    if err_text:
+        await message.answer(
+            err_text,
+            reply_markup=status_kb(),
+            parse_mode="HTML",
+        )
+        return
 
     await message.answer(success_text, parse_mode="HTML")
     await state.set_state(EditProfileStates.menu)
@@ -651,31 +623,35 @@ async def edit_interests_done(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     selected = data.get("interests", [])
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
         if not selected:
             # alert-текст (plain, без HTML)
-            alert_text = render_bot_message(
+            alert_text = await render_bot_message(
                 session,
                 "profile_interests_empty",
                 lang="uk",
             )
-            await callback.answer(alert_text, show_alert=True)
-            return
-
-        user = get_user_by_telegram_id(session, callback.from_user.id)
-        if user:
-            user.interests = selected
-            session.commit()
-
-        success_text = render_bot_message(
-            session,
-            "edit_interests_saved",
-            lang="uk",
-        )
-        # "Інтереси оновлено ✅\nТепер я ще краще зможу підбирати мам за спільними темами 🧩"
+        else:
+            user = await get_user_by_telegram_id(session, callback.from_user.id)
+            if user:
+                user.interests = selected
+                user.interests_mask = interests_to_mask(selected)
+                await session.commit()
+                on_profile_changed(user)
+
+            success_text = await render_bot_message(
+                session,
+                "edit_interests_saved",
+                lang="uk",
+            )
+            # "Інтереси оновлено ✅\nТепер я ще краще зможу підбирати мам за спільними темами 🧩"
     finally:
-        session.close()
+        await session.close()
+
+    if not selected:
+        await callback.answer(alert_text, show_alert=True)
+        return
 
     await callback.message.answer(success_text, parse_mode="HTML")
 
@@ -693,21 +669,21 @@ async def edit_bio_save(message: Message, state: FSMContext):
     """
     new_bio = (message.text or "").strip()
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        user = get_user_by_telegram_id(session, message.from_user.id)
+        user = await get_user_by_telegram_id(session, message.from_user.id)
         if user:
             user.bio = new_bio
-            session.commit()
+            await session.commit()
 
-        success_text = render_bot_message(
+        success_text = await render_bot_message(
             session,
             "edit_bio_saved",
             lang="uk",
         )
         # "BIO оновлено ✅"
     finally:
-        session.close()
+        await session.close()
 
     await message.answer(success_text, parse_mode="HTML")
     await state.set_state(EditProfileStates.menu)
@@ -3,13 +3,20 @@ import math
 from aiogram import Router, F
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, ReplyKeyboardRemove
-from sqlalchemy.exc import IntegrityError
 
 from config import VALID_REGIONS
-from database import User, Choice, SessionLocal
-from function import notify_match, run_match_flow, render_bot_message
+from database import User, AsyncSessionLocal
+from function import (
+    record_choice,
+    run_match_flow,
+    render_bot_message,
+    render_bot_messages,
+    send_replies,
+)
 from keyboard.reply import location_type_kb, PAGE_SIZE, build_regions_kb
 from state import ProfileStates, MatchStates
+from matching_engine import on_choice_recorded
+from outbox import wake_outbox_worker
 
 router_hengler = Router()
 
@@ -23,7 +30,7 @@ async def match_by_location(message: Message, state: FSMContext):
     """
     Старт метчингу за місцем проживання.
     """
-    await run_match_flow(message, state, criterion="location")
+    await run_match_flow(message, state, criterion="location", fresh=True)
 
 
 @router_hengler.message(MatchStates.criteria, F.text == "📍Місце проживання + Інтереси 🧩")
@@ -31,7 +38,7 @@ async def match_by_location_interests(message: Message, state: FSMContext):
     """
     Старт метчингу за місцем проживання та спільними інтересами.
     """
-    await run_match_flow(message, state, criterion="location_interests")
+    await run_match_flow(message, state, criterion="location_interests", fresh=True)
 
 
 @router_hengler.message(MatchStates.criteria, F.text == "Інтереси 🧩")
@@ -39,7 +46,7 @@ async def match_by_interests(message: Message, state: FSMContext):
     """
     Старт метчингу тільки за спільними інтересами.
     """
-    await run_match_flow(message, state, criterion="interests")
+    await run_match_flow(message, state, criterion="interests", fresh=True)
 
 
 # ====================== ЛАЙК / ДИЗЛАЙК КАНДИДАТА ======================
@@ -51,9 +58,10 @@ async def match_like_message(message: Message, state: FSMContext):
 
     Логіка:
     1. Дістаємо з FSM поточного кандидата та критерій.
-    2. Зберігаємо лайк, якщо ще не збережений.
-    3. Перевіряємо, чи є взаємний лайк.
-       - якщо так → відправляємо обом повідомлення про метч (notify_match).
+    2. Одним запитом зберігаємо лайк (якщо ще не збережений)
+       і перевіряємо, чи є взаємний лайк (record_choice).
+       - якщо так → сповіщення обом уже записане в NotificationOutbox,
+         надсилає його воркер outbox.py.
        - якщо ні → просто повідомляємо, що лайк збережено.
     4. Автоматично показуємо наступного кандидата за тим самим критерієм.
     """
@@ -61,99 +69,55 @@ async def match_like_message(message: Message, state: FSMContext):
     candidate_id = data.get("current_candidate_id")
     criterion = data.get("current_criterion")
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
         # Якщо щось не так з кандидатом / станом
         if not candidate_id:
-            text_err = render_bot_message(
-                session,
-                "match_candidate_error",
-                lang="uk",
-            )
             # Наприклад: "Сталася помилка з кандидатом 😔"
-            await message.answer(text_err, parse_mode="HTML")
-            await state.clear()
-            return
-
-        me_id = message.from_user.id
+            key = "match_candidate_error"
+        else:
+            me_id = message.from_user.id
+
+            # Зберігаємо лайк і одразу дізнаємось, чи він взаємний — один запит
+            result = await record_choice(session, me_id, candidate_id, "LIKE")
+
+            # Більше не пропонуємо цю анкету (in-memory рушій пошуку)
+            on_choice_recorded(me_id, candidate_id)
+
+            if result == "mutual":
+                # Є взаємний лайк → перевіряємо, що обидві анкети на місці
+                user_me = await session.get(User, me_id)
+                user_other = await session.get(User, candidate_id)
+
+                if user_me and user_other:
+                    # Сповіщення обом уже в NotificationOutbox (тим самим запитом,
+                    # що й лайк) — лише будимо воркер, відповідь на "Лайк" не чекає Bot API
+                    wake_outbox_worker()
+                    # "Це взаємний лайк! 🎉"
+                    key = "match_mutual"
+                else:
+                    # "Метч, але щось пішло не так з профілями 🤔"
+                    key = "match_profiles_error"
+            elif result == "duplicate":
+                # Цю анкету вже оцінювали раніше (повторне натискання)
+                # "Цей лайк уже враховано 🙂"
+                key = "match_like_already_counted"
+            else:
+                # Просто зберегли лайк, але ще немає взаємного
+                # "Лайк збережено 💚"
+                key = "match_like_saved"
 
-        # Перевіряємо, чи вже є Choice для цієї пари
-        existing = (
-            session.query(Choice)
-            .filter(
-                Choice.chooser_id == me_id,
-                Choice.chosen_id == candidate_id,
-            )
-            .one_or_none()
-        )
+        text = await render_bot_message(session, key, lang="uk")
 
-        # Якщо ще не було вибору — зберігаємо лайк
-        if existing is None:
-            choice = Choice(
-                chooser_id=me_id,
-                chosen_id=candidate_id,
-                choice_type="LIKE",
-            )
-            session.add(choice)
-            session.commit()
-
-        # Перевіряємо взаємний лайк
-        mutual = (
-            session.query(Choice)
-            .filter(
-                Choice.chooser_id == candidate_id,
-                Choice.chosen_id == me_id,
-                Choice.choice_type == "LIKE",
-            )
-            .one_or_none()
-        )
+    finally:
+        # Закриваємо сесію перед відправкою повідомлень
+        await session.close()
 
-        if mutual:
-            # Є взаємний лайк → дістаємо обох користувачів
-            user_me = session.get(User, me_id)
-            user_other = session.get(User, candidate_id)
-
-            if user_me and user_other:
-                # Відправляємо обом красиве повідомлення про метч
-                await notify_match(message.bot, user_me, user_other)
-
-                text_mutual = render_bot_message(
-                    session,
-                    "match_mutual",
-                    lang="uk",
-                )
-                # "Це взаємний лайк! 🎉"
-                await message.answer(text_mutual, parse_mode="HTML")
-            else:
-                text_profiles_err = render_bot_message(
-                    session,
-                    "match_profiles_error",
-                    lang="uk",
-                )
-                # "Метч, але щось пішло не так з профілями 🤔"
-                await message.answer(text_profiles_err, parse_mode="HTML")
-        else:
-            # Просто зберегли лайк, але ще немає взаємного
-            text_saved = render_bot_message(
-                session,
-                "match_like_saved",
-                lang="uk",
-            )
-            # "Лайк збережено 💚"
-            await message.answer(text_saved, parse_mode="HTML")
+    await message.answer(text, parse_mode="HTML")
 
-    except IntegrityError:
-        # Якщо в БД стоїть унікальний індекс і лайк вже був
-        session.rollback()
-        text_exists = render_bot_message(
-            session,
-            "match_like_already_counted",
-            lang="uk",
-        )
-        # "Цей лайк уже враховано 🙂"
-        await message.answer(text_exists, parse_mode="HTML")
-    finally:
-        session.close()
+    if not candidate_id:
+        await state.clear()
+        return
 
     # 🔁 автоматично наступний кандидат за тим самим критерієм
     if criterion:
@@ -161,16 +125,16 @@ async def match_like_message(message: Message, state: FSMContext):
     else:
         # Немає критерію в стейті — завершуємо
         await state.clear()
-        session = SessionLocal()
+        session = AsyncSessionLocal()
         try:
-            text_again = render_bot_message(
+            text_again = await render_bot_message(
                 session,
                 "match_run_again",
                 lang="uk",
             )
             # "Щоб продовжити пошук, виконай /match ще раз 🙂"
         finally:
-            session.close()
+            await session.close()
 
         await message.answer(text_again, parse_mode="HTML")
 
@@ -186,68 +150,48 @@ async def match_dislike_message(message: Message, state: FSMContext):
     candidate_id = data.get("current_candidate_id")
     criterion = data.get("current_criterion")
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
         if not candidate_id:
-            text_err = render_bot_message(
-                session,
-                "match_candidate_error",
-                lang="uk",
-            )
-            await message.answer(text_err, parse_mode="HTML")
-            await state.clear()
-            return
+            key = "match_candidate_error"
+        else:
+            me_id = message.from_user.id
 
-        me_id = message.from_user.id
+            # Повторний дизлайк тихо ігноруємо (ON CONFLICT DO NOTHING)
+            await record_choice(session, me_id, candidate_id, "DISLIKE")
 
-        existing = (
-            session.query(Choice)
-            .filter(
-                Choice.chooser_id == me_id,
-                Choice.chosen_id == candidate_id,
-            )
-            .one_or_none()
-        )
+            # Більше не пропонуємо цю анкету (in-memory рушій пошуку)
+            on_choice_recorded(me_id, candidate_id)
 
-        # Якщо ще немає запису — додаємо DISLIKE
-        if existing is None:
-            choice = Choice(
-                chooser_id=me_id,
-                chosen_id=candidate_id,
-                choice_type="DISLIKE",
-            )
-            session.add(choice)
-            session.commit()
+            # "Дизлайк збережено 💔"
+            key = "match_dislike_saved"
 
-        text_saved = render_bot_message(
-            session,
-            "match_dislike_saved",
-            lang="uk",
-        )
-        # "Дизлайк збережено 💔"
-        await message.answer(text_saved, parse_mode="HTML")
+        text = await render_bot_message(session, key, lang="uk")
 
-    except IntegrityError:
-        session.rollback()
-        # Якщо хочеш, можна окреме повідомлення,
-        # але зазвичай повторний дизлайк можна тихо ігнорити.
     finally:
-        session.close()
+        # Закриваємо сесію перед відправкою повідомлень
+        await session.close()
+
+    await message.answer(text, parse_mode="HTML")
+
+    if not candidate_id:
+        await state.clear()
+        return
 
     # 🔁 автоматично наступний кандидат за тим самим критерієм
     if criterion:
         await run_match_flow(message, state, criterion=criterion)
     else:
         await state.clear()
-        session = SessionLocal()
+        session = AsyncSessionLocal()
         try:
-            text_again = render_bot_message(
+            text_again = await render_bot_message(
                 session,
                 "match_run_again",
                 lang="uk",
             )
         finally:
-            session.close()
+            await session.close()
 
         await message.answer(text_again, parse_mode="HTML")
 
@@ -259,9 +203,9 @@ async def match_stop_message(message: Message, state: FSMContext):
     """
     await state.clear()
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        text = render_bot_message(
+        text = await render_bot_message(
             session,
             "match_stop",
             lang="uk",
@@ -269,7 +213,7 @@ async def match_stop_message(message: Message, state: FSMContext):
         # Наприклад:
         # "Зупиняю пошук мам 🤚\nЯкщо захочеш продовжити — просто надішли /match 💕"
     finally:
-        session.close()
+        await session.close()
 
     await message.answer(
         text,
@@ -297,101 +241,65 @@ async def process_region(message: Message, state: FSMContext):
     data = await state.get_data()
     page = data.get("regions_page", 0)
 
-    session = SessionLocal()
-    try:
-        # пагінація назад
-        if text == "⬅️ Назад":
-            page = max(page - 1, 0)
-            await state.update_data(regions_page=page)
-
-            msg = render_bot_message(
-                session,
-                "profile_region_choose",
-                lang="uk",
-            )
-            await message.answer(
-                msg,
-                reply_markup=build_regions_kb(page),
-                parse_mode="HTML",
-            )
-            return
+    # (текст, клавіатура) — надсилаємо вже після закриття сесії
+    replies = []
 
-        # пагінація вперед
-        if text == "Вперед ➡️":
-            max_page = math.ceil(len(VALID_REGIONS) / PAGE_SIZE) - 1
-            page = min(page + 1, max_page)
+    session = AsyncSessionLocal()
+    try:
+        # пагінація назад / вперед
+        if text in ("⬅️ Назад", "Вперед ➡️"):
+            if text == "⬅️ Назад":
+                page = max(page - 1, 0)
+            else:
+                max_page = math.ceil(len(VALID_REGIONS) / PAGE_SIZE) - 1
+                page = min(page + 1, max_page)
             await state.update_data(regions_page=page)
 
-            msg = render_bot_message(
+            msg = await render_bot_message(
                 session,
                 "profile_region_choose",
                 lang="uk",
             )
-            await message.answer(
-                msg,
-                reply_markup=build_regions_kb(page),
-                parse_mode="HTML",
-            )
-            return
+            replies.append((msg, build_regions_kb(page)))
 
         # скасувати реєстрацію
-        if text == "Скасувати":
+        elif text == "Скасувати":
             await state.clear()
-            cancel_text = render_bot_message(
+            cancel_text = await render_bot_message(
                 session,
                 "profile_region_cancelled",
                 lang="uk",
             )
             # "Добре, реєстрацію скасовано. Якщо захочеш — почни знову через /start 🙂"
-            await message.answer(cancel_text, parse_mode="HTML")
-            return
+            replies.append((cancel_text, None))
 
         # вибір області
-        if text not in VALID_REGIONS:
-            err_text = render_bot_message(
+        elif text not in VALID_REGIONS:
+            err_text, choose_text = await render_bot_messages(
                 session,
-                "profile_region_not_found",
+                ["profile_region_not_found", "profile_region_choose"],
                 lang="uk",
             )
-            await message.answer(err_text, parse_mode="HTML")
+            replies.append((err_text, None))
+            replies.append((choose_text, build_regions_kb(page)))
 
-            choose_text = render_bot_message(
+        else:
+            # ✅ зберігаємо область у FSM
+            await state.update_data(region=text)
+            await state.set_state(ProfileStates.location_type)
+
+            # повідомлення про обрану область ("Область: {region}") + далі — місто/село
+            selected_text, ask_loc_type = await render_bot_messages(
                 session,
-                "profile_region_choose",
+                [
+                    ("profile_region_selected", {"region": text}),
+                    "profile_ask_location_type",
+                ],
                 lang="uk",
             )
-            await message.answer(
-                choose_text,
-                reply_markup=build_regions_kb(page),
-                parse_mode="HTML",
-            )
-            return
-
-        # ✅ зберігаємо область у FSM
-        await state.update_data(region=text)
-
-        # повідомлення про обрану область (опційно)
-        selected_text = render_bot_message(
-            session,
-            "profile_region_selected",
-            lang="uk",
-            region=text,
-        )
-        # "Область: {region}"
-        await message.answer(selected_text, parse_mode="HTML")
-
-        # далі — місто/село
-        ask_loc_type = render_bot_message(
-            session,
-            "profile_ask_location_type",
-            lang="uk",
-        )
+            replies.append((selected_text, None))
+            replies.append((ask_loc_type, location_type_kb()))
     finally:
-        session.close()
+        await session.close()
 
-    await message.answer(
-        ask_loc_type,
-        reply_markup=location_type_kb(),
-        parse_mode="HTML",
-    )
-    await state.set_state(ProfileStates.location_type)
+    await send_replies(message, replies)
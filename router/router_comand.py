@@ -1,17 +1,24 @@
-from aiogram import Router
+from aiogram import Router, F
 from aiogram.filters import CommandStart, Command
-from aiogram.types import Message
+from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 import asyncio
-from database import SessionLocal
+from database import AsyncSessionLocal
 from state import ProfileStates, EditProfileStates, MatchStates
 from function import (
     get_user_by_telegram_id,
     send_edit_menu,
     get_status_emoji,
     render_bot_message,
+    render_bot_messages,
+    run_match_flow,
+    find_matches_page,
+    profile_link,
+    contact_link,
 )
 from keyboard.reply import build_match_criteria_kb
+import throttling
+from keyboard.inline import build_matches_more_kb, parse_matches_cursor, MATCHES_MORE_PREFIX
 import html
 
 router_comand = Router()
@@ -33,34 +40,45 @@ async def process_start_command(message: Message, state: FSMContext):
     REGISTERED user (є в БД):
       1) Повідомлення з колонки REGISTERED (start_r2_c1)
     """
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        user = get_user_by_telegram_id(session, message.from_user.id)
+        user = await get_user_by_telegram_id(session, message.from_user.id)
 
-        # 🔹 Новий користувач
         if user is None:
-            # 1) Перше вітальне повідомлення
-            text_intro = render_bot_message(session, "start_r2_c0", lang="uk")
-            await message.answer(text_intro, parse_mode="HTML")
+            # Обидва тексти для нового користувача дістаємо одним запитом:
+            # вітання + представлення бота з "А як тебе звати?"
+            text_intro, text_ask_name = await render_bot_messages(
+                session,
+                ["start_r2_c0", "start_r4_c0"],
+                lang="uk",
+            )
+        else:
+            # Текст з колонки REGISTERED user → row2, col1
+            text_existing = await render_bot_message(session, "start_r2_c1", lang="uk")
 
-            # 2) Затримка 10 секунд (згідно CSV: "затримка 10 секунд")
-            await asyncio.sleep(10)
+            # Пише боту — отже, вже не блокує: знову отримуватиме розсилки
+            if user.blocked_at is not None:
+                user.blocked_at = None
+                await session.commit()
 
-            # 3) Друге повідомлення: представлення бота + "А як тебе звати?"
-            text_ask_name = render_bot_message(session, "start_r4_c0", lang="uk")
+    finally:
+        await session.close()
 
-            # 4) Ставимо стан "name" і задаємо питання
-            await state.set_state(ProfileStates.name)
-            await message.answer(text_ask_name, parse_mode="HTML")
+    # 🔹 Користувач уже є в базі
+    if user is not None:
+        await message.answer(text_existing, parse_mode="HTML")
+        return
 
-        # 🔹 Користувач уже є в базі
-        else:
-            # Текст з колонки REGISTERED user → row2, col1
-            text_existing = render_bot_message(session, "start_r2_c1", lang="uk")
-            await message.answer(text_existing, parse_mode="HTML")
+    # 🔹 Новий користувач
+    # 1) Перше вітальне повідомлення
+    await message.answer(text_intro, parse_mode="HTML")
 
-    finally:
-        session.close()
+    # 2) Затримка 10 секунд (згідно CSV: "затримка 10 секунд")
+    await asyncio.sleep(10)
+
+    # 3) Ставимо стан "name" і задаємо питання
+    await state.set_state(ProfileStates.name)
+    await message.answer(text_ask_name, parse_mode="HTML")
 
 # ====================== /help ======================
 
@@ -71,14 +89,14 @@ async def cmd_help(message: Message):
 
     Витягуємо з БД текст з описом доступних команд (BotMessage.key = "help_text").
     """
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
         # Приклад шаблону:
         # key="help_text"
         # text="📘 <b>Допомога — доступні команди</b>\n━━━━━━━━━━━━..."
-        text = render_bot_message(session, "help_text", lang="uk")
+        text = await render_bot_message(session, "help_text", lang="uk")
     finally:
-        session.close()
+        await session.close()
 
     await message.answer(text, parse_mode="HTML")
 
@@ -94,19 +112,21 @@ async def cmd_edit(message: Message, state: FSMContext):
       (BotMessage.key = "edit_user_not_found").
     - якщо користувач є → показуємо меню редагування (send_edit_menu).
     """
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        user = get_user_by_telegram_id(session, message.from_user.id)
+        user = await get_user_by_telegram_id(session, message.from_user.id)
 
         if user is None:
             # Текст при відсутності профілю
             # key="edit_user_not_found"
-            text = render_bot_message(session, "edit_user_not_found", lang="uk")
-            await message.answer(text, parse_mode="HTML")
-            return
+            text = await render_bot_message(session, "edit_user_not_found", lang="uk")
 
     finally:
-        session.close()
+        await session.close()
+
+    if user is None:
+        await message.answer(text, parse_mode="HTML")
+        return
 
     # Є користувач → показуємо меню редагування
     await state.set_state(EditProfileStates.menu)
@@ -125,94 +145,99 @@ async def cmd_view(message: Message, state: FSMContext):
       а також окремим повідомленням підказуємо про /edit та /match
       (BotMessage.key = "view_suggest_edit_match") з невеликою затримкою.
     """
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        user = get_user_by_telegram_id(session, message.from_user.id)
+        user = await get_user_by_telegram_id(session, message.from_user.id)
 
         if user is None:
             # Повідомлення, якщо профіль ще не створений
-            text = render_bot_message(session, "view_user_not_found", lang="uk")
-            await message.answer(text, parse_mode="HTML")
-            return
-
-        # -------- Нормалізація полів профілю --------
-        name = user.name or "не вказано"
-        nickname = user.nickname or "не вказано"
-        region = user.region or "не вказано"
-        age = str(user.age) if user.age is not None else "не вказано"
-        status = user.status or "не вказано"
-        bio = user.bio or "не вказано"
-
-        # Локація в одному рядку
-        city = user.city
-        village = user.village
-
-        if city and village:
-            location = f"🏙️ Місто: {city} / 🏘️ Село: {village}"
-        elif city:
-            location = f"🏙️ Місто: {city}"
-        elif village:
-            location = f"🏘️ Село: {village}"
+            text = await render_bot_message(session, "view_user_not_found", lang="uk")
         else:
-            location = "📌 Місце проживання: не вказано"
-
-        # Інтереси блоком (як було раніше — під шаблон {interests_block})
-        if user.interests:
-            interests_lines = "\n".join(
-                f"   • {html.escape(i)}" for i in user.interests
+            # -------- Нормалізація полів профілю --------
+            name = user.name or "не вказано"
+            nickname = user.nickname or "не вказано"
+            region = user.region or "не вказано"
+            age = str(user.age) if user.age is not None else "не вказано"
+            status = user.status or "не вказано"
+            bio = user.bio or "не вказано"
+
+            # Локація в одному рядку
+            city = user.city
+            village = user.village
+
+            if city and village:
+                location = f"🏙️ Місто: {city} / 🏘️ Село: {village}"
+            elif city:
+                location = f"🏙️ Місто: {city}"
+            elif village:
+                location = f"🏘️ Село: {village}"
+            else:
+                location = "📌 Місце проживання: не вказано"
+
+            # Інтереси блоком (як було раніше — під шаблон {interests_block})
+            if user.interests:
+                interests_lines = "\n".join(
+                    f"   • {html.escape(i)}" for i in user.interests
+                )
+                interests_block = f"\n{interests_lines}"
+            else:
+                interests_block = " не вказано"
+
+            status_emoji = get_status_emoji(user.status)
+
+            # Екрануємо текстові поля, щоб не зламати HTML
+            name_safe = html.escape(name)
+            nickname_safe = html.escape(nickname)
+            region_safe = html.escape(region)
+            location_safe = html.escape(location)
+            status_safe = html.escape(status)
+            bio_safe = html.escape(bio)
+
+            # -------- Картка профілю з BotMessage --------
+            # Приклад шаблону для key="view_profile_card":
+            #
+            # "{status_emoji} <b>Твій профіль</b>\n"
+            # "━━━━━━━━━━━━━━━━━━━━\n"
+            # "👩 Ім'я: {name}\n"
+            # "✨ Нікнейм: {nickname}\n"
+            # "📍 Область: {region}\n"
+            # "{location}\n"
+            # "🎂 Вік: {age}\n"
+            # "👶 Статус: {status}\n"
+            # "🧩 Інтереси:{interests_block}\n"
+            # "📜 BIO:\n{bio}\n"
+            # "━━━━━━━━━━━━━━━━━━━━"
+            #
+            # Друге повідомлення — пропозиція /edit та /match (view_suggest_edit_match).
+            # Обидва шаблони дістаємо одним запитом.
+            text_profile, text_followup = await render_bot_messages(
+                session,
+                [
+                    (
+                        "view_profile_card",
+                        {
+                            "status_emoji": status_emoji,
+                            "name": name_safe,
+                            "nickname": nickname_safe,
+                            "region": region_safe,
+                            "location": location_safe,  # 🔹 передаємо location
+                            "age": age,
+                            "status": status_safe,
+                            "interests_block": interests_block,
+                            "bio": bio_safe,
+                        },
+                    ),
+                    "view_suggest_edit_match",
+                ],
+                lang="uk",
             )
-            interests_block = f"\n{interests_lines}"
-        else:
-            interests_block = " не вказано"
-
-        status_emoji = get_status_emoji(user.status)
-
-        # Екрануємо текстові поля, щоб не зламати HTML
-        name_safe = html.escape(name)
-        nickname_safe = html.escape(nickname)
-        region_safe = html.escape(region)
-        location_safe = html.escape(location)
-        status_safe = html.escape(status)
-        bio_safe = html.escape(bio)
-
-        # -------- Картка профілю з BotMessage --------
-        # Приклад шаблону для key="view_profile_card":
-        #
-        # "{status_emoji} <b>Твій профіль</b>\n"
-        # "━━━━━━━━━━━━━━━━━━━━\n"
-        # "👩 Ім'я: {name}\n"
-        # "✨ Нікнейм: {nickname}\n"
-        # "📍 Область: {region}\n"
-        # "{location}\n"
-        # "🎂 Вік: {age}\n"
-        # "👶 Статус: {status}\n"
-        # "🧩 Інтереси:{interests_block}\n"
-        # "📜 BIO:\n{bio}\n"
-        # "━━━━━━━━━━━━━━━━━━━━"
-        text_profile = render_bot_message(
-            session,
-            "view_profile_card",
-            lang="uk",
-            status_emoji=status_emoji,
-            name=name_safe,
-            nickname=nickname_safe,
-            region=region_safe,
-            location=location_safe,         # 🔹 передаємо location
-            age=age,
-            status=status_safe,
-            interests_block=interests_block,
-            bio=bio_safe,
-        )
-
-        # Друге повідомлення з пропозицією /edit та /match
-        text_followup = render_bot_message(
-            session,
-            "view_suggest_edit_match",
-            lang="uk",
-        )
 
     finally:
-        session.close()
+        await session.close()
+
+    if user is None:
+        await message.answer(text, parse_mode="HTML")
+        return
 
     # Надсилаємо картку профілю
     await message.answer(text_profile, parse_mode="HTML")
@@ -220,8 +245,9 @@ async def cmd_view(message: Message, state: FSMContext):
     # Невелика затримка перед підказкою
     await asyncio.sleep(3)
 
-    # Надсилаємо фоллоу-ап із підказками
-    await message.answer(text_followup, parse_mode="HTML")
+    # Надсилаємо фоллоу-ап із підказками (низький пріоритет у черзі вихідних)
+    with throttling.priority(throttling.PRIORITY_LOW):
+        await message.answer(text_followup, parse_mode="HTML")
 
 
 # ====================== /match ======================
@@ -237,30 +263,32 @@ async def cmd_match(message: Message, state: FSMContext):
       текст (BotMessage.key = "match_choose_criteria").
     """
     me_id = message.from_user.id
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        me = get_user_by_telegram_id(session, me_id)
+        me = await get_user_by_telegram_id(session, me_id)
 
         if me is None:
             # Повідомлення, якщо користувача немає в базі.
             # Цей же ключ використовується в run_match_flow.
             # key="match_user_not_found"
-            text = render_bot_message(session, "match_user_not_found", lang="uk")
-            await message.answer(text, parse_mode="HTML")
-            return
-
-        # Є користувач → питаємо критерій пошуку
-        # Приклад шаблону:
-        # key="match_choose_criteria"
-        # text="Окей, давай підберемо тобі мам 🤝\nЗа яким критерієм хочеш шукати?"
-        text_criteria = render_bot_message(
-            session,
-            "match_choose_criteria",
-            lang="uk",
-        )
+            text = await render_bot_message(session, "match_user_not_found", lang="uk")
+        else:
+            # Є користувач → питаємо критерій пошуку
+            # Приклад шаблону:
+            # key="match_choose_criteria"
+            # text="Окей, давай підберемо тобі мам 🤝\nЗа яким критерієм хочеш шукати?"
+            text_criteria = await render_bot_message(
+                session,
+                "match_choose_criteria",
+                lang="uk",
+            )
 
     finally:
-        session.close()
+        await session.close()
+
+    if me is None:
+        await message.answer(text, parse_mode="HTML")
+        return
 
     await message.answer(
         text_criteria,
@@ -268,3 +296,120 @@ async def cmd_match(message: Message, state: FSMContext):
         parse_mode="HTML",
     )
     await state.set_state(MatchStates.criteria)
+
+
+# ====================== /likes ======================
+
+@router_comand.message(Command("likes"))
+async def cmd_likes(message: Message, state: FSMContext):
+    """
+    Обробка команди /likes ("хто мене лайкнув").
+
+    - якщо профілю немає → "match_user_not_found" (як у /match);
+    - якщо нових лайків немає → "likes_inbox_empty";
+    - інакше → показуємо кількість ("likes_inbox_header", {count}) і по черзі
+      анкети тих, хто лайкнув, з тими самими кнопками лайк/дизлайк, що й у /match.
+
+    Кількість береться з лічильника Users.unread_likes, а не COUNT(*) по Choices.
+    """
+    session = AsyncSessionLocal()
+    try:
+        me = await get_user_by_telegram_id(session, message.from_user.id)
+        unread = me.unread_likes if me is not None else 0
+
+        if me is None:
+            text = await render_bot_message(session, "match_user_not_found", lang="uk")
+        elif not unread:
+            # Наприклад: "Поки що нових лайків немає 💌\nСпробуй /match"
+            text = await render_bot_message(session, "likes_inbox_empty", lang="uk")
+        else:
+            # Наприклад: "💌 Тебе лайкнули мами: {count}\nПодивимось?"
+            text = await render_bot_message(
+                session,
+                "likes_inbox_header",
+                lang="uk",
+                count=unread,
+            )
+    finally:
+        await session.close()
+
+    await message.answer(text, parse_mode="HTML")
+
+    if unread:
+        await run_match_flow(message, state, criterion="likes", fresh=True)
+
+
+# ====================== /matches ======================
+
+async def _render_matches_page(me_id: int, after=None):
+    """
+    Текст сторінки метчів і кнопка "Ще" (або None, якщо це остання сторінка).
+
+    Сторінка — один запит по Matches (function.find_matches_page), усі рядки
+    списку рендеряться одним render_bot_messages.
+    """
+    session = AsyncSessionLocal()
+    try:
+        if await get_user_by_telegram_id(session, me_id) is None:
+            return await render_bot_message(session, "match_user_not_found", lang="uk"), None
+
+        matches, cursor = await find_matches_page(session, me_id, after=after)
+        if not matches:
+            # Наприклад: "Поки що метчів немає 🫶\nСпробуй /match"
+            key = "matches_list_empty" if after is None else "matches_list_end"
+            return await render_bot_message(session, key, lang="uk"), None
+
+        # Приклад шаблонів:
+        # key="matches_list_header", text="🫶 <b>Твої метчі</b>"
+        # key="matches_list_item",   text="👩 {mama} — {contact}"
+        header, *items = await render_bot_messages(
+            session,
+            ["matches_list_header"] + [
+                ("matches_list_item", {"mama": profile_link(u), "contact": contact_link(u)})
+                for u in matches
+            ],
+            lang="uk",
+        )
+    finally:
+        await session.close()
+
+    text = "\n".join([header, *items]) if after is None else "\n".join(items)
+    return text, (build_matches_more_kb(cursor) if cursor is not None else None)
+
+
+@router_comand.message(Command("matches"))
+async def cmd_matches(message: Message):
+    """
+    Обробка команди /matches — список взаємних лайків, спочатку нові.
+
+    Показуємо MATCHES_PAGE_SIZE метчів; якщо є ще — під списком кнопка
+    "Ще метчі", яка несе keyset-курсор наступної сторінки.
+    """
+    text, kb = await _render_matches_page(message.from_user.id)
+    await message.answer(
+        text,
+        reply_markup=kb,
+        parse_mode="HTML",
+        disable_web_page_preview=True,
+    )
+
+
+@router_comand.callback_query(F.data.startswith(MATCHES_MORE_PREFIX))
+async def matches_more(callback: CallbackQuery):
+    """
+    Кнопка "Ще метчі": наступна сторінка після курсора з callback_data.
+    """
+    text, kb = await _render_matches_page(
+        callback.from_user.id,
+        after=parse_matches_cursor(callback.data),
+    )
+
+    # Кнопку з попередньої сторінки прибираємо, щоб не гортати двічі
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await callback.message.answer(
+        text,
+        reply_markup=kb,
+        parse_mode="HTML",
+        disable_web_page_preview=True,
+    )
+    await callback.answer()
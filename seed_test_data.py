@@ -4,6 +4,7 @@ from sqlalchemy.orm import Session
 from database import SessionLocal
 from database import User  # або звідки в тебе імпортується User
 from config import INTEREST_OPTIONS, VALID_REGIONS, STATUS_OPTIONS
+from function import interests_to_mask
 
 
 def _pick_interests(base_interests: list[str], min_common=1, extra=1) -> list[str]:
@@ -103,6 +104,10 @@ def seed_test_profiles_for_user(me_telegram_id: int):
                 )
             )
 
+        # Маска інтересів — саме по ній іде метчинг за інтересами
+        for u in test_users:
+            u.interests_mask = interests_to_mask(u.interests)
+
         # Додаємо в БД
         for u in test_users:
             # на випадок, якщо вже запускали — не дублюємо по telegram_id
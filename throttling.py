@@ -0,0 +1,243 @@
+import asyncio
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from config import (
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_CHAT_INTERVAL,
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_SEND_RETRIES,
+    TELEGRAM_FLOOD_CHATS,
+    TELEGRAM_FLOOD_WINDOW,
+)
+
+
+# ==========================
+# ЧЕРГА ВИХІДНИХ ПОВІДОМЛЕНЬ (ЛІМІТИ TELEGRAM)
+# ==========================
+# Telegram дозволяє боту ~30 повідомлень/с загалом і ~1 повідомлення/с в один
+# чат (з невеликими сплесками); понад це — 429 (TelegramRetryAfter).
+#
+# OutboundQueueMiddleware вішається на bot.session (setup_outbound_queue), тож
+# через неї йде КОЖЕН виклик Bot API — message.answer, bot.send_message тощо
+# з усіх роутерів, без змін у хендлерах. Для методів, що шлють повідомлення в чат:
+#   1) чекаємо токен відра цього чату (TELEGRAM_CHAT_INTERVAL, TELEGRAM_CHAT_BURST);
+#   2) стаємо в спільну чергу за токеном глобального відра (TELEGRAM_GLOBAL_RATE),
+#      де вищий пріоритет обслуговується першим (PRIORITY_*);
+#   3) на 429 призупиняємо цей чат на retry_after і повторюємо
+#      (до TELEGRAM_SEND_RETRIES разів); усю відправку — лише якщо 429
+#      сиплються з багатьох чатів одразу (_is_global_flood).
+#
+# Пріоритет задається контекстом: with priority(PRIORITY_HIGH): ...
+
+PRIORITY_HIGH = 0     # повідомлення про метч
+PRIORITY_NORMAL = 1   # відповіді на дії користувачки (за замовчуванням)
+PRIORITY_LOW = 2      # підказки, розсилки
+
+_priority: ContextVar[int] = ContextVar("outbound_priority", default=PRIORITY_NORMAL)
+
+# Методи Bot API, які створюють / змінюють повідомлення в чаті
+_THROTTLED_PREFIXES = ("Send", "Forward", "Copy", "Edit")
+
+
+@contextmanager
+def priority(level: int):
+    """
+    Усі відправки всередині блоку (і в задачах, створених у ньому) —
+    з пріоритетом level.
+    """
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class _TokenBucket:
+    """
+    Відро токенів: rate токенів за секунду, не більше capacity за раз.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        # Під локом — щоб ті, хто чекає, отримували токени по черзі
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Telegram попросив зачекати — наступний токен не раніше, ніж за seconds.
+        """
+        self._refill()
+        self._tokens = min(self._tokens, 1 - seconds * self.rate)
+
+    def set_rate(self, rate: float, capacity: float) -> None:
+        """
+        Нова швидкість з цього моменту (уже накопичене рахуємо по старій).
+        """
+        self._refill()
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = min(self._tokens, capacity)
+
+    def is_idle(self) -> bool:
+        """
+        Відро повне і ніхто не чекає — його можна викинути.
+        """
+        self._refill()
+        return self._tokens >= self.capacity and not self._lock.locked()
+
+
+# ==========================
+# ГЛОБАЛЬНА ЧЕРГА З ПРІОРИТЕТАМИ
+# ==========================
+
+_global_bucket: _TokenBucket | None = None
+_global_rate = TELEGRAM_GLOBAL_RATE
+_queue: asyncio.PriorityQueue | None = None
+_dispatcher_task: asyncio.Task | None = None
+
+# Порядковий номер — FIFO всередині одного пріоритету
+_seq = itertools.count()
+
+# chat_id → відро цього чату
+_chat_buckets: dict[int | str, _TokenBucket] = {}
+
+# Коли _chat_buckets розростається — викидаємо відра неактивних чатів
+_CHAT_PRUNE_AT = 10_000
+
+# Останні 429: chat_id → коли прийшов (лише за TELEGRAM_FLOOD_WINDOW)
+_recent_429: dict[int | str, float] = {}
+
+
+async def _dispatch() -> None:
+    """
+    Видає глобальні токени тим, хто чекає в _queue, — найвищий пріоритет першим.
+
+    Спершу чекаємо токен і лише тоді беремо з черги, щоб заявка з вищим
+    пріоритетом, що прийшла під час очікування, не стояла за нижчою.
+    """
+    while True:
+        await _global_bucket.acquire()
+        while True:
+            _, _, granted = await _queue.get()
+            if not granted.done():  # відправника могли скасувати, поки чекав
+                granted.set_result(None)
+                break
+
+
+async def _global_turn(level: int) -> None:
+    """
+    Стає в глобальну чергу з пріоритетом level і чекає свого токена.
+    """
+    global _global_bucket, _queue, _dispatcher_task
+
+    # Створюємо ліниво — у робочому event loop
+    if _dispatcher_task is None or _dispatcher_task.done():
+        _global_bucket = _TokenBucket(_global_rate, _global_rate)
+        _queue = asyncio.PriorityQueue()
+        _dispatcher_task = asyncio.get_running_loop().create_task(_dispatch())
+
+    granted = asyncio.get_running_loop().create_future()
+    _queue.put_nowait((level, next(_seq), granted))
+    await granted
+
+
+def _is_global_flood(chat_id: int | str) -> bool:
+    """
+    Запамʼятовує 429 у чаті chat_id і каже, чи це вже глобальний ліміт:
+    за останні TELEGRAM_FLOOD_WINDOW сек 429 прийшли з TELEGRAM_FLOOD_CHATS
+    різних чатів. Один "гарячий" чат (розсилка, спамер) сюди не дотягує.
+    """
+    now = time.monotonic()
+    _recent_429[chat_id] = now
+    for stale in [c for c, at in _recent_429.items() if now - at > TELEGRAM_FLOOD_WINDOW]:
+        del _recent_429[stale]
+    return len(_recent_429) >= TELEGRAM_FLOOD_CHATS
+
+
+def _chat_bucket(chat_id: int | str) -> _TokenBucket:
+    bucket = _chat_buckets.get(chat_id)
+    if bucket is None:
+        if len(_chat_buckets) > _CHAT_PRUNE_AT:
+            for idle in [c for c, b in _chat_buckets.items() if b.is_idle()]:
+                del _chat_buckets[idle]
+        bucket = _chat_buckets[chat_id] = _TokenBucket(
+            1 / TELEGRAM_CHAT_INTERVAL, TELEGRAM_CHAT_BURST
+        )
+    return bucket
+
+
+class OutboundQueueMiddleware(BaseRequestMiddleware):
+    """
+    Request-middleware сесії бота: усі повідомлення в чати — через ліміти
+    та пріоритетну чергу вище. Інші методи (answerCallbackQuery, getMe, ...)
+    ідуть напряму.
+    """
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not type(method).__name__.startswith(_THROTTLED_PREFIXES):
+            return await make_request(bot, method)
+
+        chat_bucket = _chat_bucket(chat_id)
+        for attempt in range(TELEGRAM_SEND_RETRIES + 1):
+            await chat_bucket.acquire()
+            await _global_turn(_priority.get())
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == TELEGRAM_SEND_RETRIES:
+                    raise
+                chat_bucket.pause(e.retry_after)
+                if _is_global_flood(chat_id):
+                    print(f"⚠ Telegram 429 з багатьох чатів: уся відправка чекає {e.retry_after} с")
+                    _global_bucket.pause(e.retry_after)
+                else:
+                    print(f"⚠ Telegram 429 (chat {chat_id}): цей чат чекає {e.retry_after} с")
+
+
+def setup_outbound_queue(bot, rate: float = TELEGRAM_GLOBAL_RATE) -> None:
+    """
+    Підключає чергу до бота. Викликається одразу після створення Bot
+    (bot_app / main; broadcast.py — зі своїм rate).
+
+    rate — загальна швидкість відправки цього процесу, повідомлень/с.
+    """
+    global _global_rate
+
+    _global_rate = rate
+    bot.session.middleware(OutboundQueueMiddleware())
+
+
+def set_global_rate(rate: float) -> None:
+    """
+    Змінює загальну швидкість відправки процесу на льоту — поки йде
+    розсилка, бот віддає їй частину ліміту (broadcast.start_broadcast_watch).
+    """
+    global _global_rate
+
+    _global_rate = rate
+    if _global_bucket is not None:
+        _global_bucket.set_rate(rate, rate)